@@ -23,6 +23,9 @@ class Attendance(models.Model):
         db_table = 'attendance_attendance'
         unique_together = ['employee', 'date']
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['date'], name='attendance_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.employee.first_name} {self.employee.last_name} - {self.date}"
@@ -0,0 +1,537 @@
+# attendance/services.py
+import csv
+import zipfile
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q
+from django.db.models.functions import Upper
+from django.utils import timezone
+from django.utils.timezone import localtime, make_aware
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.exceptions import InvalidFileException
+
+from hr.models import Employee
+from leave.services import WorkingDayCalendar
+from .models import Attendance
+
+OFFICE_START_TIME = time(9, 30)
+
+# Worked-hour thresholds shared by every attendance screen
+LOP_HOURS = 2
+HALF_DAY_HOURS = 5
+
+
+class AttendanceReportService:
+    """Set-based helpers for the admin/HR attendance report"""
+
+    REPORT_STATUSES = ['Present', 'Half Day', 'LOP', 'Absent', 'Sunday']
+
+    @staticmethod
+    def get_employee_rows(employees):
+        """
+        Load the employee columns the report needs in one query,
+        ordered the same way the report has always been sorted (by full name)
+        """
+        rows = list(
+            employees.order_by('first_name', 'last_name').values(
+                'id', 'employee_id', 'first_name', 'last_name', 'location'
+            )
+        )
+        rows.sort(key=lambda e: f"{e['first_name']} {e['last_name']}".lower())
+        return rows
+
+    @staticmethod
+    def get_attendance_map(employee_ids, start_date, end_date):
+        """Fetch every attendance row for the given employees and range with a single query"""
+        if not employee_ids:
+            return {}
+        records = Attendance.objects.filter(
+            employee_id__in=employee_ids,
+            date__range=(start_date, end_date)
+        ).only(
+            'employee_id', 'date', 'check_in', 'check_out',
+            'checkin_address', 'checkout_address'
+        )
+        return {(att.employee_id, att.date): att for att in records}
+
+    @staticmethod
+    def get_status_counts(employee_ids, start_date, end_date):
+        """
+        Per-employee counts of attendance rows by report status, computed in SQL
+        Returns: {employee_pk: {'Present': n, 'Half Day': n, 'LOP': n, 'sunday': n, 'weekday': n, 'no_check_in': n}}
+        """
+        if not employee_ids:
+            return {}
+
+        worked = ExpressionWrapper(F('check_out') - F('check_in'), output_field=DurationField())
+        completed = Q(check_in__isnull=False, check_out__isnull=False)
+        lop_limit = timedelta(hours=LOP_HOURS)
+        half_day_limit = timedelta(hours=HALF_DAY_HOURS)
+
+        counts = Attendance.objects.filter(
+            employee_id__in=employee_ids,
+            date__range=(start_date, end_date)
+        ).annotate(worked=worked).values('employee_id').annotate(
+            present=Count('id', filter=completed & Q(worked__gte=half_day_limit)),
+            half_day=Count('id', filter=(
+                completed & Q(worked__gte=lop_limit, worked__lt=half_day_limit)
+            ) | Q(check_in__isnull=False, check_out__isnull=True)),
+            lop=Count('id', filter=completed & Q(worked__lt=lop_limit)),
+            sunday=Count('id', filter=Q(date__week_day=1)),
+            weekday=Count('id', filter=~Q(date__week_day=1)),
+            no_check_in=Count('id', filter=Q(check_in__isnull=True)),
+        )
+
+        return {
+            row['employee_id']: {
+                'Present': row['present'],
+                'Half Day': row['half_day'],
+                'LOP': row['lop'],
+                'sunday': row['sunday'],
+                'weekday': row['weekday'],
+                'no_check_in': row['no_check_in'],
+            }
+            for row in counts
+        }
+
+    @staticmethod
+    def build_record(emp, day, att):
+        """Build one report row (employee x day) exactly as the report template expects it"""
+        record = {
+            'employee_pk': emp['id'],
+            'employee_id': emp['employee_id'],
+            'employee_name': f"{emp['first_name']} {emp['last_name']}",
+            'branch': emp['location'],
+            'date': day,
+            'check_in': "—",
+            'check_out': "—",
+            'checkin_address': "—",
+            'checkout_address': "—",
+            'status': 'Absent',
+            'duration_display': '-',
+            'is_late': False,
+        }
+
+        if WorkingDayCalendar.is_weekly_off(day) and not att:
+            record['status'] = "Sunday"
+            return record
+
+        if not att:
+            return record
+
+        if att.check_in:
+            ci = localtime(att.check_in)
+            record['check_in'] = ci.strftime("%I:%M %p")
+            record['checkin_address'] = att.checkin_address or "Location not available"
+            if ci.time() > OFFICE_START_TIME:
+                record['is_late'] = True
+
+        if att.check_out:
+            co = localtime(att.check_out)
+            record['check_out'] = co.strftime("%I:%M %p")
+            record['checkout_address'] = att.checkout_address or "Location not available"
+
+        if att.check_in and att.check_out:
+            total_minutes = (att.check_out - att.check_in).total_seconds() / 60
+            worked_hours = total_minutes / 60
+
+            if worked_hours < LOP_HOURS:
+                record['status'] = "LOP"
+            elif worked_hours < HALF_DAY_HOURS:
+                record['status'] = "Half Day"
+            else:
+                record['status'] = "Present"
+
+            hours = int(total_minutes // 60)
+            minutes = int(total_minutes % 60)
+            record['duration_display'] = f"{hours}h {minutes}m"
+
+        elif att.check_in and not att.check_out:
+            # Check-in only = treat just like personal page
+            record['status'] = "Half Day"
+            record['duration_display'] = "In Progress"
+
+        return record
+
+
+class AttendanceReportRows:
+    """
+    Lazy employee x day grid for the attendance report.
+
+    Paginator only needs count() and slicing, so the grid is never materialised:
+    row counts per employee come from one aggregate query, and a page slice
+    fetches attendance only for the employees that fall on that page.
+    """
+
+    def __init__(self, employees, start_date, end_date, status_filter=''):
+        self.employees = AttendanceReportService.get_employee_rows(employees)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.status_filter = status_filter
+        self.days = [
+            start_date + timedelta(days=i)
+            for i in range((end_date - start_date).days + 1)
+        ]
+        self._offsets = None
+
+    def _row_counts(self):
+        if not self.status_filter:
+            return [len(self.days)] * len(self.employees)
+
+        if self.status_filter not in AttendanceReportService.REPORT_STATUSES:
+            return [0] * len(self.employees)
+
+        counts = AttendanceReportService.get_status_counts(
+            [emp['id'] for emp in self.employees], self.start_date, self.end_date
+        )
+        sundays = sum(1 for d in self.days if WorkingDayCalendar.is_weekly_off(d))
+        weekdays = len(self.days) - sundays
+
+        row_counts = []
+        for emp in self.employees:
+            emp_counts = counts.get(emp['id'])
+            if self.status_filter == 'Sunday':
+                n = sundays - (emp_counts['sunday'] if emp_counts else 0)
+            elif self.status_filter == 'Absent':
+                n = weekdays
+                if emp_counts:
+                    n = n - emp_counts['weekday'] + emp_counts['no_check_in']
+            else:
+                n = emp_counts[self.status_filter] if emp_counts else 0
+            row_counts.append(n)
+        return row_counts
+
+    @property
+    def offsets(self):
+        """Prefix sums of rows per employee: offsets[i] is the first row index of employee i"""
+        if self._offsets is None:
+            self._offsets = [0] + list(accumulate(self._row_counts()))
+        return self._offsets
+
+    def count(self):
+        return self.offsets[-1]
+
+    def __len__(self):
+        return self.count()
+
+    def _rows_for(self, employees):
+        attendance_map = AttendanceReportService.get_attendance_map(
+            [emp['id'] for emp in employees], self.start_date, self.end_date
+        )
+        for emp in employees:
+            for day in self.days:
+                record = AttendanceReportService.build_record(
+                    emp, day, attendance_map.get((emp['id'], day))
+                )
+                if self.status_filter and record['status'] != self.status_filter:
+                    continue
+                yield record
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+
+        start, stop, _ = key.indices(self.count())
+        if start >= stop:
+            return []
+
+        # Locate the employees whose rows overlap [start, stop)
+        first = bisect_right(self.offsets, start) - 1
+        last = bisect_right(self.offsets, stop - 1) - 1
+        skip = start - self.offsets[first]
+
+        rows = list(self._rows_for(self.employees[first:last + 1]))
+        return rows[skip:skip + (stop - start)]
+
+    def iter_chunks(self, employees_per_chunk=200):
+        """Yield report rows for the whole grid, one attendance query per chunk of employees"""
+        for i in range(0, len(self.employees), employees_per_chunk):
+            yield from self._rows_for(self.employees[i:i + employees_per_chunk])
+
+
+class AttendanceExportService:
+    """Streaming XLSX/CSV writers for the admin attendance report"""
+
+    HEADERS = [
+        "Employee ID", "Employee Name", "Branch",
+        "Date", "Check-In", "Check-Out", "Status", "Duration"
+    ]
+    # Fixed widths replace the old second pass over every cell to size columns
+    COLUMN_WIDTHS = [14, 28, 16, 15, 12, 12, 10, 13]
+
+    @staticmethod
+    def export_row(record):
+        return [
+            record['employee_id'],
+            record['employee_name'],
+            record['branch'],
+            record['date'].strftime("%b %d, %Y"),
+            record['check_in'],
+            record['check_out'],
+            record['status'],
+            record['duration_display'],
+        ]
+
+    @staticmethod
+    def iter_csv(records):
+        """Yield the report as CSV text, one line at a time"""
+        class Echo:
+            """File-like object whose write() just hands the line back"""
+            def write(self, value):
+                return value
+
+        writer = csv.writer(Echo())
+        yield writer.writerow(AttendanceExportService.HEADERS)
+        for record in records:
+            yield writer.writerow(AttendanceExportService.export_row(record))
+
+    @staticmethod
+    def write_xlsx(records, fileobj):
+        """
+        Write the report with an openpyxl write-only workbook.
+        Rows are flushed to disk as they are appended, so memory stays flat
+        regardless of how many employee-days are exported.
+        """
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("Attendance Report")
+
+        for index, width in enumerate(AttendanceExportService.COLUMN_WIDTHS, start=1):
+            ws.column_dimensions[get_column_letter(index)].width = width
+
+        header_font = Font(bold=True, color="FFFFFF")
+        header_fill = PatternFill("solid", fgColor="4472C4")
+        align_center = Alignment(horizontal="center", vertical="center")
+        thin = Side(style="thin")
+        border_style = Border(left=thin, right=thin, top=thin, bottom=thin)
+
+        def styled(value, header=False):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.alignment = align_center
+            cell.border = border_style
+            if header:
+                cell.font = header_font
+                cell.fill = header_fill
+            return cell
+
+        ws.append([styled(h, header=True) for h in AttendanceExportService.HEADERS])
+        for record in records:
+            ws.append([styled(v) for v in AttendanceExportService.export_row(record)])
+
+        wb.save(fileobj)
+
+
+class InvalidSpreadsheet(Exception):
+    """The uploaded attendance file could not be read as an Excel workbook"""
+
+
+class AttendanceImportService:
+    """Bulk importer for the admin attendance Excel upload"""
+
+    # What openpyxl raises for files that are not (or no longer) valid xlsx
+    # workbooks: not a zip, missing parts, or malformed sheet XML
+    PARSE_ERRORS = (InvalidFileException, zipfile.BadZipFile, KeyError, ValueError, SyntaxError, OSError)
+    EMPTY_VALUES = [None, "", "-", "—"]
+    TIME_FORMATS = ["%I:%M %p", "%I:%M%p", "%I %p", "%H:%M"]
+    CHUNK_SIZE = 500
+
+    @staticmethod
+    def parse_time(val):
+        if val in AttendanceImportService.EMPTY_VALUES:
+            return None
+        if isinstance(val, datetime):
+            return val.time()
+        if isinstance(val, time):
+            return val
+
+        val = str(val).strip().upper()
+        for fmt in AttendanceImportService.TIME_FORMATS:
+            try:
+                return datetime.strptime(val, fmt).time()
+            except ValueError:
+                pass
+        return None
+
+    @staticmethod
+    def parse_date(val):
+        if isinstance(val, datetime):
+            return val.date()
+        if isinstance(val, date):
+            return val
+        try:
+            return datetime.strptime(str(val).strip(), "%b %d, %Y").date()
+        except ValueError:
+            return None
+
+    @staticmethod
+    def read_rows(excel_file):
+        """
+        Yield (row_number, values) from the first sheet without loading the workbook into memory.
+        Raises InvalidSpreadsheet if the file cannot be parsed.
+        """
+        try:
+            wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+        except AttendanceImportService.PARSE_ERRORS as e:
+            raise InvalidSpreadsheet(str(e)) from e
+        try:
+            sheet = wb.active
+            rows = enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2)
+            while True:
+                # Sheet XML is parsed lazily, so a corrupt sheet only fails here
+                try:
+                    row_number, row = next(rows)
+                except StopIteration:
+                    return
+                except AttendanceImportService.PARSE_ERRORS as e:
+                    raise InvalidSpreadsheet(str(e)) from e
+                yield row_number, row
+        finally:
+            wb.close()
+
+    @staticmethod
+    def get_employee_map(employee_ids):
+        """Resolve spreadsheet employee IDs (case-insensitive) with a single query"""
+        keys = {eid.upper() for eid in employee_ids}
+        if not keys:
+            return {}
+        employees = Employee.objects.annotate(
+            employee_key=Upper('employee_id')
+        ).filter(employee_key__in=keys).values('id', 'employee_key', 'location')
+        return {emp['employee_key']: emp for emp in employees}
+
+    @staticmethod
+    def get_existing_map(employee_pks, dates):
+        """Load existing attendance for the affected (employee, date) pairs with a single query"""
+        if not employee_pks or not dates:
+            return {}
+        records = Attendance.objects.filter(
+            employee_id__in=employee_pks,
+            date__range=(min(dates), max(dates))
+        ).only('id', 'employee_id', 'date', 'check_in', 'check_out')
+        return {(att.employee_id, att.date): att for att in records}
+
+    @staticmethod
+    def import_rows(rows, current_branch='', dry_run=False):
+        """
+        Import attendance rows (Employee ID, Name, Branch, Date, Check-In, Check-Out, ...).
+
+        Returns a summary dict: inserted, updated, unchanged, rejected (list of
+        (row_number, reason)) and branch_mismatch (the offending location, if the
+        sheet contains employees outside current_branch - nothing is written then).
+        With dry_run=True the diff is computed but nothing is written. The rows
+        are written in a single transaction, so a failed import saves nothing.
+        """
+        summary = {
+            'inserted': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'rejected': [],
+            'branch_mismatch': None,
+        }
+
+        # Pass 1: parse every row in memory. Biometric exports repeat the same
+        # handful of dates and punch times, so each distinct cell value is parsed once.
+        date_cache = {}
+        time_cache = {}
+
+        def cached(cache, parser, val):
+            try:
+                return cache[val]
+            except KeyError:
+                cache[val] = result = parser(val)
+                return result
+            except TypeError:
+                return parser(val)
+
+        parsed = []
+        for row_number, row in rows:
+            if not row or not row[0]:
+                continue
+            row = tuple(row) + (None,) * (6 - len(row))
+            employee_id = str(row[0]).strip()
+            if not employee_id:
+                continue
+
+            date_obj = cached(date_cache, AttendanceImportService.parse_date, row[3])
+            if not date_obj:
+                summary['rejected'].append((row_number, f"{employee_id}: invalid date '{row[3]}'"))
+                continue
+
+            parsed.append((
+                row_number, employee_id, date_obj,
+                cached(time_cache, AttendanceImportService.parse_time, row[4]),
+                cached(time_cache, AttendanceImportService.parse_time, row[5]),
+            ))
+
+        employee_map = AttendanceImportService.get_employee_map(
+            {employee_id for _, employee_id, _, _, _ in parsed}
+        )
+
+        # Pass 2: validate and collapse duplicates (the last row for an employee/day wins)
+        incoming = {}
+        for row_number, employee_id, date_obj, in_time, out_time in parsed:
+            employee = employee_map.get(employee_id.upper())
+            if not employee:
+                summary['rejected'].append((row_number, f"{employee_id}: employee not found"))
+                continue
+
+            if current_branch and employee['location'] != current_branch:
+                summary['branch_mismatch'] = employee['location']
+                return summary
+
+            if not in_time:
+                summary['rejected'].append((row_number, f"{employee_id}: missing check-in time"))
+                continue
+
+            incoming[(employee['id'], date_obj)] = (
+                make_aware(datetime.combine(date_obj, in_time)),
+                make_aware(datetime.combine(date_obj, out_time)) if out_time else None,
+            )
+
+        existing_map = AttendanceImportService.get_existing_map(
+            {pk for pk, _ in incoming}, {day for _, day in incoming}
+        )
+
+        # Pass 3: diff against the database
+        to_create = []
+        to_update = []
+        now = timezone.now()
+        for (employee_pk, date_obj), (excel_in, excel_out) in incoming.items():
+            existing = existing_map.get((employee_pk, date_obj))
+            if existing is None:
+                to_create.append(Attendance(
+                    employee_id=employee_pk,
+                    date=date_obj,
+                    check_in=excel_in,
+                    check_out=excel_out
+                ))
+            elif existing.check_in == excel_in and existing.check_out == excel_out:
+                summary['unchanged'] += 1
+            else:
+                existing.check_in = excel_in
+                existing.check_out = excel_out
+                existing.updated_at = now
+                to_update.append(existing)
+
+        summary['rejected'].sort()
+        summary['inserted'] = len(to_create)
+        summary['updated'] = len(to_update)
+
+        if dry_run:
+            return summary
+
+        size = AttendanceImportService.CHUNK_SIZE
+        with transaction.atomic():
+            for i in range(0, len(to_create), size):
+                Attendance.objects.bulk_create(to_create[i:i + size])
+            for i in range(0, len(to_update), size):
+                Attendance.objects.bulk_update(
+                    to_update[i:i + size], ['check_in', 'check_out', 'updated_at']
+                )
+
+        return summary
@@ -3,19 +3,27 @@ from django.contrib import messages
 from django.utils import timezone
 from django.utils.timezone import localtime
 from django.core.paginator import Paginator
+from django.db import DatabaseError
 from django.db.models import Q
 from .models import Attendance
+from .services import AttendanceReportRows, AttendanceExportService, AttendanceImportService, InvalidSpreadsheet
+from hr.utils import get_current_employee
 from hr.models import Employee
-from django.http import HttpResponse
+from leave.services import WorkingDayCalendar
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
 from datetime import datetime, date, time, timedelta
 from calendar import monthrange
 import pandas as pd
 from django.utils.timezone import make_aware
 import hashlib
+import tempfile
 from django.urls import reverse
 SAFE_TIME = make_aware(datetime(1970, 1, 1, 0, 0))
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 # -------------------------------
@@ -169,14 +177,7 @@ def all_attendance(request):
                 else:
                     record.day_status = "Present"
 
-                weekday = record.date.weekday()
-                if weekday == 5:
-                    if employee.location.strip().lower() == 'Bhubaneswar':
-                       standard_hours = 6  
-                    else:
-                       standard_hours = 4  
-                else:
-                    standard_hours = 9
+                standard_hours = WorkingDayCalendar.standard_hours(employee.location, record.date)
 
                 extra_minutes = int((worked_hours - standard_hours) * 60)
 
@@ -242,7 +243,7 @@ def all_attendance(request):
             # full_attendance_list.append(fake_record)
             
             # ✅ Sunday logic
-            if d.weekday() == 6:   # Sunday
+            if WorkingDayCalendar.is_weekly_off(d):
                 fake_record.day_status = "Sunday"
             else:
                 fake_record.day_status = "Absent"
@@ -283,7 +284,6 @@ def attendance_report(request):
     status_filter = request.GET.get('status_filter', '')
 
     today = date.today()
-    office_start_time = time(9, 30)
 
     try:
         start_date = datetime.strptime(date_from, '%d/%m/%Y').date() if date_from else today
@@ -301,7 +301,8 @@ def attendance_report(request):
         end_date = start_date
     # ✅ Get current user details
     user_role = request.session.get('user_role')
-    user_email = request.session.get('user_email')
+
+    current_branch_manager = None
 
     # ✅ Employees - Role-based filtering
     if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
@@ -312,7 +313,7 @@ def attendance_report(request):
     elif user_role == 'BRANCH MANAGER':
         try:
             # Get the current branch manager's employee record
-            current_branch_manager = Employee.objects.get(email=user_email)
+            current_branch_manager = get_current_employee(request)
             
             # Get the branch manager's location
             branch_manager_location = current_branch_manager.location
@@ -320,7 +321,7 @@ def attendance_report(request):
             if branch_manager_location:
                 # Show all employees with the same location
                 employees = Employee.objects.filter(
-                    location__iexact=branch_manager_location
+                    current_branch_manager.branch_lookup()
                 ).order_by('first_name', 'last_name')
                 filter_info = f"Showing employees from {branch_manager_location} location"
             else:
@@ -341,12 +342,8 @@ def attendance_report(request):
 
     # ✅ For BRANCH MANAGER, always filter by their location regardless of branch filter
     elif user_role == 'BRANCH MANAGER':
-        try:
-            current_branch_manager = Employee.objects.get(email=user_email)
-            if current_branch_manager.location:
-                employees = employees.filter(location__iexact=current_branch_manager.location)
-        except Employee.DoesNotExist:
-            pass
+        if current_branch_manager and current_branch_manager.location:
+            employees = employees.filter(current_branch_manager.branch_lookup())
 
     if search_query:
         names = search_query.strip().split()
@@ -364,79 +361,9 @@ def attendance_report(request):
                 | Q(employee_id__icontains=search_query)
             )
 
-    all_dates = [
-        start_date + timedelta(days=i)
-        for i in range((end_date - start_date).days + 1)
-    ]
-
-    attendance_data = []
-
-    for emp in employees:
-        for day in all_dates:
-            att = Attendance.objects.filter(employee=emp, date=day).first()
-
-            record = {
-                'employee_pk': emp.id,
-                'employee_id': emp.employee_id,
-                'employee_name': f"{emp.first_name} {emp.last_name}",
-                'branch': getattr(emp, 'location', '—'),
-                'date': day,
-                'check_in': "—",
-                'check_out': "—",
-                'checkin_address': "—",
-                'checkout_address': "—",
-                'status': 'Absent',
-                'duration_display': '-',
-                'is_late': False,
-            }
-            
-            if day.weekday() == 6 and not att:
-                record['status'] = "Sunday"
-                attendance_data.append(record)
-                continue
-            
-            if att:
-                if att.check_in:
-                    ci = localtime(att.check_in)
-                    record['check_in'] = ci.strftime("%I:%M %p")
-                    record['checkin_address'] = att.checkin_address or "Location not available"
-                    if ci.time() > office_start_time:
-                        record['is_late'] = True
-
-                if att.check_out:
-                    co = localtime(att.check_out)
-                    record['check_out'] = co.strftime("%I:%M %p")
-                    record['checkout_address'] = att.checkout_address or "Location not available"
-
-                #  UPDATED HALF-DAY / LOP LOGIC
-                if att.check_in and att.check_out:
-                    diff = att.check_out - att.check_in
-                    total_minutes = diff.total_seconds() / 60
-                    worked_hours = total_minutes / 60
-
-                    if worked_hours < 2:
-                        record['status'] = "LOP"
-                    elif worked_hours < 5:
-                        record['status'] = "Half Day"
-                    else:
-                        record['status'] = "Present"
-
-                    hours = int(total_minutes // 60)
-                    minutes = int(total_minutes % 60)
-                    record['duration_display'] = f"{hours}h {minutes}m"
-
-                elif att.check_in and not att.check_out:
-                    # Check-in only = treat just like personal page
-                    record['status'] = "Half Day"
-
-                    record['duration_display'] = "In Progress"
-
-            attendance_data.append(record)
-
-    if status_filter:
-        attendance_data = [a for a in attendance_data if a['status'] == status_filter]
-
-    attendance_data.sort(key=lambda x: x['employee_name'].lower())
+    # Rows are built lazily: counting uses one aggregate query and each page
+    # only loads attendance for the employees that appear on it
+    attendance_data = AttendanceReportRows(employees, start_date, end_date, status_filter)
     paginator = Paginator(attendance_data, 20)
     page = request.GET.get('page')
     attendance_records = paginator.get_page(page)
@@ -445,13 +372,9 @@ def attendance_report(request):
     if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
         branches = list(Employee.objects.values_list('location', flat=True).distinct())
     elif user_role == 'BRANCH MANAGER':
-        try:
-            current_branch_manager = Employee.objects.get(email=user_email)
-            if current_branch_manager.location:
-                branches = [current_branch_manager.location]
-            else:
-                branches = []
-        except Employee.DoesNotExist:
+        if current_branch_manager and current_branch_manager.location:
+            branches = [current_branch_manager.location]
+        else:
             branches = []
     else:
         branches = []
@@ -472,16 +395,16 @@ def attendance_report(request):
 @login_required
 @role_required(['ADMIN', 'HR', 'SUPER ADMIN'])
 def download_admin_attendance_report(request):
-    """Download Excel with exactly the same filtered data shown in the dashboard."""
+    """Download Excel (or CSV with ?format=csv) with exactly the same filtered data shown in the dashboard."""
     search_query = request.GET.get('search', '')
     branch = request.GET.get('branch', '')
     department = request.GET.get('department', '')
     date_from = request.GET.get('date_from', '')
     date_to = request.GET.get('date_to', '')
     status_filter = request.GET.get('status_filter', '')
+    export_format = request.GET.get('format', 'xlsx').lower()
 
     today = date.today()
-    office_start_time = time(9, 30)
 
     # Parse date range
     try:
@@ -506,7 +429,8 @@ def download_admin_attendance_report(request):
 
       # ✅ Get current user details for role-based filtering
     user_role = request.session.get('user_role')
-    user_email = request.session.get('user_email')
+
+    current_branch_manager = None
 
     # ✅ Employees - Role-based filtering (same as attendance_report)
     if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
@@ -514,12 +438,12 @@ def download_admin_attendance_report(request):
     
     elif user_role == 'BRANCH MANAGER':
         try:
-            current_branch_manager = Employee.objects.get(email=user_email)
+            current_branch_manager = get_current_employee(request)
             branch_manager_location = current_branch_manager.location
             
             if branch_manager_location:
                 employees = Employee.objects.filter(
-                    location__iexact=branch_manager_location
+                    current_branch_manager.branch_lookup()
                 ).order_by('first_name', 'last_name')
             else:
                 employees = Employee.objects.none()
@@ -539,12 +463,8 @@ def download_admin_attendance_report(request):
 
     # ✅ For BRANCH MANAGER, always filter by their location
     elif user_role == 'BRANCH MANAGER':
-        try:
-            current_branch_manager = Employee.objects.get(email=user_email)
-            if current_branch_manager.location:
-                employees = employees.filter(location__iexact=current_branch_manager.location)
-        except Employee.DoesNotExist:
-            pass
+        if current_branch_manager and current_branch_manager.location:
+            employees = employees.filter(current_branch_manager.branch_lookup())
 
     # ==============================
     # FIXED SEARCH FILTER (Copied from dashboard)
@@ -570,78 +490,9 @@ def download_admin_attendance_report(request):
 
     # ==============================
 
-    all_dates = [
-        start_date + timedelta(days=i)
-        for i in range((end_date - start_date).days + 1)
-    ]
-
-    attendance_data = []
-
-    for emp in employees:
-        for day in all_dates:
-            att = Attendance.objects.filter(employee=emp, date=day).first()
-
-            record = {
-                'employee_id': emp.employee_id,
-                'employee_name': f"{emp.first_name} {emp.last_name}",
-                'branch': getattr(emp, 'location', '—'),
-                'date': day.strftime("%b %d, %Y"),
-                'check_in': "—",
-                'check_out': "—",
-                'status': 'Absent',
-                'duration_display': '-'
-            }
-            
-            
-            #  SUNDAY LOGIC (NO RECORD)
-            # ---------------------------
-            if day.weekday() == 6 and not att:
-                record['status'] = "Sunday"
-                attendance_data.append(record)
-                continue
-            
-            if att:
-                # Set time values
-                if att.check_in:
-                    record['check_in'] = localtime(att.check_in).strftime("%I:%M %p")
-                if att.check_out:
-                    record['check_out'] = localtime(att.check_out).strftime("%I:%M %p")
-
-                # ⭐⭐⭐ UPDATED STATUS LOGIC (MATCH PAGE EXACTLY) ⭐⭐⭐
-                if att.check_in and att.check_out:
-                    diff = att.check_out - att.check_in
-                    total_minutes = diff.total_seconds() / 60
-                    worked_hours = total_minutes / 60
-
-                    if worked_hours < 2:
-                        record['status'] = "LOP"
-                    elif worked_hours < 5:
-                        record['status'] = "Half Day"
-                    else:
-                        record['status'] = "Present"
-
-                    # Duration
-                    hours = int(total_minutes // 60)
-                    minutes = int(total_minutes % 60)
-                    record['duration_display'] = f"{hours}h {minutes}m"
-
-                elif att.check_in and not att.check_out:
-                    record['status'] = "Half Day"
-                    record['duration_display'] = "In Progress"
-
-                else:
-                    record['status'] = "Absent"
-                    record['duration_display'] = "-"
-
-            attendance_data.append(record)
-
-    # Filters
-    if status_filter:
-        attendance_data = [a for a in attendance_data if a['status'] == status_filter]
-
-    attendance_data.sort(key=lambda x: x['employee_name'].lower())
+    attendance_data = AttendanceReportRows(employees, start_date, end_date, status_filter)
 
-    if not attendance_data:
+    if not attendance_data.count():
         response = HttpResponse(
             "No attendance data found for the selected date range and filters.",
             content_type="text/plain"
@@ -649,64 +500,32 @@ def download_admin_attendance_report(request):
         response['Content-Disposition'] = 'attachment; filename=\"Empty_Attendance_Report.txt\"'
         return response
 
-    # Create Excel
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Attendance Report"
-
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill("solid", fgColor="4472C4")
-    align_center = Alignment(horizontal="center", vertical="center")
-    border_style = Border(
-        left=Side(style="thin"),
-        right=Side(style="thin"),
-        top=Side(style="thin"),
-        bottom=Side(style="thin")
-    )
-
-    headers = [
-        "Employee ID", "Employee Name", "Branch",
-        "Date", "Check-In", "Check-Out", "Status", "Duration"
-    ]
-    ws.append(headers)
-
-    for cell in ws[1]:
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = align_center
-        cell.border = border_style
-
-    for record in attendance_data:
-        ws.append([
-            record['employee_id'],
-            record['employee_name'],
-            record['branch'],
-            record['date'],
-            record['check_in'],
-            record['check_out'],
-            record['status'],
-            record['duration_display'],
-        ])
-
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=1, max_col=8):
-        for cell in row:
-            cell.alignment = align_center
-            cell.border = border_style
-
-    for col in ws.columns:
-        max_len = max(len(str(c.value)) if c.value else 0 for c in col)
-        ws.column_dimensions[col[0].column_letter].width = max_len + 2
-
+    # Rows are generated chunk by chunk (one attendance query per chunk of employees)
+    records = attendance_data.iter_chunks()
     filename = (
         f"Attendance_Report_{start_date.strftime('%b_%d_%Y')}"
-        f"_to_{end_date.strftime('%b_%d_%Y')}.xlsx"
+        f"_to_{end_date.strftime('%b_%d_%Y')}"
     )
-    response = HttpResponse(
+
+    if export_format == 'csv':
+        response = StreamingHttpResponse(
+            AttendanceExportService.iter_csv(records),
+            content_type='text/csv'
+        )
+        response['Content-Disposition'] = f'attachment; filename=\"{filename}.csv\"'
+        return response
+
+    # XLSX is a zip archive, so it is spooled to a temporary file by the
+    # write-only workbook and then streamed back from disk
+    tmp = tempfile.TemporaryFile()
+    AttendanceExportService.write_xlsx(records, tmp)
+    tmp.seek(0)
+    return FileResponse(
+        tmp,
+        as_attachment=True,
+        filename=f"{filename}.xlsx",
         content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
-    response['Content-Disposition'] = f'attachment; filename=\"{filename}\"'
-    wb.save(response)
-    return response
 
 
 
@@ -784,7 +603,7 @@ def download_attendance_report_excel(request):
             check_out = "-"
 
             # ✅ Sunday logic FIXED
-            if d.weekday() == 6:
+            if WorkingDayCalendar.is_weekly_off(d):
                 status = "Sunday"
             else:
                 status = "Absent"
@@ -870,102 +689,54 @@ def upload_admin_attendance_excel(request):
         messages.error(request, "Please upload a valid Excel file.")
         return redirect(f"{reverse('attendance:report')}?branch={current_branch}")
 
+    dry_run = request.POST.get("dry_run") == "on"
+    redirect_url = f"{reverse('attendance:report')}?branch={current_branch}"
+
     # ============================
-    # LOAD EXCEL
+    # LOAD & IMPORT EXCEL
     # ============================
     try:
-        wb = openpyxl.load_workbook(excel_file, data_only=True)
-        sheet = wb.active
-    except:
+        summary = AttendanceImportService.import_rows(
+            AttendanceImportService.read_rows(excel_file),
+            current_branch=current_branch,
+            dry_run=dry_run
+        )
+    except InvalidSpreadsheet:
         messages.error(request, "Invalid Excel file.")
-        return redirect(f"{reverse('attendance:report')}?branch={current_branch}")
-
-    new_updates = 0
+        return redirect(redirect_url)
+    except DatabaseError:
+        logger.exception("Attendance import failed")
+        messages.error(request, "Attendance import failed – no records were saved. Please try again.")
+        return redirect(redirect_url)
 
-    # ============================
-    # READ ROWS
-    # ============================
-    for row in sheet.iter_rows(min_row=2, values_only=True):
-
-        employee_id = str(row[0]).strip() if row[0] else None
-        if not employee_id:
-            continue
-
-        # ==========================================================
-        # ✔ BRANCH VALIDATION – STOP WRONG LOCATION UPLOAD
-        # ==========================================================
-        try:
-            employee = Employee.objects.get(employee_id__iexact=employee_id)
-        except:
-            continue
-
-        # FIXED HERE: employee.location is correct field
-        if current_branch and employee.location != current_branch:
-            messages.error(
-                request,
-                f"❌ Excel contains employees from **{employee.location}**, "
-                f"but selected location is **{current_branch}**."
-            )
-            return redirect(f"{reverse('attendance:report')}?branch={current_branch}")
+    # ==========================================================
+    # ✔ BRANCH VALIDATION – STOP WRONG LOCATION UPLOAD
+    # ==========================================================
+    if summary['branch_mismatch'] is not None:
+        messages.error(
+            request,
+            f"❌ Excel contains employees from **{summary['branch_mismatch']}**, "
+            f"but selected location is **{current_branch}**."
+        )
+        return redirect(redirect_url)
 
-        # ==========================================================
-        # PROCESS DATE/TIME
-        # ==========================================================
-        excel_date = row[3]
-        check_in_val = row[4]
-        check_out_val = row[5]
+    rejected = summary['rejected']
+    if rejected:
+        details = "; ".join(f"row {row_number}: {reason}" for row_number, reason in rejected[:5])
+        if len(rejected) > 5:
+            details += f"; and {len(rejected) - 5} more"
+        messages.warning(request, f"⚠ {len(rejected)} row(s) rejected – {details}")
 
-        if isinstance(excel_date, datetime):
-            date_obj = excel_date.date()
-        else:
-            try:
-                date_obj = datetime.strptime(str(excel_date), "%b %d, %Y").date()
-            except:
-                continue
-
-        def parse_time(val):
-            if val in [None, "", "-", "—"]:
-                return None
-            if isinstance(val, datetime):
-                return val.time()
-
-            val = str(val).replace(":", ":").strip().upper()
-            fmts = ["%I:%M %p", "%I:%M%p", "%I %p", "%H:%M"]
-            for f in fmts:
-                try:
-                    return datetime.strptime(val, f).time()
-                except:
-                    pass
-            return None
-
-        in_time = parse_time(check_in_val)
-        out_time = parse_time(check_out_val)
-
-        excel_in = make_aware(datetime.combine(date_obj, in_time)) if in_time else None
-        excel_out = make_aware(datetime.combine(date_obj, out_time)) if out_time else None
-
-        existing = Attendance.objects.filter(employee=employee, date=date_obj).first()
-
-        if existing:
-            db_in = existing.check_in
-            db_out = existing.check_out
-
-            if db_in == excel_in and db_out == excel_out:
-                continue
-
-            existing.check_in = excel_in
-            existing.check_out = excel_out
-            existing.save()
-            new_updates += 1
+    if dry_run:
+        messages.info(
+            request,
+            f"Preview only (nothing saved): {summary['inserted']} to insert, "
+            f"{summary['updated']} to update, {summary['unchanged']} unchanged, "
+            f"{len(rejected)} rejected."
+        )
+        return redirect(redirect_url)
 
-        else:
-            Attendance.objects.create(
-                employee=employee,
-                date=date_obj,
-                check_in=excel_in,
-                check_out=excel_out
-            )
-            new_updates += 1
+    new_updates = summary['inserted'] + summary['updated']
 
     # ==========================================================
     # NO NEW UPDATES
@@ -975,7 +746,11 @@ def upload_admin_attendance_excel(request):
             request,
             "⚠ This Excel file contains no new attendance updates. It was already uploaded before."
         )
-        return redirect(f"{reverse('attendance:report')}?branch={current_branch}")
+        return redirect(redirect_url)
 
-    messages.success(request, f"{new_updates} attendance records updated successfully.")
-    return redirect(f"{reverse('attendance:report')}?branch={current_branch}")
\ No newline at end of file
+    messages.success(
+        request,
+        f"{new_updates} attendance records updated successfully "
+        f"({summary['inserted']} new, {summary['updated']} changed)."
+    )
+    return redirect(redirect_url)
\ No newline at end of file
@@ -2,6 +2,7 @@
 from hr.models import Role, Employee, YsMenuMaster, YsMenuLinkMaster, YsMenuRoleMaster, YsUserRoleMaster,CelebrationWish
 from datetime import date, timedelta
 from django.utils import timezone
+from hr.services import MenuService, CelebrationService
 
 
 # In context_processors.py
@@ -93,63 +94,9 @@ def get_assigned_menus(request):
         if not user_role:
             return {'menu_data': []}
         
-        # Get user role ID from ys_user_role_master
-        user_role_obj = Role.objects.filter(name=user_role, is_active=True).first()
-        if not user_role_obj:
-            return {'menu_data': []}
-        
-        role_id = user_role_obj.id
-        
-        # Get all assigned menu links for this role
-        assigned_permissions = YsMenuRoleMaster.objects.filter(
-            userRoleId=role_id,
-            status=True
-        )
-        
-        # Get assigned menu_link_ids
-        assigned_menu_link_ids = [perm.menu_link_id for perm in assigned_permissions]
-        
-        # Get all active menus
-        menus = YsMenuMaster.objects.filter(status=True).order_by('seq')
-        
-        menu_data = []
-        
-        for menu in menus:
-            # Check if this menu has any assigned submenus
-            assigned_submenus = YsMenuLinkMaster.objects.filter(
-                menu_id=menu.menu_id,
-                menu_link_id__in=assigned_menu_link_ids,
-                status=1
-            ).order_by('seq')
-            
-            # Check if this menu itself is assigned (standalone menu)
-            is_menu_assigned = YsMenuRoleMaster.objects.filter(
-                userRoleId=role_id,
-                menu_id=menu.menu_id,
-                menu_link_id=menu.menu_id,  # For standalone menus
-                status=True
-            ).exists()
-            
-            # If it's a standalone menu and assigned, or has assigned submenus
-            if is_menu_assigned or assigned_submenus.exists():
-                menu_info = {
-                    'id': menu.menu_id,
-                    'name': menu.menu_name,
-                    'icon': menu.menu_icon,
-                    'url': menu.menu_url,
-                    'submenus': []
-                }
-                
-                # Add submenus if any are assigned
-                for submenu in assigned_submenus:
-                    menu_info['submenus'].append({
-                        'menu_link_id': submenu.menu_link_id,
-                        'menu_link_name': submenu.menu_link_name,
-                        'menu_link_icon': submenu.menu_link_icon,
-                        'menu_link_url': submenu.menu_link_url
-                    })
-                
-                menu_data.append(menu_info)
+        # Compiled once per role and shared through the cache;
+        # invalidated by hr.signals / assign_permissions
+        menu_data = MenuService.get_menu_tree(user_role)
         
         return {'menu_data': menu_data}
     
@@ -180,20 +127,15 @@ def celebration_notifications(request):
     }
     
     try:
-        # Get current user
-        current_user = None
+        # Get current user (the session already carries the logged-in employee's id)
         if user_role == 'SUPER ADMIN':
             celebrations['current_user_id'] = 'admin'
         else:
-            try:
-                current_user = Employee.objects.get(email=user_email, status='active')
-                celebrations['current_user_id'] = current_user.id
-            except Employee.DoesNotExist:
-                celebrations['current_user_id'] = None
+            celebrations['current_user_id'] = request.session.get('user_id')
+        current_user_id = celebrations['current_user_id']
 
         # Get today's date and next 7 days
         today = timezone.now().date()
-        week_from_now = today + timedelta(days=7)
         
         # Create list of upcoming dates for display
         upcoming_dates = []
@@ -213,102 +155,14 @@ def celebration_notifications(request):
             celebrations['show_celebration_popup'] = True
             request.session['last_popup_date'] = today_str
         
-        # Get all active employees
-        active_employees = Employee.objects.filter(status='active')
-        
-        # Process birthdays (today + next 7 days)
-        for emp in active_employees:
-            if emp.date_of_birth:
-                # Get next birthday
-                next_birthday = date(today.year, emp.date_of_birth.month, emp.date_of_birth.day)
-                if next_birthday < today:
-                    next_birthday = date(today.year + 1, emp.date_of_birth.month, emp.date_of_birth.day)
-                
-                # Check if birthday is within next 7 days
-                days_until = (next_birthday - today).days
-                if 0 <= days_until <= 7:
-                    birthday_data = {
-                        'id': emp.id,
-                        'employee_id': emp.employee_id,
-                        'name': emp.full_name,
-                        'designation': emp.designation,
-                        'department': emp.department,
-                        'years_old': today.year - emp.date_of_birth.year if next_birthday.year > emp.date_of_birth.year else today.year - emp.date_of_birth.year - 1,
-                        'is_current_user': current_user and emp.id == current_user.id,
-                        'date': next_birthday,
-                        'days_until': days_until,
-                        'formatted_date': next_birthday.strftime('%d %b')
-                    }
-                    
-                    if days_until == 0:
-                        celebrations['birthdays_today'].append(birthday_data)
-                    else:
-                        celebrations['birthdays_upcoming'].append(birthday_data)
-        
-        # Process work anniversaries (today + next 7 days)
-        for emp in active_employees:
-            if emp.date_of_joining:
-                # Get next anniversary
-                next_anniversary = date(today.year, emp.date_of_joining.month, emp.date_of_joining.day)
-                if next_anniversary < today:
-                    next_anniversary = date(today.year + 1, emp.date_of_joining.month, emp.date_of_joining.day)
-                
-                # Check if anniversary is within next 7 days
-                days_until = (next_anniversary - today).days
-                if 0 <= days_until <= 7:
-                    years_of_service = emp.get_years_of_service()
-                    anniversary_data = {
-                        'id': emp.id,
-                        'employee_id': emp.employee_id,
-                        'name': emp.full_name,
-                        'designation': emp.designation,
-                        'department': emp.department,
-                        'years': years_of_service,
-                        'is_current_user': current_user and emp.id == current_user.id,
-                        'date': next_anniversary,
-                        'days_until': days_until,
-                        'formatted_date': next_anniversary.strftime('%d %b')
-                    }
-                    
-                    if days_until == 0:
-                        celebrations['work_anniversaries_today'].append(anniversary_data)
-                    else:
-                        celebrations['work_anniversaries_upcoming'].append(anniversary_data)
-        
-        # Process marriage anniversaries (today + next 7 days)
-        for emp in active_employees:
-            if emp.marriage_date:
-                # Get next anniversary
-                next_anniversary = date(today.year, emp.marriage_date.month, emp.marriage_date.day)
-                if next_anniversary < today:
-                    next_anniversary = date(today.year + 1, emp.marriage_date.month, emp.marriage_date.day)
-                
-                # Check if anniversary is within next 7 days
-                days_until = (next_anniversary - today).days
-                if 0 <= days_until <= 7:
-                    years_of_marriage = emp.get_years_of_marriage()
-                    anniversary_data = {
-                        'id': emp.id,
-                        'employee_id': emp.employee_id,
-                        'name': emp.full_name,
-                        'designation': emp.designation,
-                        'department': emp.department,
-                        'years': years_of_marriage,
-                        'is_current_user': current_user and emp.id == current_user.id,
-                        'date': next_anniversary,
-                        'days_until': days_until,
-                        'formatted_date': next_anniversary.strftime('%d %b')
-                    }
-                    
-                    if days_until == 0:
-                        celebrations['marriage_anniversaries_today'].append(anniversary_data)
-                    else:
-                        celebrations['marriage_anniversaries_upcoming'].append(anniversary_data)
-        
-        # Sort upcoming events by date
-        celebrations['birthdays_upcoming'] = sorted(celebrations['birthdays_upcoming'], key=lambda x: x['days_until'])
-        celebrations['work_anniversaries_upcoming'] = sorted(celebrations['work_anniversaries_upcoming'], key=lambda x: x['days_until'])
-        celebrations['marriage_anniversaries_upcoming'] = sorted(celebrations['marriage_anniversaries_upcoming'], key=lambda x: x['days_until'])
+        # Birthdays / work anniversaries / marriage anniversaries for today + next 7 days,
+        # computed once per day from the month-day index (see CelebrationService)
+        window = CelebrationService.get_window(today)
+        for key, items in window.items():
+            celebrations[key] = [
+                dict(item, is_current_user=item['id'] == current_user_id)
+                for item in items
+            ]
         
         # Update show_celebration_popup based on actual celebrations
         if celebrations['show_celebration_popup']:
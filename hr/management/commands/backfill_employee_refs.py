@@ -0,0 +1,134 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from hr.models import Department, Designation, Employee, Location
+
+
+class Command(BaseCommand):
+    help = 'Link employees to Department/Designation/Location rows by matching the legacy id and name fields'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be linked without saving anything',
+        )
+        parser.add_argument(
+            '--relink',
+            action='store_true',
+            help='Re-match employees that are already linked as well',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Employees updated per transaction (default: 500)',
+        )
+
+    @staticmethod
+    def build_lookup(queryset, name_field):
+        """({pk: pk}, {lower(name): pk}) for one master table"""
+        by_pk = {}
+        by_name = {}
+        for pk, name in queryset.values_list('pk', name_field):
+            by_pk[pk] = pk
+            if name:
+                by_name.setdefault(name.strip().lower(), pk)
+        return by_pk, by_name
+
+    @staticmethod
+    def resolve(lookup, pk_value, name):
+        # The name wins: it is what the existing filters matched on
+        by_pk, by_name = lookup
+        match = by_name.get((name or '').strip().lower())
+        if match is not None:
+            return match
+        pk_value = str(pk_value or '').strip()
+        if pk_value.isdigit() and int(pk_value) in by_pk:
+            return int(pk_value)
+        return None
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+
+        locations = self.build_lookup(Location.objects.all(), 'name')
+        departments = self.build_lookup(Department.objects.all(), 'name')
+        designations = self.build_lookup(Designation.objects.all(), 'title')
+        # Designation titles are only unique within a department
+        designations_by_department = {
+            (title.strip().lower(), department_id): pk
+            for pk, title, department_id in Designation.objects.values_list('pk', 'title', 'department_id')
+            if title
+        }
+
+        employees = Employee.objects.only(
+            'id', 'location', 'location_id', 'department', 'department_id',
+            'designation', 'designation_id',
+            'location_ref', 'department_ref', 'designation_ref',
+        )
+        if not options['relink']:
+            employees = employees.filter(
+                Q(location_ref__isnull=True) | Q(department_ref__isnull=True) | Q(designation_ref__isnull=True)
+            )
+
+        to_update = []
+        linked = Counter()
+        unmatched = {'location': Counter(), 'department': Counter(), 'designation': Counter()}
+
+        for employee in employees.iterator(chunk_size=2000):
+            changed = False
+
+            location_pk = self.resolve(locations, employee.location_id, employee.location)
+            department_pk = self.resolve(departments, employee.department_id, employee.department)
+            designation_pk = None
+            if department_pk and employee.designation:
+                designation_pk = designations_by_department.get(
+                    (employee.designation.strip().lower(), department_pk)
+                )
+            designation_pk = designation_pk or self.resolve(
+                designations, employee.designation_id, employee.designation
+            )
+
+            for field, pk, label in [
+                ('location_ref_id', location_pk, 'location'),
+                ('department_ref_id', department_pk, 'department'),
+                ('designation_ref_id', designation_pk, 'designation'),
+            ]:
+                current = getattr(employee, field)
+                if options['relink'] or current is None:
+                    if pk is None:
+                        legacy_name = getattr(employee, label)
+                        if current is None and legacy_name:
+                            unmatched[label][legacy_name] += 1
+                    elif pk != current:
+                        setattr(employee, field, pk)
+                        linked[label] += 1
+                        changed = True
+
+            if changed:
+                to_update.append(employee)
+
+        if not dry_run:
+            for i in range(0, len(to_update), batch_size):
+                with transaction.atomic():
+                    Employee.objects.bulk_update(
+                        to_update[i:i + batch_size],
+                        ['location_ref', 'department_ref', 'designation_ref']
+                    )
+
+        prefix = '[DRY RUN] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{len(to_update)} employees linked "
+            f"(locations: {linked['location']}, departments: {linked['department']}, "
+            f"designations: {linked['designation']})"
+        ))
+
+        for label, counter in unmatched.items():
+            for name, count in counter.most_common():
+                self.stdout.write(self.style.WARNING(
+                    f"  No {label} matches '{name}' ({count} employees)"
+                ))
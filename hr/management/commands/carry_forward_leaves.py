@@ -0,0 +1,70 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from leave.models import CarryForwardRun
+from leave.services import CarryForwardService
+
+
+class Command(BaseCommand):
+    help = 'Carry Earned Leave forward into the next financial year in chunks (resumes an interrupted run)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from-year',
+            type=int,
+            help='Start year of the financial year that ended (default: the previous financial year)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Write the proposed changes as CSV instead of saving anything',
+        )
+        parser.add_argument(
+            '--output',
+            help='CSV file for --dry-run (default: stdout)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=CarryForwardService.CHUNK_SIZE,
+            help=f'Employees per committed chunk (default: {CarryForwardService.CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        from_year = options['from_year']
+        if from_year is None:
+            fy_start, fy_end = CarryForwardService.get_financial_year()
+            from_year = fy_start - 1
+        to_year = from_year + 1
+
+        if not CarryForwardService.get_leave_type():
+            raise CommandError('Earned Leave type (accrual rate 1.5) not found')
+
+        if options['dry_run']:
+            plan = CarryForwardService.carry_forward_plan(from_year, to_year)
+            if options['output']:
+                with open(options['output'], 'w', newline='') as f:
+                    CarryForwardService.write_plan_csv(plan, from_year, to_year, f)
+            else:
+                CarryForwardService.write_plan_csv(plan, from_year, to_year, sys.stdout)
+            carried = sum(row['carry_forward'] for row in plan)
+            forfeited = sum(row['forfeited'] for row in plan)
+            self.stderr.write(self.style.SUCCESS(
+                f"[DRY RUN] {len(plan)} employees: {carried} days would be carried into {to_year}, "
+                f"{forfeited} forfeited"
+            ))
+            return
+
+        run = CarryForwardRun.objects.filter(from_year=from_year).first()
+        if run and run.status == 'running':
+            self.stdout.write(self.style.WARNING(
+                f"Resuming carry forward from {from_year} after employee {run.last_employee_id}"
+            ))
+
+        processed = CarryForwardService.run(from_year, to_year, chunk_size=options['batch_size'])
+        run = CarryForwardRun.objects.get(from_year=from_year)
+        self.stdout.write(self.style.SUCCESS(
+            f"{processed} employees processed; run total {run.employees_processed} employees, "
+            f"{run.days_carried} days carried into {run.to_year}, {run.days_forfeited} forfeited"
+        ))
@@ -0,0 +1,106 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from attendance.models import Attendance
+from hr.models import Employee, EmployeeWarning, YsMenuRoleMaster
+from leave.models import Leave
+from payroll.models import Payslip
+from resignation.models import Resignation
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the main view queries and report the ones that still do full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plan',
+            action='store_true',
+            help='Print the full query plan for every query, not only the full scans',
+        )
+
+    def get_queries(self):
+        """Representative lookups from the dashboard, leave, attendance, payroll and resignation views"""
+        today = date.today()
+        employee = Employee.objects.order_by('id').first()
+        email = employee.email if employee else 'someone@example.com'
+        employee_id = employee.employee_id if employee else 'EMP001'
+        location = employee.location if employee else 'Head Office'
+
+        return [
+            ('Current employee by email', Employee.objects.filter(email=email)),
+            ('Employee by employee_id', Employee.objects.filter(employee_id=employee_id)),
+            ('Active employees of a branch', Employee.objects.filter(status='active', location=location)),
+            ('Leaves on a day', Leave.objects.filter(
+                status='approved', start_date__lte=today, end_date__gte=today
+            )),
+            ('Pending leaves', Leave.objects.filter(status__in=['pending', 'new'])),
+            ('Attendance for a date range', Attendance.objects.filter(
+                date__range=(today - timedelta(days=30), today)
+            )),
+            ('Payslips of a payroll run', Payslip.objects.filter(payroll_run_id=1, employee_id=1)),
+            ('Recent resignations by status', Resignation.objects.filter(
+                status='applied'
+            ).order_by('-created_at')),
+            ('Warnings of an employee', EmployeeWarning.objects.filter(employee_code=employee_id)),
+            ('Menu permissions of a role', YsMenuRoleMaster.objects.filter(userRoleId=1, status=True)),
+        ]
+
+    def explain(self, queryset):
+        """Return (plan lines, is_full_scan) for a queryset on the current database"""
+        sql, params = queryset.query.sql_with_params()
+        vendor = connection.vendor
+
+        with connection.cursor() as cursor:
+            if vendor == 'sqlite':
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                details = [row[-1] for row in cursor.fetchall()]
+                full_scan = any(
+                    d.startswith('SCAN') and 'INDEX' not in d and 'TEMP B-TREE' not in d
+                    for d in details
+                )
+                return details, full_scan
+
+            cursor.execute(f"EXPLAIN {sql}", params)
+            rows = cursor.fetchall()
+            columns = [col[0] for col in cursor.description]
+
+        if vendor == 'mysql':
+            # type=ALL means the table is read row by row
+            type_index = columns.index('type')
+            table_index = columns.index('table')
+            key_index = columns.index('key')
+            details = [
+                f"table={row[table_index]} type={row[type_index]} key={row[key_index]}"
+                for row in rows
+            ]
+            return details, any(row[type_index] == 'ALL' for row in rows)
+
+        details = [str(row[0]) for row in rows]
+        return details, any('Seq Scan' in d for d in details)
+
+    def handle(self, *args, **options):
+        full_scans = 0
+
+        for label, queryset in self.get_queries():
+            try:
+                details, full_scan = self.explain(queryset)
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"? {label}: could not EXPLAIN ({e})"))
+                continue
+
+            if full_scan:
+                full_scans += 1
+                self.stdout.write(self.style.ERROR(f"✗ {label}: FULL SCAN"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"✓ {label}: uses index"))
+
+            if full_scan or options['verbose_plan']:
+                for line in details:
+                    self.stdout.write(f"      {line}")
+
+        if full_scans:
+            self.stdout.write(self.style.WARNING(f"\n{full_scans} queries still do full table scans"))
+        else:
+            self.stdout.write(self.style.SUCCESS("\nAll queries use an index"))
@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from leave.models import LeaveBalance
+from leave.services import LeaveLedgerService
+
+
+class Command(BaseCommand):
+    help = 'Replay the leave balance ledger and report (or fix) balances that drifted from it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Overwrite drifted balances with the replayed amounts',
+        )
+        parser.add_argument(
+            '--year',
+            type=int,
+            help='Only check balances for this year',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Balances checked and written per query (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        fix = options['fix']
+        batch_size = options['batch_size']
+        fields = list(LeaveLedgerService.FIELDS.values())
+
+        balances = LeaveBalance.objects.order_by('pk')
+        if options['year']:
+            balances = balances.filter(year=options['year'])
+        ids = list(balances.values_list('pk', flat=True))
+
+        checked = 0
+        drifted = []
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            replayed = LeaveLedgerService.replay(chunk)
+            to_update = []
+            for row in LeaveBalance.objects.filter(pk__in=chunk).values('pk', 'employee_id', 'year', *fields):
+                checked += 1
+                # A balance with no ledger rows replays to zero
+                expected = {
+                    field: replayed.get(row['pk'], {}).get(field) or Decimal('0')
+                    for field in fields
+                }
+                diffs = {
+                    field: (row[field] or Decimal('0'), expected[field])
+                    for field in fields if (row[field] or Decimal('0')) != expected[field]
+                }
+                if diffs:
+                    drifted.append((row, diffs))
+                    to_update.append(LeaveBalance(pk=row['pk'], **expected))
+
+            if fix and to_update:
+                with transaction.atomic():
+                    LeaveBalance.objects.bulk_update(to_update, fields, batch_size=batch_size)
+
+        for row, diffs in drifted:
+            detail = ', '.join(f"{field} {actual} -> {expected}" for field, (actual, expected) in diffs.items())
+            self.stdout.write(self.style.WARNING(
+                f"  Balance {row['pk']} (employee {row['employee_id']}, {row['year']}): {detail}"
+            ))
+
+        action = 'fixed' if fix else 'drifted from the ledger'
+        self.stdout.write(self.style.SUCCESS(f"{checked} balances checked, {len(drifted)} {action}"))
@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from hr.models import Employee, EmployeeHierarchy
+
+
+class Command(BaseCommand):
+    help = 'Resolve Employee.reports_to from the legacy reporting manager fields and rebuild the hierarchy closure table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would change without saving anything',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows written per query (default: 1000)',
+        )
+
+    @staticmethod
+    def resolve_all(employees):
+        """{employee pk: manager pk or None}, same matching rules as Employee.resolve_manager"""
+        # Active employees win when a code or name is shared
+        ordered = sorted(employees, key=lambda e: (e['status'] != 'active', e['id']))
+        by_code = {}
+        by_name = {}
+        for e in ordered:
+            if e['employee_id']:
+                by_code.setdefault(e['employee_id'].strip(), e['id'])
+            by_name.setdefault(((e['first_name'] or '').lower(), (e['last_name'] or '').lower()), e['id'])
+        pks = {e['id'] for e in employees}
+
+        managers = {}
+        for e in employees:
+            code = str(e['reporting_manager_id'] or '').strip()
+            first_name, last_name, name_code = Employee.parse_reporting_manager(e['reporting_manager'])
+            manager_id = by_code.get(code) or by_code.get(name_code)
+            if not manager_id and code.isdigit() and int(code) in pks:
+                manager_id = int(code)
+            if not manager_id and first_name:
+                manager_id = by_name.get((first_name.lower(), last_name.lower()))
+            managers[e['id']] = manager_id if manager_id != e['id'] else None
+        return managers
+
+    @staticmethod
+    def break_cycles(managers):
+        """Clear the link that closes each reporting cycle; returns the affected employee pks"""
+        broken = []
+        state = {}
+        for start in managers:
+            path = []
+            node = start
+            while node is not None and node not in state:
+                state[node] = start
+                path.append(node)
+                node = managers.get(node)
+            if node is not None and state[node] == start:
+                # node is on the path we just walked: cut the edge back into it
+                cycle_end = path[-1]
+                managers[cycle_end] = None
+                broken.append(cycle_end)
+        return broken
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        employees = list(Employee.objects.values(
+            'id', 'employee_id', 'first_name', 'last_name', 'status',
+            'reporting_manager', 'reporting_manager_id', 'reports_to_id',
+        ))
+        managers = self.resolve_all(employees)
+        broken = self.break_cycles(managers)
+
+        to_update = []
+        unresolved = 0
+        for e in employees:
+            if managers[e['id']] is None and (e['reporting_manager'] or e['reporting_manager_id']):
+                unresolved += 1
+            if managers[e['id']] != e['reports_to_id']:
+                to_update.append(Employee(id=e['id'], reports_to_id=managers[e['id']]))
+
+        if not dry_run:
+            with transaction.atomic():
+                # bulk_update skips Employee.save(), so the closure table is rebuilt in one pass below
+                Employee.objects.bulk_update(to_update, ['reports_to'], batch_size=options['batch_size'])
+                paths = EmployeeHierarchy.rebuild(batch_size=options['batch_size'])
+        else:
+            paths = None
+
+        prefix = '[DRY RUN] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{len(to_update)} reporting managers updated, {unresolved} could not be resolved"
+        ))
+        if paths is not None:
+            self.stdout.write(self.style.SUCCESS(f"{paths} hierarchy rows written"))
+        for employee_id in broken:
+            self.stdout.write(self.style.WARNING(
+                f"  Employee {employee_id} is part of a reporting cycle; its manager link was cleared"
+            ))
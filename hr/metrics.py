@@ -0,0 +1,93 @@
+# hr/metrics.py
+import threading
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a view runs more SQL queries than its configured budget"""
+
+
+class RequestMetrics:
+    """
+    In-process aggregates of request cost, keyed by URL name.
+
+    Each worker process keeps its own counters; they are exposed in the
+    Prometheus text format by the metrics view.
+    """
+
+    _lock = threading.Lock()
+    _views = {}
+
+    @classmethod
+    def record(cls, view_name, queries, db_seconds, latency_seconds, response_bytes):
+        with cls._lock:
+            stats = cls._views.get(view_name)
+            if stats is None:
+                stats = cls._views[view_name] = {
+                    'requests': 0,
+                    'queries': 0,
+                    'db_seconds': 0.0,
+                    'latency_seconds': 0.0,
+                    'response_bytes': 0,
+                    'max_queries': 0,
+                    'buckets': [0] * len(LATENCY_BUCKETS),
+                }
+            stats['requests'] += 1
+            stats['queries'] += queries
+            stats['db_seconds'] += db_seconds
+            stats['latency_seconds'] += latency_seconds
+            stats['response_bytes'] += response_bytes
+            stats['max_queries'] = max(stats['max_queries'], queries)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency_seconds <= bound:
+                    stats['buckets'][index] += 1
+
+    @classmethod
+    def snapshot(cls):
+        with cls._lock:
+            return {
+                name: dict(stats, buckets=list(stats['buckets']))
+                for name, stats in cls._views.items()
+            }
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._views.clear()
+
+    @classmethod
+    def render_prometheus(cls):
+        """Render the collected metrics in the Prometheus text exposition format"""
+        snapshot = sorted(cls.snapshot().items())
+
+        def label(name):
+            escaped = name.replace('\\', '\\\\').replace('"', '\\"')
+            return f'view="{escaped}"'
+
+        lines = []
+        series = [
+            ('hrms_requests_total', 'counter', 'Requests handled', 'requests'),
+            ('hrms_request_queries_total', 'counter', 'SQL queries run while handling requests', 'queries'),
+            ('hrms_request_max_queries', 'gauge', 'Most SQL queries run by a single request', 'max_queries'),
+            ('hrms_request_db_seconds_total', 'counter', 'Time spent in SQL queries', 'db_seconds'),
+            ('hrms_response_bytes_total', 'counter', 'Response body bytes sent', 'response_bytes'),
+        ]
+        for metric, metric_type, help_text, key in series:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for name, stats in snapshot:
+                lines.append(f"{metric}{{{label(name)}}} {stats[key]}")
+
+        metric = 'hrms_request_latency_seconds'
+        lines.append(f"# HELP {metric} Total request latency")
+        lines.append(f"# TYPE {metric} histogram")
+        for name, stats in snapshot:
+            for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+                lines.append(f'{metric}_bucket{{{label(name)},le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{{label(name)},le="+Inf"}} {stats["requests"]}')
+            lines.append(f"{metric}_sum{{{label(name)}}} {stats['latency_seconds']}")
+            lines.append(f"{metric}_count{{{label(name)}}} {stats['requests']}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,71 @@
+# hr/middleware.py
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from hr.metrics import QueryBudgetExceeded, RequestMetrics
+
+slow_request_logger = logging.getLogger('hrms.slow_requests')
+
+
+class RequestMetricsMiddleware:
+    """
+    Record query count, DB time, latency and response size for every request,
+    keyed by URL name (see hr.metrics and the /metrics/ endpoint).
+
+    Settings:
+        SLOW_REQUEST_MS      - requests slower than this are logged to 'hrms.slow_requests'
+        QUERY_BUDGETS        - {url_name: max_queries}; exceeding a budget is logged,
+        QUERY_BUDGET_RAISE   - or raised as QueryBudgetExceeded when True (tests)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = {'queries': 0, 'db_seconds': 0.0}
+
+        def count_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats['queries'] += 1
+                stats['db_seconds'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count_query))
+            response = self.get_response(request)
+        latency = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = (match.view_name or match._func_path) if match else '<unresolved>'
+
+        if response.streaming:
+            response_bytes = int(response.get('Content-Length') or 0)
+        else:
+            response_bytes = len(response.content)
+
+        RequestMetrics.record(view_name, stats['queries'], stats['db_seconds'], latency, response_bytes)
+
+        slow_ms = getattr(settings, 'SLOW_REQUEST_MS', 1000)
+        if latency * 1000 >= slow_ms:
+            slow_request_logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries, %.0f ms in DB, %d bytes",
+                request.method, request.path, view_name, latency * 1000,
+                stats['queries'], stats['db_seconds'] * 1000, response_bytes
+            )
+
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+        if budget is not None and stats['queries'] > budget:
+            message = f"{view_name} ran {stats['queries']} queries (budget {budget})"
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            slow_request_logger.warning("Query budget exceeded: %s", message)
+
+        return response
@@ -0,0 +1,63 @@
+from django.db import migrations, models
+
+
+# Tables that are not part of the migration history (EmployeeWarning, the unmanaged
+# ys_menu_role_master table, and the resignation app, which has no migrations yet)
+# get their indexes through plain SQL, and only where the table actually exists.
+RAW_INDEXES = [
+    ('employee_warning', 'employee_warning_code_idx', ['employee_code']),
+    ('ys_menu_role_master', 'ys_menu_role_role_status_idx', ['userRoleId', 'status']),
+    ('resignation_resignation', 'resignation_status_created_idx', ['status', 'created_at']),
+]
+
+
+def _existing_indexes(schema_editor, table):
+    with schema_editor.connection.cursor() as cursor:
+        return schema_editor.connection.introspection.get_constraints(cursor, table)
+
+
+def create_raw_indexes(apps, schema_editor):
+    tables = schema_editor.connection.introspection.table_names()
+    quote = schema_editor.quote_name
+    for table, name, columns in RAW_INDEXES:
+        if table not in tables or name in _existing_indexes(schema_editor, table):
+            continue
+        schema_editor.execute(
+            f"CREATE INDEX {quote(name)} ON {quote(table)} ({', '.join(quote(c) for c in columns)})"
+        )
+
+
+def drop_raw_indexes(apps, schema_editor):
+    tables = schema_editor.connection.introspection.table_names()
+    for table, name, columns in RAW_INDEXES:
+        if table not in tables or name not in _existing_indexes(schema_editor, table):
+            continue
+        schema_editor.execute(
+            schema_editor.sql_delete_index % {
+                'table': schema_editor.quote_name(table),
+                'name': schema_editor.quote_name(name),
+            }
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr', '0005_alter_admin_profile_picture_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['email'], name='hr_employee_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['employee_id'], name='hr_employee_empid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['status', 'location'], name='hr_employee_status_loc_idx'),
+        ),
+        migrations.RunPython(create_raw_indexes, drop_raw_indexes),
+    ]
@@ -0,0 +1,106 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_missing_master_tables(apps, schema_editor):
+    """
+    hr_locations / hr_departments / hr_designations already exist on deployed
+    databases but were never part of the migration history; only create them
+    where they are missing (fresh databases).
+    """
+    tables = schema_editor.connection.introspection.table_names()
+    for model_name in ['Location', 'Department', 'Designation']:
+        model = apps.get_model('hr', model_name)
+        if model._meta.db_table not in tables:
+            schema_editor.create_model(model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr', '0006_lookup_indexes'),
+    ]
+
+    operations = [
+        # Bring the existing master tables into the migration state so Employee can reference them
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Location',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('name', models.CharField(max_length=100, unique=True)),
+                        ('code', models.CharField(blank=True, max_length=10, null=True, unique=True)),
+                        ('address', models.TextField(blank=True, null=True)),
+                        ('city', models.CharField(blank=True, max_length=50, null=True)),
+                        ('state', models.CharField(blank=True, max_length=50, null=True)),
+                        ('country', models.CharField(default='India', max_length=50)),
+                        ('zip_code', models.CharField(blank=True, max_length=20, null=True)),
+                        ('phone', models.CharField(blank=True, max_length=20, null=True)),
+                        ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                        ('is_active', models.BooleanField(default=True)),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('updated_at', models.DateTimeField(auto_now=True)),
+                    ],
+                    options={
+                        'db_table': 'hr_locations',
+                        'ordering': ['name'],
+                    },
+                ),
+                migrations.CreateModel(
+                    name='Department',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('name', models.CharField(max_length=100, unique=True)),
+                        ('code', models.CharField(blank=True, max_length=10, null=True)),
+                        ('description', models.TextField(blank=True, null=True)),
+                        ('is_active', models.BooleanField(default=True)),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('updated_at', models.DateTimeField(auto_now=True)),
+                        ('head', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='headed_departments', to='hr.employee')),
+                    ],
+                    options={
+                        'db_table': 'hr_departments',
+                        'ordering': ['name'],
+                    },
+                ),
+                migrations.CreateModel(
+                    name='Designation',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('title', models.CharField(max_length=100)),
+                        ('code', models.CharField(blank=True, max_length=10, null=True, unique=True)),
+                        ('level', models.IntegerField(default=1, help_text='Hierarchy level (1 = entry level)')),
+                        ('description', models.TextField(blank=True, null=True)),
+                        ('min_salary', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                        ('max_salary', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                        ('is_active', models.BooleanField(default=True)),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('updated_at', models.DateTimeField(auto_now=True)),
+                        ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='designations', to='hr.department')),
+                    ],
+                    options={
+                        'db_table': 'hr_designations',
+                        'ordering': ['department', 'level'],
+                        'unique_together': {('title', 'department')},
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_missing_master_tables, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='employee',
+            name='department_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='employees', to='hr.department'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='designation_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='employees', to='hr.designation'),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='location_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='employees', to='hr.location'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr', '0007_employee_org_refs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='reports_to',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='direct_reports', to='hr.employee'),
+        ),
+        migrations.CreateModel(
+            name='EmployeeHierarchy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='hr.employee')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='hr.employee')),
+            ],
+            options={
+                'db_table': 'hr_employee_hierarchy',
+                'unique_together': {('ancestor', 'descendant')},
+                'indexes': [
+                    models.Index(fields=['ancestor', 'depth'], name='hr_hierarchy_ancestor_idx'),
+                    models.Index(fields=['descendant', 'depth'], name='hr_hierarchy_descendant_idx'),
+                ],
+            },
+        ),
+    ]
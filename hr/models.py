@@ -1,7 +1,10 @@
 from datetime import timedelta
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ObjectDoesNotExist
+import logging
+
+logger = logging.getLogger(__name__)
 
 class Admin(models.Model):
     admin_id = models.AutoField(primary_key=True)
@@ -85,6 +88,19 @@ class Employee(models.Model):
     location = models.CharField(max_length=100)
     location_id = models.CharField(max_length=100)
     
+    # Indexed references to the master tables. The name/id CharFields above are
+    # still filled for existing screens; rows saved before these existed are
+    # linked with `manage.py backfill_employee_refs`.
+    department_ref = models.ForeignKey(
+        'Department', on_delete=models.SET_NULL, null=True, blank=True, related_name='employees'
+    )
+    designation_ref = models.ForeignKey(
+        'Designation', on_delete=models.SET_NULL, null=True, blank=True, related_name='employees'
+    )
+    location_ref = models.ForeignKey(
+        'Location', on_delete=models.SET_NULL, null=True, blank=True, related_name='employees'
+    )
+    
     # Employment Details
     role = models.CharField(
         max_length=20,
@@ -111,6 +127,10 @@ class Employee(models.Model):
     
     reporting_manager = models.CharField(max_length=100)
     reporting_manager_id = models.CharField(max_length=50, blank=True, null=True)
+    # Resolved from reporting_manager / reporting_manager_id on save; drives EmployeeHierarchy
+    reports_to = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='direct_reports'
+    )
     
     status = models.CharField(
         max_length=8,
@@ -239,6 +259,11 @@ class Employee(models.Model):
     class Meta:
         managed = True 
         db_table = 'hr_employee' 
+        indexes = [
+            models.Index(fields=['email'], name='hr_employee_email_idx'),
+            models.Index(fields=['employee_id'], name='hr_employee_empid_idx'),
+            models.Index(fields=['status', 'location'], name='hr_employee_status_loc_idx'),
+        ]
     
     def save(self, *args, **kwargs):
             # Recalculate probation end date whenever saving
@@ -255,8 +280,152 @@ class Employee(models.Model):
                 self.created_at = timezone.now()
             self.updated_at = timezone.now()
             
+            relinked = self.link_org_refs()
+            
+            is_new = self.pk is None
+            previous_manager_id = getattr(self, '_loaded_values', {}).get('reports_to_id')
+            self.link_reporting_manager()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and self.reports_to_id != previous_manager_id:
+                relinked.add('reports_to')
+            if update_fields is not None and relinked:
+                kwargs['update_fields'] = set(update_fields) | relinked
+            
             super().save(*args, **kwargs)
             
+            if is_new or self.reports_to_id != previous_manager_id:
+                EmployeeHierarchy.attach(self.pk, self.reports_to_id)
+            self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
+    
+    # Fields whose loaded values save() compares against to decide what to re-resolve
+    # (email: hr.signals drops the current-employee cache entry under the old address)
+    TRACKED_FIELDS = (
+        'reporting_manager', 'reporting_manager_id', 'reports_to_id',
+        'location', 'location_id', 'department', 'department_id', 'designation', 'designation_id',
+        'email',
+    )
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded reporting/org fields so save() only re-resolves the refs when they change
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values)
+            if name in cls.TRACKED_FIELDS and value is not models.DEFERRED
+        }
+        return instance
+    
+    def link_reporting_manager(self):
+        """Point reports_to at the employee named by the legacy reporting manager fields"""
+        loaded = getattr(self, '_loaded_values', {})
+        if (
+            self.pk
+            and 'reporting_manager' in loaded and 'reporting_manager_id' in loaded
+            and loaded['reporting_manager'] == self.reporting_manager
+            and loaded['reporting_manager_id'] == self.reporting_manager_id
+        ):
+            return
+        
+        manager_id = Employee.resolve_manager(self.reporting_manager_id, self.reporting_manager)
+        if manager_id == self.pk:
+            manager_id = None
+        if manager_id and self.pk and EmployeeHierarchy.objects.filter(
+            ancestor_id=self.pk, descendant_id=manager_id
+        ).exists():
+            logger.warning(
+                "Ignoring reporting manager %s for employee %s: it would create a cycle", manager_id, self.pk
+            )
+            manager_id = None
+        self.reports_to_id = manager_id
+    
+    @staticmethod
+    def parse_reporting_manager(reporting_manager):
+        """Split the 'First Last (EMP001)' dropdown value into (first, last, employee code)"""
+        text = (reporting_manager or '').strip()
+        code = ''
+        if text.endswith(')') and ' (' in text:
+            text, code = text[:-1].rsplit(' (', 1)
+        first_name, _, last_name = text.strip().partition(' ')
+        return first_name, last_name.strip(), code.strip()
+    
+    @classmethod
+    def resolve_manager(cls, reporting_manager_id, reporting_manager):
+        """
+        Employee pk of the reporting manager, or None.
+        reporting_manager_id normally holds the manager's employee code (older rows hold
+        the pk); the display name is only used when neither matches.
+        """
+        employees = cls.objects.order_by('status', 'id')
+        code = str(reporting_manager_id or '').strip()
+        first_name, last_name, name_code = cls.parse_reporting_manager(reporting_manager)
+        
+        for candidate in [code, name_code]:
+            if candidate:
+                match = employees.filter(employee_id=candidate).values_list('pk', flat=True).first()
+                if match:
+                    return match
+        if code.isdigit():
+            match = employees.filter(pk=int(code)).values_list('pk', flat=True).first()
+            if match:
+                return match
+        if first_name:
+            return employees.filter(
+                first_name__iexact=first_name, last_name__iexact=last_name
+            ).values_list('pk', flat=True).first()
+        return None
+    
+    def link_org_refs(self):
+        """
+        Resolve the department/designation/location FKs from the legacy id/name fields.
+        A ref is matched when it is missing or its legacy fields changed since the row
+        was loaded. Returns the names of the refs that changed.
+        """
+        loaded = getattr(self, '_loaded_values', {})
+        
+        def changed(*fields):
+            return any(field in loaded and loaded[field] != getattr(self, field) for field in fields)
+        
+        relinked = set()
+        
+        def relink(ref, match):
+            if getattr(self, f'{ref}_id') != match:
+                setattr(self, f'{ref}_id', match)
+                relinked.add(ref)
+        
+        if not self.location_ref_id or changed('location_id', 'location'):
+            relink('location_ref', Location.match(self.location_id, self.location))
+        if not self.department_ref_id or changed('department_id', 'department'):
+            relink('department_ref', Department.match(self.department_id, self.department))
+        # The designation is matched within the department, so follow a department change too
+        if not self.designation_ref_id or 'department_ref' in relinked or changed('designation_id', 'designation'):
+            relink('designation_ref', Designation.match(
+                self.designation_id, self.designation, self.department_ref_id
+            ))
+        return relinked
+    
+    def branch_lookup(self, prefix=''):
+        """
+        Q selecting rows in this employee's branch, e.g.
+        Leave.objects.filter(manager.branch_lookup('employee__'))
+        Uses the indexed location_ref join when set, else the legacy name match.
+        Employees whose location_ref is not linked yet (backfill_employee_refs
+        not run) are still matched by location name.
+        """
+        by_name = models.Q(**{f'{prefix}location__iexact': self.location})
+        if self.location_ref_id:
+            return (
+                models.Q(**{f'{prefix}location_ref': self.location_ref_id})
+                | models.Q(**{f'{prefix}location_ref__isnull': True}) & by_name
+            )
+        return by_name
+    
+    @property
+    def holiday_region_id(self):
+        """Location id used for regional holidays"""
+        if self.location_ref_id:
+            return self.location_ref_id
+        return Location.match(None, self.location)
+            
     def calculate_probation_end_date(self):
         """Calculate probation end date using individual probation period"""
         if self.date_of_joining and self.probation_period_days:
@@ -335,15 +504,15 @@ class Employee(models.Model):
     # Property methods to access names easily
     @property
     def department_name(self):
-        return self.department.name if self.department else None
+        return self.department_ref.name if self.department_ref_id else (self.department or None)
     
     @property
     def designation_name(self):
-        return self.designation.title if self.designation else None
+        return self.designation_ref.title if self.designation_ref_id else (self.designation or None)
     
     @property
     def location_name(self):
-        return self.location.name if self.location else None
+        return self.location_ref.name if self.location_ref_id else (self.location or None)
     
     @property
     def full_name(self):
@@ -351,6 +520,83 @@ class Employee(models.Model):
             return f"{self.first_name} {self.middle_name} {self.last_name}"
         return f"{self.first_name} {self.last_name}"
     
+class EmployeeHierarchy(models.Model):
+    """
+    Closure table of the reporting tree: one row for every (manager, report) pair at
+    any depth, plus a depth-0 row linking each employee to itself.
+    Maintained by Employee.save(); rebuild with `manage.py rebuild_reporting_hierarchy`.
+    """
+    ancestor = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        db_table = 'hr_employee_hierarchy'
+        unique_together = ['ancestor', 'descendant']
+        indexes = [
+            models.Index(fields=['ancestor', 'depth'], name='hr_hierarchy_ancestor_idx'),
+            models.Index(fields=['descendant', 'depth'], name='hr_hierarchy_descendant_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+    
+    @classmethod
+    def attach(cls, employee_id, manager_id):
+        """Move an employee and everyone under them below manager_id (None detaches the subtree)"""
+        with transaction.atomic():
+            subtree = list(
+                cls.objects.filter(ancestor_id=employee_id).values_list('descendant_id', 'depth')
+            )
+            if not subtree:
+                cls.objects.create(ancestor_id=employee_id, descendant_id=employee_id, depth=0)
+                subtree = [(employee_id, 0)]
+            subtree_ids = [descendant_id for descendant_id, _ in subtree]
+            
+            # Drop the paths from the old managers into the subtree
+            cls.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+            
+            if not manager_id:
+                return
+            ancestors = list(
+                cls.objects.filter(descendant_id=manager_id).values_list('ancestor_id', 'depth')
+            )
+            if not ancestors:
+                cls.objects.create(ancestor_id=manager_id, descendant_id=manager_id, depth=0)
+                ancestors = [(manager_id, 0)]
+            cls.objects.bulk_create([
+                cls(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=up + down + 1)
+                for ancestor_id, up in ancestors
+                for descendant_id, down in subtree
+            ], batch_size=1000)
+    
+    @classmethod
+    def detach_reports(cls, employee_id):
+        """Before an employee is deleted, cut their reports' subtrees loose from the managers above"""
+        for report_id in Employee.objects.filter(reports_to_id=employee_id).values_list('id', flat=True):
+            cls.attach(report_id, None)
+    
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """Recompute every path from Employee.reports_to; returns the number of rows written"""
+        parents = dict(Employee.objects.values_list('id', 'reports_to_id'))
+        rows = []
+        for employee_id in parents:
+            # Walk up the chain; the seen set stops at a cycle in bad data
+            seen = {employee_id}
+            rows.append(cls(ancestor_id=employee_id, descendant_id=employee_id, depth=0))
+            ancestor_id, depth = parents.get(employee_id), 1
+            while ancestor_id and ancestor_id not in seen and ancestor_id in parents:
+                rows.append(cls(ancestor_id=ancestor_id, descendant_id=employee_id, depth=depth))
+                seen.add(ancestor_id)
+                ancestor_id, depth = parents.get(ancestor_id), depth + 1
+        
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows, batch_size=batch_size)
+        return len(rows)
+
+
 class EmployeePassword(models.Model):
     employee = models.OneToOneField(Employee, on_delete=models.CASCADE, primary_key=True)
     password_hash = models.CharField(max_length=255)
@@ -414,6 +660,11 @@ class Location(models.Model):
     def _str_(self):
         return self.name
 
+    @classmethod
+    def match(cls, pk_value, name):
+        """Id of the location matching a legacy id string or (case-insensitive) name, or None"""
+        return _match_master(cls, 'name', pk_value, name)
+
     def get_full_address(self):
         address_parts = []
         if self.address:
@@ -452,6 +703,11 @@ class Department(models.Model):
     def _str_(self):
         return self.name
 
+    @classmethod
+    def match(cls, pk_value, name):
+        """Id of the department matching a legacy id string or (case-insensitive) name, or None"""
+        return _match_master(cls, 'name', pk_value, name)
+
 class Designation(models.Model):
     title = models.CharField(max_length=100)
     code = models.CharField(max_length=10, unique=True, blank=True, null=True)
@@ -472,6 +728,30 @@ class Designation(models.Model):
     def _str_(self):
         return f"{self.title} - {self.department.name}"
 
+    @classmethod
+    def match(cls, pk_value, title, department_id=None):
+        """Id of the designation matching a legacy id string or title (within the department if known)"""
+        queryset = cls.objects.filter(department_id=department_id) if department_id else cls.objects.all()
+        return _match_master(queryset, 'title', pk_value, title)
+
+
+def _match_master(queryset, name_field, pk_value, name):
+    """
+    Resolve a master-table row from the legacy CharField pair. The name wins because
+    it is what every existing filter matched on; the id string is only a fallback.
+    """
+    if isinstance(queryset, type):
+        queryset = queryset.objects.all()
+    name = (name or '').strip()
+    if name:
+        match = queryset.filter(**{f'{name_field}__iexact': name}).values_list('pk', flat=True).first()
+        if match:
+            return match
+    pk_value = str(pk_value or '').strip()
+    if pk_value.isdigit():
+        return queryset.filter(pk=int(pk_value)).values_list('pk', flat=True).first()
+    return None
+
 
 class Role(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -0,0 +1,313 @@
+# hr/services.py
+import calendar
+from datetime import timedelta
+
+import time
+
+from django.core.cache import cache, caches
+from django.utils import timezone
+
+from hr.models import Employee, EmployeeHierarchy, Role, YsMenuMaster, YsMenuLinkMaster, YsMenuRoleMaster
+
+
+class CacheVersion:
+    """
+    Shared version counters for the in-cache lookups (menu trees, leave
+    types, calendars, salary plan, ...).
+
+    They live in their own 'versions' cache, which holds nothing else and
+    so is never culled. A counter is seeded from the clock rather than 1,
+    so one that does get lost can't fall back onto stale entries.
+    """
+
+    ALIAS = 'versions'
+
+    @staticmethod
+    def get(key):
+        return caches[CacheVersion.ALIAS].get_or_set(key, int(time.time()), None)
+
+    @staticmethod
+    def bump(key):
+        store = caches[CacheVersion.ALIAS]
+        try:
+            store.incr(key)
+        except ValueError:
+            store.set(key, int(time.time()), None)
+
+
+class MenuService:
+    """Builds and caches the sidebar menu tree for each role"""
+
+    VERSION_KEY = 'menu_tree:version'
+    CACHE_TIMEOUT = 60 * 60 * 24
+
+    @staticmethod
+    def _cache_key(role_name):
+        version = CacheVersion.get(MenuService.VERSION_KEY)
+        return f"menu_tree:v{version}:{role_name}"
+
+    @staticmethod
+    def build_menu_tree(role_name):
+        """
+        Compile the menu tree assigned to a role with a fixed number of queries
+        (role, role permissions, active menus, assigned submenus)
+        """
+        role_id = Role.objects.filter(
+            name=role_name, is_active=True
+        ).values_list('id', flat=True).first()
+        if role_id is None:
+            return []
+
+        permissions = YsMenuRoleMaster.objects.filter(
+            userRoleId=role_id,
+            status=True
+        ).values_list('menu_id', 'menu_link_id')
+
+        assigned_menu_link_ids = set()
+        standalone_menu_ids = set()
+        for menu_id, menu_link_id in permissions:
+            assigned_menu_link_ids.add(menu_link_id)
+            # Standalone menus are stored with menu_link_id == menu_id
+            if menu_id is not None and menu_id == menu_link_id:
+                standalone_menu_ids.add(menu_id)
+
+        submenus_by_menu = {}
+        assigned_submenus = YsMenuLinkMaster.objects.filter(
+            menu_link_id__in=assigned_menu_link_ids,
+            status=1
+        ).order_by('seq').values(
+            'menu_id', 'menu_link_id', 'menu_link_name', 'menu_link_icon', 'menu_link_url'
+        )
+        for submenu in assigned_submenus:
+            submenus_by_menu.setdefault(submenu.pop('menu_id'), []).append(submenu)
+
+        menu_data = []
+        menus = YsMenuMaster.objects.filter(status=True).order_by('seq').values(
+            'menu_id', 'menu_name', 'menu_icon', 'menu_url'
+        )
+        for menu in menus:
+            submenus = submenus_by_menu.get(menu['menu_id'], [])
+            if menu['menu_id'] in standalone_menu_ids or submenus:
+                menu_data.append({
+                    'id': menu['menu_id'],
+                    'name': menu['menu_name'],
+                    'icon': menu['menu_icon'],
+                    'url': menu['menu_url'],
+                    'submenus': submenus
+                })
+
+        return menu_data
+
+    @staticmethod
+    def get_menu_tree(role_name):
+        """Return the cached menu tree for a role, building it on a cache miss"""
+        key = MenuService._cache_key(role_name)
+        menu_data = cache.get(key)
+        if menu_data is None:
+            menu_data = MenuService.build_menu_tree(role_name)
+            cache.set(key, menu_data, MenuService.CACHE_TIMEOUT)
+        return menu_data
+
+    @staticmethod
+    def invalidate():
+        """Drop every cached menu tree (called when roles, menus or permissions change)"""
+        CacheVersion.bump(MenuService.VERSION_KEY)
+
+
+class CelebrationService:
+    """
+    Month-day index of birthdays and work/marriage anniversaries.
+
+    The celebrations for today + the next 7 days are computed once per day
+    (and again after any Employee change) and shared through the cache;
+    per-user flags are added on top by the context processor.
+    """
+
+    VERSION_KEY = 'celebrations:version'
+    WINDOW_DAYS = 7
+    # kind -> Employee date field
+    KINDS = {
+        'birthdays': 'date_of_birth',
+        'work_anniversaries': 'date_of_joining',
+        'marriage_anniversaries': 'marriage_date',
+    }
+
+    @staticmethod
+    def build_index():
+        """Index active employees by (month, day) of each celebration date with a single query"""
+        index = {kind: {} for kind in CelebrationService.KINDS}
+        employees = Employee.objects.filter(status='active').order_by('id').values(
+            'id', 'employee_id', 'first_name', 'middle_name', 'last_name',
+            'designation', 'department', *CelebrationService.KINDS.values()
+        )
+        for emp in employees:
+            for kind, field in CelebrationService.KINDS.items():
+                source_date = emp[field]
+                if source_date:
+                    index[kind].setdefault((source_date.month, source_date.day), []).append(emp)
+        return index
+
+    @staticmethod
+    def _years_completed(source_date, today):
+        """Whole years from source_date to today (same as Employee.get_years_of_service)"""
+        years = today.year - source_date.year
+        if (today.month, today.day) < (source_date.month, source_date.day):
+            years -= 1
+        return years
+
+    @staticmethod
+    def build_window(today):
+        """Celebrations from today to today + WINDOW_DAYS, without any per-user data"""
+        index = CelebrationService.build_index()
+        window = {}
+
+        for kind, field in CelebrationService.KINDS.items():
+            today_list, upcoming = [], []
+            by_month_day = index[kind]
+
+            for days_until in range(CelebrationService.WINDOW_DAYS + 1):
+                day = today + timedelta(days=days_until)
+                employees = list(by_month_day.get((day.month, day.day), []))
+                # Feb 29 dates are celebrated on Feb 28 in non-leap years
+                if day.month == 2 and day.day == 28 and not calendar.isleap(day.year):
+                    employees += by_month_day.get((2, 29), [])
+
+                for emp in employees:
+                    source_date = emp[field]
+                    if emp['middle_name']:
+                        name = f"{emp['first_name']} {emp['middle_name']} {emp['last_name']}"
+                    else:
+                        name = f"{emp['first_name']} {emp['last_name']}"
+                    data = {
+                        'id': emp['id'],
+                        'employee_id': emp['employee_id'],
+                        'name': name,
+                        'designation': emp['designation'],
+                        'department': emp['department'],
+                        'date': day,
+                        'days_until': days_until,
+                        'formatted_date': day.strftime('%d %b')
+                    }
+                    if kind == 'birthdays':
+                        data['years_old'] = today.year - source_date.year
+                    else:
+                        data['years'] = CelebrationService._years_completed(source_date, today)
+
+                    (today_list if days_until == 0 else upcoming).append(data)
+
+            window[f'{kind}_today'] = today_list
+            window[f'{kind}_upcoming'] = upcoming
+
+        return window
+
+    @staticmethod
+    def get_window(today=None):
+        """Return the cached celebrations window for today, building it on a cache miss"""
+        today = today or timezone.now().date()
+        version = CacheVersion.get(CelebrationService.VERSION_KEY)
+        key = f"celebrations:v{version}:{today.isoformat()}"
+        window = cache.get(key)
+        if window is None:
+            window = CelebrationService.build_window(today)
+            cache.set(key, window, 60 * 60 * 24)
+        return window
+
+    @staticmethod
+    def invalidate():
+        """Drop the cached window (called when an Employee is saved or deleted)"""
+        CacheVersion.bump(CelebrationService.VERSION_KEY)
+
+
+class CurrentEmployeeService:
+    """
+    Resolves the Employee behind the logged-in session.
+
+    The lookup happens at most once per request and is backed by a short-lived
+    cache entry keyed by the session's email, which hr.signals drops whenever
+    that Employee is saved or deleted.
+    """
+
+    CACHE_TIMEOUT = 60 * 5
+    # Cached for sessions that have no Employee row (e.g. SUPER ADMIN)
+    NOT_FOUND = 'not_found'
+
+    @staticmethod
+    def _cache_key(email):
+        return f"current_employee:{email}"
+
+    @staticmethod
+    def lookup(email):
+        """Employee with this email (same as Employee.objects.get(email=email)), or None"""
+        if not email:
+            return None
+
+        key = CurrentEmployeeService._cache_key(email)
+        employee = cache.get(key)
+        if employee is None:
+            try:
+                employee = Employee.objects.get(email=email)
+            except Employee.DoesNotExist:
+                employee = CurrentEmployeeService.NOT_FOUND
+            cache.set(key, employee, CurrentEmployeeService.CACHE_TIMEOUT)
+
+        return None if employee == CurrentEmployeeService.NOT_FOUND else employee
+
+    @staticmethod
+    def resolve(request):
+        """Current Employee for this request (memoised on the request), or None"""
+        if not hasattr(request, '_current_employee'):
+            request._current_employee = CurrentEmployeeService.lookup(
+                request.session.get('user_email')
+            )
+        return request._current_employee
+
+    @staticmethod
+    def invalidate(email):
+        if email:
+            cache.delete(CurrentEmployeeService._cache_key(email))
+
+
+class HierarchyService:
+    """
+    Team lookups over the EmployeeHierarchy closure table.
+
+    Every query is a join on the (ancestor, depth) index instead of matching
+    the reporting manager's name with LIKE.
+    """
+
+    @staticmethod
+    def _pk(employee):
+        return employee.pk if isinstance(employee, Employee) else employee
+
+    @staticmethod
+    def team_of(manager, depth=None, include_self=False):
+        """
+        Employees reporting to manager: depth=1 for direct reports, depth=None for
+        everyone below them in the tree
+        """
+        links = EmployeeHierarchy.objects.filter(ancestor_id=HierarchyService._pk(manager))
+        if not include_self:
+            links = links.filter(depth__gte=1)
+        if depth is not None:
+            links = links.filter(depth__lte=depth)
+        return Employee.objects.filter(id__in=links.values('descendant_id'))
+
+    @staticmethod
+    def direct_reports(manager):
+        return HierarchyService.team_of(manager, depth=1)
+
+    @staticmethod
+    def managers_of(employee):
+        """Managers above employee, nearest first"""
+        return Employee.objects.filter(
+            descendant_links__descendant_id=HierarchyService._pk(employee),
+            descendant_links__depth__gte=1,
+        ).order_by('descendant_links__depth')
+
+    @staticmethod
+    def is_in_team(manager, employee):
+        return EmployeeHierarchy.objects.filter(
+            ancestor_id=HierarchyService._pk(manager),
+            descendant_id=HierarchyService._pk(employee),
+            depth__gte=1,
+        ).exists()
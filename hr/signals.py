@@ -1,9 +1,13 @@
 # hr/signals.py - CREATE THIS FILE
 
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete
 from django.dispatch import receiver
-from hr.models import Employee
-from leave.services import AutoLeaveBalanceService
+from hr.models import Employee, EmployeeHierarchy, Role, YsMenuMaster, YsMenuLinkMaster, YsMenuRoleMaster
+from hr.services import MenuService, CelebrationService, CurrentEmployeeService
+from leave.models import Holiday, Leave, LeaveType
+from leave.services import AutoLeaveBalanceService, CalendarFeedService, LeaveTypeRegistry, WorkingDayCalendar
+from payroll.models import SalaryComponent
+from payroll.services import SalaryFormulaEngine
 from datetime import date
 import logging
 
@@ -49,4 +53,88 @@ def check_probation_end(sender, instance, **kwargs):
         except Exception as e:
             logger.error(
                 f"Error checking probation end for employee {instance.employee_id}: {str(e)}"
-            )
\ No newline at end of file
+            )
+
+
+@receiver([post_save, post_delete], sender=Role)
+@receiver([post_save, post_delete], sender=YsMenuMaster)
+@receiver([post_save, post_delete], sender=YsMenuLinkMaster)
+@receiver([post_save, post_delete], sender=YsMenuRoleMaster)
+def invalidate_menu_cache(sender, **kwargs):
+    """
+    Drop cached sidebar menu trees whenever roles, menus or menu permissions change
+    """
+    MenuService.invalidate()
+
+
+@receiver(pre_save, sender=Employee)
+def remember_previous_email(sender, instance, **kwargs):
+    """
+    Keep the stored email so the current-employee lookup cached under it
+    can be dropped too when the email changes
+    """
+    loaded = getattr(instance, '_loaded_values', {})
+    if 'email' in loaded:
+        instance._previous_email = loaded['email']
+    elif instance.pk:
+        instance._previous_email = (
+            Employee.objects.filter(pk=instance.pk).values_list('email', flat=True).first()
+        )
+    else:
+        instance._previous_email = None
+
+
+@receiver([post_save, post_delete], sender=Employee)
+def invalidate_employee_caches(sender, instance, **kwargs):
+    """
+    Rebuild the celebrations window and drop the cached current-employee
+    lookup and calendar feeds after any employee change
+    """
+    CelebrationService.invalidate()
+    CurrentEmployeeService.invalidate(instance.email)
+    previous_email = getattr(instance, '_previous_email', None)
+    if previous_email != instance.email:
+        CurrentEmployeeService.invalidate(previous_email)
+    CalendarFeedService.invalidate()
+
+
+@receiver(pre_delete, sender=Employee)
+def detach_reporting_subtree(sender, instance, **kwargs):
+    """
+    Cut the deleted employee's reports loose from the managers above them;
+    their reports_to is cleared by SET_NULL without calling save()
+    """
+    EmployeeHierarchy.detach_reports(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Holiday)
+def invalidate_working_day_calendar(sender, **kwargs):
+    """
+    Rebuild working-day calendars after any holiday change
+    """
+    WorkingDayCalendar.invalidate()
+
+
+@receiver([post_save, post_delete], sender=LeaveType)
+def invalidate_leave_type_registry(sender, **kwargs):
+    """
+    Reload the leave type registry (in every process) after any leave type change
+    """
+    LeaveTypeRegistry.invalidate()
+
+
+@receiver([post_save, post_delete], sender=SalaryComponent)
+def invalidate_salary_plan(sender, **kwargs):
+    """
+    Recompile the salary formula plan (in every process) after any salary component change
+    """
+    SalaryFormulaEngine.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Holiday)
+@receiver([post_save, post_delete], sender=Leave)
+def invalidate_calendar_feed(sender, **kwargs):
+    """
+    Drop cached calendar feeds (and their ETags) after any holiday or leave change
+    """
+    CalendarFeedService.invalidate()
@@ -1,3 +1,116 @@
-from django.test import TestCase
+from datetime import date, timedelta
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from hr.metrics import QueryBudgetExceeded
+from hr.models import Employee, Location
+from leave.models import Leave, LeaveType
+
+
+def make_employee(code, **fields):
+    values = {
+        'employee_id': code,
+        'first_name': code,
+        'last_name': 'Test',
+        'email': f'{code.lower()}@example.com',
+        'phone': '1',
+        'department': 'Dev',
+        'department_id': '1',
+        'designation': 'Engineer',
+        'designation_id': '1',
+        'location': 'Mumbai',
+        'location_id': '1',
+        'role': 'Employee',
+        'date_of_joining': date(2024, 1, 1),
+        'reporting_manager': '',
+        'status': 'active',
+    }
+    values.update(fields)
+    return Employee.objects.create(**values)
+
+
+class MetricsEndpointTests(TestCase):
+
+    def login(self, role):
+        session = self.client.session
+        session['user_authenticated'] = True
+        session['user_role'] = role
+        session.save()
+
+    def test_local_clients_are_not_trusted_by_default(self):
+        # Behind a local reverse proxy every request comes from 127.0.0.1
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    def test_super_admin_can_scrape(self):
+        self.login('SUPER ADMIN')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('text/plain', response['Content-Type'])
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.5'])
+    def test_allowed_ip_can_scrape(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 200)
+
+
+class BranchLookupTests(TestCase):
+
+    def test_unlinked_employees_stay_in_their_branch(self):
+        mumbai = Location.objects.create(name='Mumbai')
+        manager = make_employee('BM1', role='Branch Manager')
+        self.assertEqual(manager.location_ref_id, mumbai.pk)
+        linked = make_employee('EMP1')
+        pune = make_employee('EMP2', location='Pune', location_id='99')
+        # Rows saved before the refs existed, not backfilled yet
+        unlinked = make_employee('EMP3')
+        Employee.objects.filter(pk=unlinked.pk).update(location_ref=None)
+
+        self.assertEqual(
+            set(Employee.objects.filter(manager.branch_lookup()).values_list('pk', flat=True)),
+            {manager.pk, linked.pk, unlinked.pk}
+        )
+        self.assertNotIn(pune.pk, Employee.objects.filter(manager.branch_lookup()).values_list('pk', flat=True))
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class QueryBudgetTests(TestCase):
+    """The QUERY_BUDGETS in settings must hold for the budgeted views"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_employee('ADM1', role='Admin')
+        leave_type = LeaveType.objects.create(name='Casual Leave')
+        today = date.today()
+        for i in range(20):
+            employee = make_employee(f'EMP{i}', location='Mumbai' if i % 2 else 'Pune')
+            Leave.objects.create(
+                employee=employee,
+                leave_type=leave_type,
+                colour='blue',
+                start_date=today + timedelta(days=i - 10),
+                end_date=today + timedelta(days=i - 8),
+                reason='test',
+                status='approved' if i % 3 else 'pending',
+                days_requested=3,
+            )
+
+    def login(self, role, email):
+        session = self.client.session
+        session['user_authenticated'] = True
+        session['user_role'] = role
+        session['user_email'] = email
+        session.save()
+
+    def test_exceeding_a_budget_raises(self):
+        self.login('SUPER ADMIN', self.admin.email)
+        with override_settings(QUERY_BUDGETS={'metrics': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('metrics'))
+
+    def test_leave_dashboard_stays_within_budget(self):
+        self.login('ADMIN', self.admin.email)
+        for query in ('', '?from_date=01-01-2020&to_date=31-12-2030', '?branch=Mumbai'):
+            response = self.client.get(reverse('leave_dashboard') + query)
+            self.assertEqual(response.status_code, 200)
@@ -106,4 +106,7 @@ urlpatterns = [
     path('send-celebration-wish/', views.send_celebration_wish, name='send_celebration_wish'),
     path('celebration-wishes/<int:celebrant_id>/', views.get_celebration_wishes, name='get_celebration_wishes'),
     
+    # Instrumentation
+    path('metrics/', views.metrics, name='metrics'),
+    
 ]
\ No newline at end of file
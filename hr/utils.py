@@ -1,5 +1,6 @@
 import hashlib
 from .models import Admin, AllowedDomain, Employee, EmployeePassword
+from .services import CurrentEmployeeService
 
 def authenticate_user(email, password):
     """
@@ -154,4 +155,16 @@ def get_domain_restriction_message():
     elif len(allowed_domains) <= 3:
         return f"Only emails from {', '.join(allowed_domains)} are allowed"
     else:
-        return f"Only emails from {len(allowed_domains)} allowed domains are permitted"
\ No newline at end of file
+        return f"Only emails from {len(allowed_domains)} allowed domains are permitted"
+
+
+def get_current_employee(request, active_only=False):
+    """
+    Employee for the logged-in user, resolved once per request
+    Drop-in replacement for Employee.objects.get(email=request.session['user_email'])
+    Raises: Employee.DoesNotExist if the session has no (active) employee
+    """
+    employee = CurrentEmployeeService.resolve(request)
+    if employee is None or (active_only and employee.status != 'active'):
+        raise Employee.DoesNotExist("No employee found for the logged-in user.")
+    return employee
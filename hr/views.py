@@ -5,13 +5,15 @@ from django.utils.timezone import now
 from attendance.models import Attendance
 from leave.models import Holiday as LeaveHoliday, Leave, LeaveBalance
 from resignation.models import Resignation 
+from .metrics import RequestMetrics
+from .services import MenuService, HierarchyService
 from .models import Admin, AllowedDomain, Employee ,EmployeeDocument, Location, Department, Designation, MessageCategory, MessageSubType, Role ,ProbationConfiguration,EmployeeWarning, YsMenuLinkMaster, YsMenuMaster, YsMenuRoleMaster,CelebrationWish
 from .forms import AdminForm, AllowedDomainForm, LocationForm, DepartmentForm, DesignationForm, RoleForm,EmployeeWarningForm
 from datetime import date, datetime, time, timedelta
 from django.utils import timezone
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db.models import Q ,Count,Sum
-from .utils import authenticate_user, get_domain_restriction_message, get_user_display_name, simple_hash, set_employee_password, validate_email_domain
+from .utils import authenticate_user, get_current_employee, get_domain_restriction_message, get_user_display_name, simple_hash, set_employee_password, validate_email_domain
 import json
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
@@ -20,6 +22,7 @@ import openpyxl
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, PatternFill, Alignment
 from django.http import HttpResponse
+from django.conf import settings
 from itertools import chain
 from operator import attrgetter
 from django.utils.timezone import localtime
@@ -168,7 +171,7 @@ def change_password(request):
                 
                 elif user_role in ['EMPLOYEE', 'MANAGER', 'HR', 'ADMIN']:
                     # For employees and other roles
-                    employee = Employee.objects.get(email=user_email, status='active')
+                    employee = get_current_employee(request, active_only=True)
                     set_employee_password(employee, new_password)
                     messages.success(request, 'Password changed successfully!')
                 
@@ -205,13 +208,12 @@ def access_denied(request):
 @login_required
 def dashboard(request):
     user_role = request.session.get('user_role')
-    user_email = request.session.get('user_email')
     
     # Get branch manager location if applicable
     current_branch_manager_location = None
     if user_role == 'BRANCH MANAGER':
         try:
-            current_branch_manager = Employee.objects.get(email=user_email)
+            current_branch_manager = get_current_employee(request)
             current_branch_manager_location = current_branch_manager.location
         except Employee.DoesNotExist:
             pass
@@ -225,12 +227,12 @@ def dashboard(request):
         # Department-wise count
         department_data = Employee.objects.values('department').annotate(count=Count('id'))
     elif user_role == 'BRANCH MANAGER' and current_branch_manager_location:
-        total_employees = Employee.objects.filter(location__iexact=current_branch_manager_location).count()
+        total_employees = Employee.objects.filter(current_branch_manager.branch_lookup()).count()
         total_location = 1  # Branch manager only sees their location
         # Location-wise count (only their location)
-        location_data = Employee.objects.filter(location__iexact=current_branch_manager_location).values('location').annotate(count=Count('id'))
+        location_data = Employee.objects.filter(current_branch_manager.branch_lookup()).values('location').annotate(count=Count('id'))
         # Department-wise count (only their location)
-        department_data = Employee.objects.filter(location__iexact=current_branch_manager_location).values('department').annotate(count=Count('id'))
+        department_data = Employee.objects.filter(current_branch_manager.branch_lookup()).values('department').annotate(count=Count('id'))
     else:
         total_employees = 0
         total_location = 0
@@ -250,8 +252,8 @@ def dashboard(request):
             today_attendance = Attendance.objects.filter(date=today)
         elif user_role == 'BRANCH MANAGER' and current_branch_manager_location:
             today_attendance = Attendance.objects.filter(
-                date=today,
-                employee__location__iexact=current_branch_manager_location
+                current_branch_manager.branch_lookup('employee__'),
+                date=today
             )
         else:
             today_attendance = Attendance.objects.none()
@@ -289,24 +291,24 @@ def dashboard(request):
             ).count()
         elif user_role == 'BRANCH MANAGER' and current_branch_manager_location:
             total_resignations = Resignation.objects.filter(
-                employee__location__iexact=current_branch_manager_location
+                current_branch_manager.branch_lookup('employee__')
             ).count()
             pending_resignations = Resignation.objects.filter(
-                status='applied',
-                employee__location__iexact=current_branch_manager_location
+                current_branch_manager.branch_lookup('employee__'),
+                status='applied'
             ).count()
             active_notice = Resignation.objects.filter(
+                current_branch_manager.branch_lookup('employee__'),
                 status='accepted',
-                last_working_date__gte=today,
-                employee__location__iexact=current_branch_manager_location
+                last_working_date__gte=today
             ).count()
             current_month = today.month
             current_year = today.year
             completed_this_month = Resignation.objects.filter(
+                current_branch_manager.branch_lookup('employee__'),
                 status='completed',
                 last_working_date__month=current_month,
-                last_working_date__year=current_year,
-                employee__location__iexact=current_branch_manager_location
+                last_working_date__year=current_year
             ).count()
         else:
             total_resignations = 0
@@ -344,29 +346,29 @@ def dashboard(request):
                 
         elif user_role == 'BRANCH MANAGER' and current_branch_manager_location:
             recent_leaves = Leave.objects.select_related('employee', 'leave_type').filter(
+                current_branch_manager.branch_lookup('employee__'),
                 start_date__lte=today,
                 end_date__gte=today,
-                status__in=['approved'],
-                employee__location__iexact=current_branch_manager_location
+                status__in=['approved']
             ).order_by('-applied_date')[:5]
             
             pending_leave_requests = Leave.objects.filter(
-                status__in=['pending', 'new'],
-                employee__location__iexact=current_branch_manager_location
+                current_branch_manager.branch_lookup('employee__'),
+                status__in=['pending', 'new']
             ).count()
             
             approved_leaves_today = Leave.objects.filter(
+                current_branch_manager.branch_lookup('employee__'),
                 start_date__lte=today,
                 end_date__gte=today,
-                status='approved',
-                employee__location__iexact=current_branch_manager_location
+                status='approved'
             ).count()
             
             total_leaves = Leave.objects.filter(
+                current_branch_manager.branch_lookup('employee__'),
                 start_date__lte=today,
                 end_date__gte=today,
-                status='approved',
-                employee__location__iexact=current_branch_manager_location
+                status='approved'
             ).count()
         else:
             recent_leaves = []
@@ -389,7 +391,7 @@ def dashboard(request):
             ).order_by('-resignation_date')[:3]
         elif user_role == 'BRANCH MANAGER' and current_branch_manager_location:
             recent_resignations = Resignation.objects.select_related('employee').filter(
-                employee__location__iexact=current_branch_manager_location,
+                current_branch_manager.branch_lookup('employee__'),
                 status__in=['applied', 'accepted']
             ).order_by('-resignation_date')[:3]
         else:
@@ -436,14 +438,14 @@ def dashboard(request):
                     ).count()
                 elif user_role == 'BRANCH MANAGER' and current_branch_manager_location:
                     total_in_location = Employee.objects.filter(
-                        location__iexact=current_branch_manager_location, 
+                        current_branch_manager.branch_lookup(), 
                         status='active'
                     ).count()
                     
                     present_in_location = Attendance.objects.filter(
+                        current_branch_manager.branch_lookup('employee__'),
                         date=today,
                         check_in__isnull=False,
-                        employee__location__iexact=current_branch_manager_location,
                         employee__status='active'
                     ).count()
                 else:
@@ -476,7 +478,7 @@ def dashboard(request):
                 if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
                     total_in_location = Employee.objects.filter(location=location, status='active').count()
                 elif user_role == 'BRANCH MANAGER' and current_branch_manager_location:
-                    total_in_location = Employee.objects.filter(location__iexact=current_branch_manager_location, status='active').count()
+                    total_in_location = Employee.objects.filter(current_branch_manager.branch_lookup(), status='active').count()
                 else:
                     total_in_location = 0
                     
@@ -537,8 +539,8 @@ def dashboard(request):
             active_employees = Employee.objects.filter(status='active').count()
         elif user_role == 'BRANCH MANAGER' and current_branch_manager_location:
             active_employees = Employee.objects.filter(
-                status='active', 
-                location__iexact=current_branch_manager_location
+                current_branch_manager.branch_lookup(),
+                status='active'
             ).count()
         else:
             active_employees = 0
@@ -551,11 +553,10 @@ def dashboard(request):
 
 @login_required
 def employee_dashboard(request):
-    user_email = request.session.get('user_email')
     user_role = request.session.get('user_role')
 
     try:
-        employee_profile = Employee.objects.get(email=user_email)
+        employee_profile = get_current_employee(request)
     except Employee.DoesNotExist:
         messages.warning(request, 'Employee profile not found.')
         return redirect('access_denied')
@@ -651,12 +652,9 @@ def employee_dashboard(request):
 
     total_team_members = None
     if employee_profile.department:
-        current_manager = Employee.objects.get(email=user_email)
+        current_manager = get_current_employee(request)
         if user_role in ['MANAGER','TL']:
-            total_team_members = Employee.objects.filter(
-                    Q(reporting_manager_id=current_manager.id) |
-                    Q(reporting_manager__icontains=current_manager.first_name)
-                    ).order_by('first_name').count()
+            total_team_members = HierarchyService.team_of(current_manager, depth=1).order_by('first_name').count()
         else:
             total_team_members = Employee.objects.filter(
             department__iexact=employee_profile.department,
@@ -778,22 +776,18 @@ def employee_dashboard(request):
 
 @login_required
 def total_team_members(request):
-    user_email = request.session.get('user_email')
     user_role = request.session.get('user_role')
-    current_manager = Employee.objects.get(email=user_email)
+    current_manager = get_current_employee(request)
    
     try:
-        employee = Employee.objects.get(email=user_email)
+        employee = get_current_employee(request)
     except Employee.DoesNotExist:
         messages.error(request, "Employee not found.")
         return redirect('access_denied')
     if user_role in ['MANAGER','TL']:
         
         # ✅ Fetch all employees in the same department
-        team_members = Employee.objects.filter(
-                    Q(reporting_manager_id=current_manager.id) |
-                    Q(reporting_manager__icontains=current_manager.first_name)
-                    ).order_by('first_name').exclude(id=employee.id)  # exclude self
+        team_members = HierarchyService.team_of(current_manager, depth=1).order_by('first_name').exclude(id=employee.id)  # exclude self
     else:
         team_members = Employee.objects.filter(department__iexact=employee.department).exclude(id=employee.id)  # exclude self
     context = {
@@ -988,10 +982,13 @@ def add_employee(request):
                 # Employment Details
                 department=department,
                 department_id=department_id,
+                department_ref=department_instance,
                 designation=designation,
                 designation_id=designation_id,
+                designation_ref=designation_instance,
                 location=location,
                 location_id=location_id,
+                location_ref=location_instance,
                 reporting_manager=reporting_manager_full,
                 reporting_manager_id=reporting_manager_id,
                 role=request.POST.get('role'),
@@ -1218,7 +1215,6 @@ def employee_page(request):
    
     # Get current user details
     user_role = request.session.get('user_role')
-    user_email = request.session.get('user_email')
     user_name = request.session.get('user_name')
    
     # Start with appropriate employee list based on role
@@ -1229,13 +1225,10 @@ def employee_page(request):
     elif user_role == 'MANAGER' or user_role == 'TL':
         try:
             # Get the current manager's employee record
-            current_manager = Employee.objects.get(email=user_email)
+            current_manager = get_current_employee(request)
            
-            # Filter by reporting_manager_id OR by reporting_manager name (fallback)
-            employees_list = Employee.objects.filter(
-                Q(reporting_manager_id=current_manager.id) |
-                Q(reporting_manager__icontains=current_manager.first_name)
-            ).order_by('first_name')
+            # Direct reports in the reporting hierarchy
+            employees_list = HierarchyService.team_of(current_manager, depth=1).order_by('first_name')
            
             filter_info = f"Showing employees under {user_name}"
            
@@ -1246,7 +1239,7 @@ def employee_page(request):
     elif user_role == 'BRANCH MANAGER':
         try:
             # Get the current branch manager's employee record
-            current_branch_manager = Employee.objects.get(email=user_email)
+            current_branch_manager = get_current_employee(request)
             
             # Get the branch manager's location
             branch_manager_location = current_branch_manager.location
@@ -1254,7 +1247,7 @@ def employee_page(request):
             if branch_manager_location:
                 # Show all employees with the same location
                 employees_list = Employee.objects.filter(
-                    location__iexact=branch_manager_location
+                    current_branch_manager.branch_lookup()
                 ).order_by('first_name')
                 
                 filter_info = f"Showing employees from {branch_manager_location} location"
@@ -1501,6 +1494,7 @@ def edit_employee(request, employee_id):
             else:
                 employee.department = request.POST.get('department')
                 employee.department_id = None
+            employee.department_ref = department_instance
 
             if designation_instance:
                 employee.designation = designation_instance.title
@@ -1508,6 +1502,7 @@ def edit_employee(request, employee_id):
             else:
                 employee.designation = request.POST.get('designation')
                 employee.designation_id = None
+            employee.designation_ref = designation_instance
 
             if location_instance:
                 employee.location = location_instance.name
@@ -1515,6 +1510,7 @@ def edit_employee(request, employee_id):
             else:
                 employee.location = request.POST.get('location')
                 employee.location_id = None
+            employee.location_ref = location_instance
 
             employee.reporting_manager = reporting_manager_full
             employee.reporting_manager_id = reporting_manager_id
@@ -1721,7 +1717,6 @@ def home(request):
 @login_required
 def update_employee_profile(request):
     """Allow active employees to update their own profile"""
-    user_email = request.session.get('user_email')
     user_role = request.session.get('user_role')
     
     # Only allow employees to update their own profile
@@ -1730,7 +1725,7 @@ def update_employee_profile(request):
     #     return redirect('access_denied')
     
     try:
-        employee = Employee.objects.get(email=user_email, status='active')
+        employee = get_current_employee(request, active_only=True)
     except Employee.DoesNotExist:
         messages.error(request, 'Employee profile not found or inactive.')
         return redirect('employee_dashboard')
@@ -2887,6 +2882,9 @@ def assign_permissions(request):
                         print(f"Menu link {item_id} does not exist")
                         continue
             
+            # The bulk status reset above bypasses post_save, so refresh the sidebar cache here
+            MenuService.invalidate()
+            
             return JsonResponse({'success': True, 'message': 'Permissions assigned successfully!'})
         
         except Exception as e:
@@ -3005,9 +3003,8 @@ def send_celebration_wish(request):
             wish_type = data.get('wish_type')
             
             # Get wisher (current user)
-            user_email = request.session.get('user_email')
             try:
-                wisher = Employee.objects.get(email=user_email, status='active')
+                wisher = get_current_employee(request, active_only=True)
                 celebrant = Employee.objects.get(id=celebrant_id, status='active')
                 
                 # Create wish
@@ -3281,4 +3278,15 @@ def message_subtype_delete(request, pk):
     subtype = get_object_or_404(MessageSubType, pk=pk)
     subtype.delete()
     messages.success(request, "Subtype deleted successfully!")
-    return redirect("warning_master_list")
\ No newline at end of file
+    return redirect("warning_master_list")
+
+
+def metrics(request):
+    """Per-view request metrics in the Prometheus text format"""
+    allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and request.session.get('user_role') != 'SUPER ADMIN':
+        return HttpResponse(status=403)
+    return HttpResponse(
+        RequestMetrics.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'hr.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -152,4 +154,67 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 SESSION_SAVE_EVERY_REQUEST = True  # This extends session on each request
 
 # Database-backed sessions (recommended for production)
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
\ No newline at end of file
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+# Shared cache (menu trees, lookups) - file based so every worker process sees the same entries.
+# Per-session and per-feed keys add up quickly, so allow far more than the default 300 entries
+# before culling. The version counters those lookups are keyed by live in 'versions', which
+# holds nothing else and therefore never culls (see hr.services.CacheVersion).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'hrms_cache'),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'hrms_cache_versions'),
+        'TIMEOUT': None,
+    },
+}
+
+# Payroll: working days (up to the run date) with neither attendance nor approved
+# leave are unexcused absences and are not paid. Turn off to pay them in full;
+# they are still reported as absent_days for salary formulas.
+PAYROLL_DEDUCT_ABSENT_DAYS = True
+
+# Request instrumentation (hr.middleware.RequestMetricsMiddleware)
+SLOW_REQUEST_MS = 1000
+# Maximum SQL queries per request, by URL name; exceeding one is logged,
+# or raised as hr.metrics.QueryBudgetExceeded when QUERY_BUDGET_RAISE is on (tests)
+QUERY_BUDGETS = {
+    'attendance:report': 15,
+    'attendance:download_admin_report': 15,
+    'leave_balance_list': 10,
+    'leave_dashboard': 12,
+}
+QUERY_BUDGET_RAISE = False
+# Clients allowed to scrape /metrics/ without a SUPER ADMIN session. Empty by default:
+# behind a local reverse proxy every request arrives from 127.0.0.1.
+METRICS_ALLOWED_IPS = []
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'hrms.slow_requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        # Status lines of the accrual / carry forward / year-end jobs
+        'leave.services': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leave', '0007_leavetype_accrual_rate_leavetype_can_use_same_month_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leave',
+            index=models.Index(fields=['status', 'start_date', 'end_date'], name='leave_status_dates_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_existing_balances(apps, schema_editor):
+    """Seed the ledger with one opening entry per existing balance so replays match today's values"""
+    LeaveBalance = apps.get_model('leave', 'LeaveBalance')
+    LeaveBalanceTransaction = apps.get_model('leave', 'LeaveBalanceTransaction')
+
+    batch = []
+    for balance in LeaveBalance.objects.all().iterator(chunk_size=2000):
+        batch.append(LeaveBalanceTransaction(
+            balance_id=balance.pk,
+            kind='opening',
+            total_delta=balance.total_leaves or 0,
+            taken_delta=balance.leaves_taken or 0,
+            remaining_delta=balance.leaves_remaining or 0,
+            carry_forward_delta=balance.carry_forward or 0,
+            note='Balance before the ledger was introduced',
+        ))
+        if len(batch) >= 1000:
+            LeaveBalanceTransaction.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        LeaveBalanceTransaction.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leave', '0008_leave_status_dates_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaveBalanceTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opening', 'Opening Balance'), ('accrual', 'Accrual'), ('deduction', 'Deduction'), ('restoration', 'Restoration'), ('carry_forward', 'Carry Forward'), ('expiry', 'Expiry'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('total_delta', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('taken_delta', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('remaining_delta', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('carry_forward_delta', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('balance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='leave.leavebalance')),
+                ('leave', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='balance_transactions', to='leave.leave')),
+            ],
+            options={
+                'db_table': 'leave_balance_transactions',
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['balance', 'created_at'], name='leave_baltxn_balance_idx')],
+            },
+        ),
+        migrations.RunPython(open_existing_balances, migrations.RunPython.noop),
+    ]
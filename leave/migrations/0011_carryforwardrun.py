@@ -0,0 +1,32 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leave', '0010_accrualrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarryForwardRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_year', models.IntegerField(unique=True)),
+                ('to_year', models.IntegerField()),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed')], default='running', max_length=20)),
+                ('last_employee_id', models.IntegerField(default=0)),
+                ('employees_processed', models.IntegerField(default=0)),
+                ('days_carried', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('days_forfeited', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('leave_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='carry_forward_runs', to='leave.leavetype')),
+            ],
+            options={
+                'db_table': 'leave_carry_forward_runs',
+                'ordering': ['-from_year'],
+            },
+        ),
+    ]
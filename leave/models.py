@@ -143,36 +143,18 @@ class Leave(models.Model):
         super().save(*args, **kwargs)
 
     def get_working_days(self):
-        """Calculate working days excluding weekends and holidays"""
+        """Calculate working days excluding Sundays and mandatory holidays"""
         # If it's a half day, return 0.5
         if self.is_half_day:
             return Decimal('0.5')
         
-        total_days = (self.end_date - self.start_date).days + 1
-        working_days = 0
-        current_date = self.start_date
+        from leave.services import WorkingDayCalendar
         
-        # Get employee's region holidays
-        holiday_dates = set()
-        if hasattr(self.employee, 'location') and self.employee.location:
-            try:
-                region = Location.objects.filter(name__iexact=self.employee.location).first()
-                if region:
-                    holidays = Holiday.objects.filter(
-                        region=region,
-                        date__gte=self.start_date,
-                        date__lte=self.end_date
-                    )
-                    holiday_dates = set(h.date for h in holidays)
-            except:
-                pass
-        
-        # Count working days (excluding weekends and holidays)
-        while current_date <= self.end_date:
-            # 5 = Saturday, 6 = Sunday
-            if current_date.weekday() < 5 and current_date not in holiday_dates:
-                working_days += 1
-            current_date += timedelta(days=1)
+        # Same rules as the apply-leave form: Sundays and mandatory holidays are off
+        region_id = None
+        if self.employee.location:
+            region_id = self.employee.holiday_region_id
+        working_days = WorkingDayCalendar.count_working_days(region_id, self.start_date, self.end_date)
         
         return Decimal(str(working_days))
 
@@ -185,6 +167,11 @@ class Leave(models.Model):
 
     class Meta:
         ordering = ['-applied_date']
+        indexes = [
+            models.Index(fields=['status', 'start_date', 'end_date'], name='leave_status_dates_idx'),
+            # Overlap lookups for a set of employees (LeaveIntervalService)
+            models.Index(fields=['employee', 'start_date', 'end_date'], name='leave_emp_dates_idx'),
+        ]
 
         
 class LeaveBalance(models.Model):
@@ -223,5 +210,105 @@ class LeaveBalance(models.Model):
     @property
     def is_comp_off(self):
         """Check if this is a comp off balance"""
-        comp_off_keywords = ['comp off', 'compensatory', 'compoff', 'comp-off']
-        return any(keyword in self.leave_type.name.lower() for keyword in comp_off_keywords)
\ No newline at end of file
+        from leave.services import LeaveTypeRegistry
+        return LeaveTypeRegistry.is_kind(self.leave_type, 'comp_off')
+
+class LeaveBalanceTransaction(models.Model):
+    """
+    Append-only ledger of every change to a LeaveBalance row.
+    Replaying a balance's transactions gives its current values
+    (see `manage.py rebuild_leave_balances`).
+    """
+    KIND_CHOICES = [
+        ('opening', 'Opening Balance'),
+        ('accrual', 'Accrual'),
+        ('deduction', 'Deduction'),
+        ('restoration', 'Restoration'),
+        ('carry_forward', 'Carry Forward'),
+        ('expiry', 'Expiry'),
+        ('adjustment', 'Adjustment'),
+    ]
+    
+    balance = models.ForeignKey(LeaveBalance, on_delete=models.CASCADE, related_name='transactions')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    total_delta = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    taken_delta = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    remaining_delta = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    carry_forward_delta = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    leave = models.ForeignKey(
+        Leave,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='balance_transactions'
+    )
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'leave_balance_transactions'
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['balance', 'created_at'], name='leave_baltxn_balance_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.remaining_delta:+} ({self.balance_id})"
+
+
+class AccrualRun(models.Model):
+    """
+    One row per monthly accrual (year, month). Chunks record how far they
+    got in last_employee_id, so a rerun resumes and a completed run is a no-op.
+    """
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+    ]
+    
+    year = models.IntegerField()
+    month = models.PositiveSmallIntegerField()
+    leave_type = models.ForeignKey(LeaveType, on_delete=models.PROTECT, related_name='accrual_runs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    last_employee_id = models.IntegerField(default=0)
+    employees_accrued = models.IntegerField(default=0)
+    days_accrued = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'leave_accrual_runs'
+        unique_together = ['year', 'month']
+        ordering = ['-year', '-month']
+    
+    def __str__(self):
+        return f"Accrual {self.month:02d}/{self.year} ({self.status})"
+
+
+class CarryForwardRun(models.Model):
+    """
+    One row per year-end carry forward (from_year -> to_year). Works like
+    AccrualRun: each committed chunk moves last_employee_id forward.
+    """
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+    ]
+    
+    from_year = models.IntegerField(unique=True)
+    to_year = models.IntegerField()
+    leave_type = models.ForeignKey(LeaveType, on_delete=models.PROTECT, related_name='carry_forward_runs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    last_employee_id = models.IntegerField(default=0)
+    employees_processed = models.IntegerField(default=0)
+    days_carried = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    days_forfeited = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'leave_carry_forward_runs'
+        ordering = ['-from_year']
+    
+    def __str__(self):
+        return f"Carry forward {self.from_year} -> {self.to_year} ({self.status})"
@@ -1,12 +1,330 @@
 # leave/services.py
+import csv
+import hashlib
 from django.utils import timezone
 from datetime import datetime, date, timedelta
 from django.db import transaction
 from dateutil.relativedelta import relativedelta
-from decimal import Decimal
-from .models import Leave, LeaveBalance, LeaveType, Holiday
+from decimal import Decimal, ROUND_HALF_UP
+from django.core.cache import cache
+from django.db.models import Count, DurationField, ExpressionWrapper, F, FilteredRelation, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import TruncDate
+from .models import AccrualRun, CarryForwardRun, Leave, LeaveBalance, LeaveBalanceTransaction, LeaveType, Holiday
 from hr.models import Employee
+from hr.services import CacheVersion, HierarchyService
 import calendar
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LeaveTypeRegistry:
+    """
+    Leave types loaded once per process and looked up by canonical kind
+    (earned, unpaid, optional, comp_off, sick) instead of by fuzzy name.
+
+    The rows are reloaded whenever the shared version key moves; hr.signals
+    bumps it after any LeaveType save or delete, so every process picks up
+    the change on its next lookup. The returned LeaveType instances are
+    shared, so callers must not modify them.
+    """
+
+    KINDS = ('earned', 'unpaid', 'optional', 'comp_off', 'sick')
+    COMP_OFF_KEYWORDS = ('comp off', 'comp_off', 'compensatory', 'compoff', 'comp-off')
+    EARNED_ACCRUAL_RATE = Decimal('1.5')
+
+    VERSION_KEY = 'leave_types:version'
+
+    _types = {}
+    _kinds = {}
+    _version = None
+
+    @staticmethod
+    def kind_of(leave_type):
+        """Canonical kind of a LeaveType, or None for types with no special handling"""
+        name = (leave_type.name or '').lower()
+        if 'unpaid' in name:
+            return 'unpaid'
+        if any(keyword in name for keyword in LeaveTypeRegistry.COMP_OFF_KEYWORDS):
+            return 'comp_off'
+        if leave_type.is_optional or 'optional' in name:
+            return 'optional'
+        if 'sick' in name:
+            return 'sick'
+        if leave_type.accrual_rate == LeaveTypeRegistry.EARNED_ACCRUAL_RATE or 'earned' in name or 'annual' in name:
+            return 'earned'
+        return None
+
+    @staticmethod
+    def _load():
+        version = CacheVersion.get(LeaveTypeRegistry.VERSION_KEY)
+        if version != LeaveTypeRegistry._version:
+            types = {leave_type.pk: leave_type for leave_type in LeaveType.objects.order_by('id')}
+            LeaveTypeRegistry._kinds = {
+                pk: LeaveTypeRegistry.kind_of(leave_type) for pk, leave_type in types.items()
+            }
+            LeaveTypeRegistry._types = types
+            LeaveTypeRegistry._version = version
+        return LeaveTypeRegistry._types
+
+    @staticmethod
+    def all(active_only=True):
+        types = LeaveTypeRegistry._load().values()
+        return [leave_type for leave_type in types if leave_type.is_active or not active_only]
+
+    @staticmethod
+    def by_id(pk):
+        return LeaveTypeRegistry._load().get(int(pk))
+
+    @staticmethod
+    def of_kind(kind, active_only=True):
+        """Every leave type of a kind, oldest first"""
+        return [
+            leave_type for leave_type in LeaveTypeRegistry.all(active_only)
+            if LeaveTypeRegistry._kinds.get(leave_type.pk) == kind
+        ]
+
+    @staticmethod
+    def get(kind, active_only=True):
+        """The (oldest) leave type of a kind, or None"""
+        types = LeaveTypeRegistry.of_kind(kind, active_only)
+        return types[0] if types else None
+
+    @staticmethod
+    def get_or_create(kind, name, defaults=None):
+        """The leave type of a kind, creating it under `name` if there is none (active or not)"""
+        leave_type = LeaveTypeRegistry.get(kind, active_only=False)
+        if leave_type is None:
+            leave_type, created = LeaveType.objects.get_or_create(name=name, defaults=defaults or {})
+            LeaveTypeRegistry.invalidate()
+        return leave_type
+
+    @staticmethod
+    def ids(*kinds):
+        """Primary keys of every leave type (active or not) of the given kinds"""
+        LeaveTypeRegistry._load()
+        return [pk for pk, kind in LeaveTypeRegistry._kinds.items() if kind in kinds]
+
+    @staticmethod
+    def is_kind(leave_type, kind):
+        if leave_type is None:
+            return False
+        types = LeaveTypeRegistry._load()
+        if leave_type.pk in types:
+            return LeaveTypeRegistry._kinds[leave_type.pk] == kind
+        return LeaveTypeRegistry.kind_of(leave_type) == kind
+
+    @staticmethod
+    def invalidate():
+        """Reload leave types in every process (called when a LeaveType is saved or deleted)"""
+        LeaveTypeRegistry._version = None
+        CacheVersion.bump(LeaveTypeRegistry.VERSION_KEY)
+
+
+class LeaveLedgerService:
+    """
+    The only code path that changes LeaveBalance amounts.
+
+    Every change is a single conditional UPDATE with F() expressions (so two
+    concurrent approvals cannot overwrite each other) plus a
+    LeaveBalanceTransaction row, written in one transaction.
+    """
+    
+    # ledger delta field -> LeaveBalance field
+    FIELDS = {
+        'total_delta': 'total_leaves',
+        'taken_delta': 'leaves_taken',
+        'remaining_delta': 'leaves_remaining',
+        'carry_forward_delta': 'carry_forward',
+    }
+    
+    @staticmethod
+    def _pk(balance):
+        return balance.pk if isinstance(balance, LeaveBalance) else balance
+    
+    @staticmethod
+    def apply(balance, kind, total=0, taken=0, remaining=0, carry_forward=0,
+              leave=None, note='', min_remaining=None):
+        """
+        Add the given amounts to a balance and record them in the ledger.
+        With min_remaining the change only happens while leaves_remaining is
+        at least that much; returns False when nothing was changed.
+        """
+        deltas = {
+            'total_delta': Decimal(str(total or 0)),
+            'taken_delta': Decimal(str(taken or 0)),
+            'remaining_delta': Decimal(str(remaining or 0)),
+            'carry_forward_delta': Decimal(str(carry_forward or 0)),
+        }
+        changes = {
+            LeaveLedgerService.FIELDS[name]: F(LeaveLedgerService.FIELDS[name]) + value
+            for name, value in deltas.items() if value
+        }
+        if not changes:
+            return False
+        
+        balance_id = LeaveLedgerService._pk(balance)
+        with transaction.atomic():
+            rows = LeaveBalance.objects.filter(pk=balance_id)
+            if min_remaining is not None:
+                rows = rows.filter(leaves_remaining__gte=Decimal(str(min_remaining)))
+            if not rows.update(updated_at=timezone.now(), **changes):
+                return False
+            LeaveBalanceTransaction.objects.create(
+                balance_id=balance_id,
+                kind=kind,
+                leave=leave,
+                note=note[:255],
+                **deltas
+            )
+        
+        if isinstance(balance, LeaveBalance):
+            balance.refresh_from_db(fields=list(LeaveLedgerService.FIELDS.values()) + ['updated_at'])
+        return True
+    
+    @staticmethod
+    def adjust_to(balance, kind='adjustment', leave=None, note='', **values):
+        """
+        Set absolute amounts (e.g. leaves_remaining=0) under a row lock and
+        record the difference; values use the LeaveBalance field names
+        """
+        balance_id = LeaveLedgerService._pk(balance)
+        with transaction.atomic():
+            current = LeaveBalance.objects.select_for_update().values(*values).get(pk=balance_id)
+            amounts = {
+                name.replace('_delta', ''): Decimal(str(values[field])) - (current[field] or 0)
+                for name, field in LeaveLedgerService.FIELDS.items() if field in values
+            }
+            return LeaveLedgerService.apply(balance, kind, leave=leave, note=note, **amounts)
+    
+    @staticmethod
+    def get_or_create(employee, leave_type, year, defaults=None, kind='opening', note='Opening balance'):
+        """
+        LeaveBalance.objects.get_or_create() whose starting amounts go through
+        the ledger, so a replay of a new balance matches what was created
+        """
+        defaults = dict(defaults or {})
+        amounts = {
+            name.replace('_delta', ''): defaults.pop(field, 0)
+            for name, field in LeaveLedgerService.FIELDS.items()
+        }
+        balance, created = LeaveBalance.objects.get_or_create(
+            employee=employee,
+            leave_type=leave_type,
+            year=year,
+            defaults=defaults
+        )
+        if created:
+            LeaveLedgerService.apply(balance, kind, note=note, **amounts)
+        return balance, created
+    
+    @staticmethod
+    def ensure_balances(leave_type, year, employee_ids):
+        """{employee id: balance id} for leave_type/year, bulk creating missing (zero) balances"""
+        balance_ids = dict(LeaveBalance.objects.filter(
+            leave_type=leave_type,
+            year=year,
+            employee_id__in=employee_ids
+        ).values_list('employee_id', 'id'))
+        
+        missing = [employee_id for employee_id in employee_ids if employee_id not in balance_ids]
+        if missing:
+            # New rows start at zero, which is also what an empty ledger replays to
+            LeaveBalance.objects.bulk_create([
+                LeaveBalance(employee_id=employee_id, leave_type=leave_type, year=year)
+                for employee_id in missing
+            ], ignore_conflicts=True)
+            balance_ids.update(LeaveBalance.objects.filter(
+                leave_type=leave_type,
+                year=year,
+                employee_id__in=missing
+            ).values_list('employee_id', 'id'))
+        return balance_ids
+    
+    @staticmethod
+    def bulk_apply(entries, kind, note):
+        """
+        Apply many changes at once: entries are (balance id, leave, {delta
+        name: amount}) using apply()'s names (total, taken, remaining,
+        carry_forward). Changes to the same balance are summed into one
+        UPDATE ... F(); every entry still gets its own ledger row. The caller
+        validates amounts (and holds the row locks) inside a transaction.
+        """
+        per_balance = {}
+        rows = []
+        for balance_id, leave, amounts in entries:
+            deltas = {
+                f'{name}_delta': Decimal(str(amounts.get(name) or 0))
+                for name in ('total', 'taken', 'remaining', 'carry_forward')
+            }
+            summed = per_balance.setdefault(balance_id, dict.fromkeys(deltas, Decimal('0')))
+            for name, value in deltas.items():
+                summed[name] += value
+            rows.append(LeaveBalanceTransaction(
+                balance_id=balance_id, kind=kind, leave=leave, note=note, **deltas
+            ))
+        
+        now = timezone.now()
+        for balance_id, deltas in per_balance.items():
+            changes = {
+                LeaveLedgerService.FIELDS[name]: F(LeaveLedgerService.FIELDS[name]) + value
+                for name, value in deltas.items() if value
+            }
+            if changes:
+                LeaveBalance.objects.filter(pk=balance_id).update(updated_at=now, **changes)
+        LeaveBalanceTransaction.objects.bulk_create(rows)
+    
+    @staticmethod
+    def bulk_credit(leave_type, year, amounts, kind, note, carry_forward=False):
+        """
+        Add {employee id: days} to total and remaining (and carry_forward if
+        asked) of each employee's balance for leave_type/year, creating
+        missing balances. Set-based: one UPDATE ... F() per distinct amount
+        and one bulk insert of ledger rows. Call inside a transaction.
+        """
+        balance_ids = LeaveLedgerService.ensure_balances(leave_type, year, list(amounts))
+        
+        by_amount = {}
+        for employee_id, amount in amounts.items():
+            by_amount.setdefault(amount, []).append(balance_ids[employee_id])
+        
+        now = timezone.now()
+        for amount, ids in by_amount.items():
+            changes = {
+                'total_leaves': F('total_leaves') + amount,
+                'leaves_remaining': F('leaves_remaining') + amount,
+            }
+            if carry_forward:
+                changes['carry_forward'] = F('carry_forward') + amount
+            LeaveBalance.objects.filter(pk__in=ids).update(updated_at=now, **changes)
+        
+        LeaveBalanceTransaction.objects.bulk_create([
+            LeaveBalanceTransaction(
+                balance_id=balance_ids[employee_id],
+                kind=kind,
+                total_delta=amount,
+                remaining_delta=amount,
+                carry_forward_delta=amount if carry_forward else 0,
+                note=note
+            )
+            for employee_id, amount in amounts.items()
+        ])
+        return balance_ids
+    
+    @staticmethod
+    def replay(balance_ids=None):
+        """{balance id: {LeaveBalance field: amount}} summed from the ledger"""
+        transactions = LeaveBalanceTransaction.objects.all()
+        if balance_ids is not None:
+            transactions = transactions.filter(balance_id__in=balance_ids)
+        totals = transactions.order_by().values('balance_id').annotate(
+            **{field: Sum(name) for name, field in LeaveLedgerService.FIELDS.items()}
+        )
+        return {
+            row.pop('balance_id'): row
+            for row in totals
+        }
+
 
 class LeaveAccrualService:
     """Handles monthly leave accrual of 1.5 days per month"""
@@ -32,42 +350,131 @@ class LeaveAccrualService:
     def process_monthly_accrual_for_all():
         """Process monthly accrual for all active employees"""
         today = timezone.now().date()
-        current_month = today.month
-        current_year = today.year
         
         # Only process on 1st of each month
         if today.day != 1:
             return
         
-        active_employees = Employee.objects.filter(status='active')
-        annual_leave_type, created = LeaveType.objects.get_or_create(
-            name='Earned',
-            defaults={'max_days': 18, 'is_active': True}
+        return MonthlyAccrualService.run(today.year, today.month)
+
+
+class MonthlyAccrualService:
+    """
+    Set-based monthly Earned Leave accrual.
+
+    Eligibility for every active employee is worked out from one query, then
+    employees are processed in chunks through LeaveLedgerService.bulk_credit.
+    Each chunk commits together with the AccrualRun cursor, so a failed run
+    can be retried and a finished one is a no-op.
+    """
+    
+    CHUNK_SIZE = 500
+    PRORATE_WINDOW_DAYS = 30
+    
+    @staticmethod
+    def get_leave_type():
+        """The active leave type that accrues 1.5 days a month (Earned Leave)"""
+        return LeaveTypeRegistry.get('earned')
+    
+    @staticmethod
+    def accrual_amount(row, rate, year, month, as_of):
+        """
+        Days to accrue for one employee row (values() of Employee).
+
+        - no accrual in the joining month unless they joined on the 1st
+        - no accrual while on probation
+        - probation ending in this month: rate prorated from the end date
+        """
+        joined = row['date_of_joining']
+        if joined and joined.year == year and joined.month == month and joined.day > 1:
+            return Decimal('0')
+        
+        probation_end = row['probation_end_date']
+        if not probation_end and joined:
+            probation_end = joined + timedelta(days=int(row['probation_period_days'] or 90))
+        if not probation_end:
+            return rate
+        
+        days_since_end = (as_of - probation_end).days
+        if days_since_end < 0:
+            return Decimal('0')  # Still on probation
+        if days_since_end <= MonthlyAccrualService.PRORATE_WINDOW_DAYS and \
+                probation_end.year == year and probation_end.month == month:
+            days_in_month = calendar.monthrange(year, month)[1]
+            days_after_probation = days_in_month - probation_end.day + 1
+            amount = rate * Decimal(days_after_probation) / Decimal(days_in_month)
+            return amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        return rate
+    
+    @staticmethod
+    def eligible_amounts(leave_type, year, month, as_of=None):
+        """{employee id: days} for every active employee due an accrual, in id order"""
+        as_of = as_of or date.today()
+        rows = Employee.objects.filter(status='active').order_by('id').values(
+            'id', 'date_of_joining', 'probation_end_date', 'probation_period_days'
+        )
+        amounts = {}
+        for row in rows:
+            amount = MonthlyAccrualService.accrual_amount(row, leave_type.accrual_rate, year, month, as_of)
+            if amount > 0:
+                amounts[row['id']] = amount
+        return amounts
+    
+    @staticmethod
+    def run(year=None, month=None, as_of=None, chunk_size=None):
+        """
+        Accrue Earned Leave for (year, month), defaulting to this month.
+        Returns the number of employees accrued by this call; 0 when the
+        month has already been completed.
+        """
+        today = date.today()
+        year = year or today.year
+        month = month or today.month
+        chunk_size = chunk_size or MonthlyAccrualService.CHUNK_SIZE
+        
+        leave_type = MonthlyAccrualService.get_leave_type()
+        if not leave_type:
+            return 0
+        
+        run, created = AccrualRun.objects.get_or_create(
+            year=year,
+            month=month,
+            defaults={'leave_type': leave_type}
         )
+        if run.status == 'completed':
+            logger.info("Accrual for %02d/%s already completed, skipping", month, year)
+            return 0
         
-        for employee in active_employees:
-            accrual_amount = LeaveAccrualService.calculate_monthly_accrual(
-                employee, current_month, current_year
-            )
-            
-            if accrual_amount > 0:
-                with transaction.atomic():
-                    balance, created = LeaveBalance.objects.get_or_create(
-                        employee=employee,
-                        leave_type=annual_leave_type,
-                        year=current_year,
-                        defaults={
-                            'total_leaves': accrual_amount,
-                            'leaves_remaining': accrual_amount,
-                            'leaves_taken': 0,
-                            'carry_forward': 0
-                        }
-                    )
-                    
-                    if not created:
-                        balance.total_leaves += accrual_amount
-                        balance.leaves_remaining += accrual_amount
-                        balance.save()
+        amounts = MonthlyAccrualService.eligible_amounts(run.leave_type, year, month, as_of)
+        employee_ids = list(amounts)
+        note = f"Monthly accrual {month:02d}/{year}"
+        accrued = 0
+        
+        for start in range(0, len(employee_ids), chunk_size):
+            chunk = employee_ids[start:start + chunk_size]
+            with transaction.atomic():
+                # The lock makes concurrent runs take turns; the cursor skips
+                # whatever another run (or an earlier attempt) already did
+                run = AccrualRun.objects.select_for_update().get(pk=run.pk)
+                if run.status == 'completed':
+                    break
+                pending = {
+                    employee_id: amounts[employee_id]
+                    for employee_id in chunk if employee_id > run.last_employee_id
+                }
+                if not pending:
+                    continue
+                LeaveLedgerService.bulk_credit(run.leave_type, run.year, pending, 'accrual', note)
+                employees, days = len(pending), sum(pending.values(), Decimal('0'))
+                run.last_employee_id = chunk[-1]
+                run.employees_accrued = F('employees_accrued') + employees
+                run.days_accrued = F('days_accrued') + days
+                run.save(update_fields=['last_employee_id', 'employees_accrued', 'days_accrued'])
+                accrued += employees
+        
+        AccrualRun.objects.filter(pk=run.pk).update(status='completed', completed_at=timezone.now())
+        logger.info("Accrual for %02d/%s: %s employees", month, year, accrued)
+        return accrued
 
 class OptionalLeaveService:
     """Manages optional leave rules (4 days/year, use only 2, lose remaining 2)"""
@@ -75,15 +482,15 @@ class OptionalLeaveService:
     @staticmethod
     def initialize_optional_leave(employee, year):
         """Initialize optional leave balance for the year"""
-        optional_leave_type, created = LeaveType.objects.get_or_create(
-            name='optional',
+        optional_leave_type = LeaveTypeRegistry.get_or_create(
+            'optional', 'optional',
             defaults={'max_days': 4, 'is_active': True}
         )
         
-        balance, created = LeaveBalance.objects.get_or_create(
-            employee=employee,
-            leave_type=optional_leave_type,
-            year=year,
+        balance, created = LeaveLedgerService.get_or_create(
+            employee,
+            optional_leave_type,
+            year,
             defaults={
                 'total_leaves': 4,
                 'leaves_remaining': 4,
@@ -97,7 +504,7 @@ class OptionalLeaveService:
     def can_use_optional_leave(employee, days_requested, year):
         """Check if employee can use optional leave"""
         try:
-            optional_leave_type = LeaveType.objects.get(name='optional')
+            optional_leave_type = LeaveTypeRegistry.get('optional', active_only=False)
             balance = LeaveBalance.objects.get(
                 employee=employee,
                 leave_type=optional_leave_type,
@@ -278,107 +685,151 @@ class CarryForwardService:
         fy_end = fy_start + 1
         return fy_start, fy_end
     
+    CHUNK_SIZE = 500
+    
     @staticmethod
-    @transaction.atomic
-    def process_year_end_carry_forward():
+    def get_leave_type():
+        """Earned Leave: the active leave type accruing 1.5 days a month"""
+        return MonthlyAccrualService.get_leave_type()
+    
+    @staticmethod
+    def carry_forward_plan(from_year, to_year, leave_type=None):
         """
-        Process carry forward for all employees at FINANCIAL year end (April 1st)
-        Call this on April 1st
+        Proposed carry forward for every active employee with Earned Leave
+        left in from_year, worked out in one query and ordered by employee.
         """
-        from hr.models import Employee
+        leave_type = leave_type or CarryForwardService.get_leave_type()
+        if not leave_type:
+            return []
         
-        current_date = date.today()
-        print(f"DEBUG: Current date for carry forward: {current_date}")
+        next_balance = LeaveBalance.objects.filter(
+            employee_id=OuterRef('employee_id'),
+            leave_type=leave_type,
+            year=to_year
+        ).values('id')[:1]
+        rows = LeaveBalance.objects.filter(
+            leave_type=leave_type,
+            year=from_year,
+            employee__status='active',
+            leaves_remaining__gt=0
+        ).annotate(
+            next_balance_id=Subquery(next_balance)
+        ).order_by('employee_id').values(
+            'id', 'employee_id', 'employee__employee_id', 'employee__first_name', 'employee__last_name',
+            'total_leaves', 'leaves_taken', 'leaves_remaining', 'next_balance_id'
+        )
         
-        # Get financial year that just ended
-        # On April 1st 2025, we carry forward from FY 2024-2025 (ended March 31st 2025)
-        fy_start, fy_end = CarryForwardService.get_financial_year(current_date)
+        plan = []
+        limit = Decimal(CarryForwardService.MAX_CARRY_FORWARD).quantize(Decimal('0.01'))
+        for row in rows:
+            remaining = row['leaves_remaining']
+            plan.append({
+                'balance_id': row['id'],
+                'employee_pk': row['employee_id'],
+                'employee_id': row['employee__employee_id'],
+                'employee_name': f"{row['employee__first_name']} {row['employee__last_name']}",
+                'financial_year': f"{from_year}-{from_year + 1}",
+                'total_allocated': row['total_leaves'],
+                'leaves_taken': row['leaves_taken'],
+                'leaves_remaining': remaining,
+                'carry_forward': min(remaining, limit),
+                'forfeited': max(Decimal('0.00'), remaining - limit),
+                'next_balance_id': row['next_balance_id'],
+            })
+        return plan
+    
+    @staticmethod
+    def write_plan_csv(plan, from_year, to_year, file):
+        """Write a carry forward plan (see carry_forward_plan) as CSV to an open file"""
+        writer = csv.writer(file)
+        writer.writerow([
+            'Employee ID', 'Employee Name', 'From Year', 'To Year', 'Total Allocated',
+            'Leaves Taken', 'Leaves Remaining', 'Carry Forward', 'Forfeited', 'Next Year Balance'
+        ])
+        for row in plan:
+            writer.writerow([
+                row['employee_id'], row['employee_name'], from_year, to_year, row['total_allocated'],
+                row['leaves_taken'], row['leaves_remaining'], row['carry_forward'], row['forfeited'],
+                'existing' if row['next_balance_id'] else 'new'
+            ])
+    
+    @staticmethod
+    def run(from_year, to_year=None, chunk_size=None):
+        """
+        Carry Earned Leave forward from from_year into to_year in chunks.
+
+        Each chunk adds the carried days to the next year's balances with
+        LeaveLedgerService.bulk_credit and moves the CarryForwardRun cursor in
+        the same short transaction, so the balances table is never locked for
+        the whole company and an interrupted run resumes where it stopped.
+        Returns the number of employees processed by this call.
+        """
+        to_year = to_year or from_year + 1
+        chunk_size = chunk_size or CarryForwardService.CHUNK_SIZE
         
-        # Since we're at year end, we need to get the PREVIOUS financial year
-        if current_date.month == CarryForwardService.FINANCIAL_YEAR_START_MONTH and current_date.day == 1:
-            # It's April 1st - process carry forward from previous FY
-            from_year = fy_start - 1  # Previous financial year start
-            to_year = fy_start        # Current financial year start
-        else:
-            print(f"DEBUG: Not financial year start (April 1st). Current date: {current_date}")
+        leave_type = CarryForwardService.get_leave_type()
+        if not leave_type:
+            logger.info("Earned Leave type not found, nothing to carry forward")
             return 0
         
-        print(f"DEBUG: Processing carry forward from FY {from_year}-{from_year+1} to {to_year}-{to_year+1}")
-        print(f"DEBUG: from_year: {from_year}, to_year: {to_year}")
-        
-        carried_forward_count = 0
-        
-        # Get Earned Leave type
-        try:
-            annual_leave = LeaveType.objects.get(
-                is_active=True,
-                accrual_rate=Decimal('1.5')
-            )
-        except LeaveType.DoesNotExist:
-            print("DEBUG: Earned Leave type not found")
+        run, created = CarryForwardRun.objects.get_or_create(
+            from_year=from_year,
+            defaults={'to_year': to_year, 'leave_type': leave_type}
+        )
+        if run.status == 'completed':
+            logger.info("Carry forward from %s already completed, skipping", from_year)
             return 0
         
-        # Get all active employees
-        employees = Employee.objects.filter(status='active')
-        print(f"DEBUG: Processing {employees.count()} active employees")
-        
-        for employee in employees:
-            try:
-                # Get previous financial year balance
-                prev_balance = LeaveBalance.objects.get(
-                    employee=employee,
-                    leave_type=annual_leave,
-                    year=from_year
+        plan = [
+            row for row in CarryForwardService.carry_forward_plan(from_year, run.to_year, run.leave_type)
+            if row['employee_pk'] > run.last_employee_id
+        ]
+        note = f"Carried forward from FY {from_year}-{from_year + 1}"
+        processed = 0
+        
+        for start in range(0, len(plan), chunk_size):
+            chunk = plan[start:start + chunk_size]
+            with transaction.atomic():
+                run = CarryForwardRun.objects.select_for_update().get(pk=run.pk)
+                if run.status == 'completed':
+                    break
+                pending = [row for row in chunk if row['employee_pk'] > run.last_employee_id]
+                if not pending:
+                    continue
+                LeaveLedgerService.bulk_credit(
+                    run.leave_type,
+                    run.to_year,
+                    {row['employee_pk']: row['carry_forward'] for row in pending},
+                    'carry_forward',
+                    note,
+                    carry_forward=True
                 )
-                
-                print(f"DEBUG: Employee {employee.first_name} - Previous year balance: {prev_balance.leaves_remaining} days")
-                
-                # Calculate carry forward (max 12 days)
-                remaining = prev_balance.leaves_remaining
-                carry_forward_amount = min(remaining, CarryForwardService.MAX_CARRY_FORWARD)
-                
-                if carry_forward_amount > 0:
-                    # Check if balance already exists for next year
-                    try:
-                        next_balance = LeaveBalance.objects.get(
-                            employee=employee,
-                            leave_type=annual_leave,
-                            year=to_year
-                        )
-                        created = False
-                        print(f"DEBUG: Existing balance found for {to_year}")
-                    except LeaveBalance.DoesNotExist:
-                        # Create new balance for next year
-                        next_balance = LeaveBalance.objects.create(
-                            employee=employee,
-                            leave_type=annual_leave,
-                            year=to_year,
-                            total_leaves=carry_forward_amount,
-                            leaves_taken=0,
-                            leaves_remaining=carry_forward_amount,
-                            carry_forward=carry_forward_amount
-                        )
-                        created = True
-                        print(f"DEBUG: Created new balance for {to_year}")
-                    
-                    if not created:
-                        # Update existing balance - Add to existing
-                        next_balance.carry_forward = float(next_balance.carry_forward or 0) + float(carry_forward_amount)
-                        next_balance.total_leaves = float(next_balance.total_leaves or 0) + float(carry_forward_amount)
-                        next_balance.leaves_remaining = float(next_balance.leaves_remaining or 0) + float(carry_forward_amount)
-                        next_balance.save()
-                    
-                    carried_forward_count += 1
-                    print(f"DEBUG: Carried forward {carry_forward_amount} days for {employee.first_name} "
-                          f"(from {prev_balance.leaves_remaining} remaining)")
-                    
-            except LeaveBalance.DoesNotExist:
-                # No balance in previous year, skip
-                print(f"DEBUG: No balance for {employee.first_name} in year {from_year}")
-                continue
+                run.last_employee_id = pending[-1]['employee_pk']
+                run.employees_processed = F('employees_processed') + len(pending)
+                run.days_carried = F('days_carried') + sum((row['carry_forward'] for row in pending), Decimal('0'))
+                run.days_forfeited = F('days_forfeited') + sum((row['forfeited'] for row in pending), Decimal('0'))
+                run.save(update_fields=['last_employee_id', 'employees_processed', 'days_carried', 'days_forfeited'])
+                processed += len(pending)
+        
+        CarryForwardRun.objects.filter(pk=run.pk).update(status='completed', completed_at=timezone.now())
+        logger.info("Carry forward %s -> %s: %s employees", from_year, run.to_year, processed)
+        return processed
+    
+    @staticmethod
+    def process_year_end_carry_forward():
+        """
+        Process carry forward for all employees at FINANCIAL year end (April 1st)
+        Call this on April 1st
+        """
+        current_date = date.today()
         
-        print(f"DEBUG: Total employees processed: {carried_forward_count}")
-        return carried_forward_count
+        # On April 1st 2025, we carry forward from FY 2024-2025 (ended March 31st 2025)
+        if current_date.month != CarryForwardService.FINANCIAL_YEAR_START_MONTH or current_date.day != 1:
+            logger.info("Not financial year start (April 1st), skipping carry forward. Current date: %s", current_date)
+            return 0
+        
+        fy_start, fy_end = CarryForwardService.get_financial_year(current_date)
+        return CarryForwardService.run(fy_start - 1, fy_start)
     
     @staticmethod
     def calculate_carry_forward_for_employee(employee, from_year):
@@ -388,10 +839,7 @@ class CarryForwardService:
         Returns: carry_forward_amount (max 12 days)
         """
         try:
-            annual_leave = LeaveType.objects.get(
-                is_active=True,
-                accrual_rate=Decimal('1.5')
-            )
+            annual_leave = LeaveTypeRegistry.get('earned')
             
             prev_balance = LeaveBalance.objects.get(
                 employee=employee,
@@ -419,47 +867,7 @@ class CarryForwardService:
         
         Returns: List of dicts with employee carry forward info
         """
-        from hr.models import Employee
-        
-        summary = []
-        
-        try:
-            annual_leave = LeaveType.objects.get(
-                is_active=True,
-                accrual_rate=Decimal('1.5')
-            )
-        except LeaveType.DoesNotExist:
-            return summary
-        
-        employees = Employee.objects.filter(status='active')
-        
-        for employee in employees:
-            try:
-                prev_balance = LeaveBalance.objects.get(
-                    employee=employee,
-                    leave_type=annual_leave,
-                    year=year  # Financial year start year
-                )
-                
-                remaining = prev_balance.leaves_remaining
-                carry_forward = min(remaining, CarryForwardService.MAX_CARRY_FORWARD)
-                forfeited = max(0, remaining - CarryForwardService.MAX_CARRY_FORWARD)
-                
-                summary.append({
-                    'employee_id': employee.employee_id,
-                    'employee_name': f"{employee.first_name} {employee.last_name}",
-                    'financial_year': f"{year}-{year+1}",
-                    'total_allocated': prev_balance.total_leaves,
-                    'leaves_taken': prev_balance.leaves_taken,
-                    'leaves_remaining': remaining,
-                    'carry_forward': carry_forward,
-                    'forfeited': forfeited
-                })
-                
-            except LeaveBalance.DoesNotExist:
-                continue
-        
-        return summary
+        return CarryForwardService.carry_forward_plan(year, year + 1)
 
     
 class AutoLeaveBalanceService:
@@ -481,29 +889,17 @@ class AutoLeaveBalanceService:
         created_balances = []
         
         # Get Earned Leave type
-        try:
-            annual_leave = LeaveType.objects.get(
-                is_active=True,
-                accrual_rate=Decimal('1.5')
-            )
-        except LeaveType.DoesNotExist:
-            annual_leave = None
+        annual_leave = LeaveTypeRegistry.get('earned')
         
         # Get Unpaid Leave type
-        try:
-            unpaid_leave = LeaveType.objects.get(
-                is_active=True,
-                name__icontains='unpaid'
-            )
-        except LeaveType.DoesNotExist:
-            unpaid_leave = None
+        unpaid_leave = LeaveTypeRegistry.get('unpaid')
         
         # Create Earned Leave Balance
         if annual_leave:
-            balance, created = LeaveBalance.objects.get_or_create(
-                employee=employee,
-                leave_type=annual_leave,
-                year=current_year,
+            balance, created = LeaveLedgerService.get_or_create(
+                employee,
+                annual_leave,
+                current_year,
                 defaults={
                     'total_leaves': 0,
                     'leaves_taken': 0,
@@ -523,9 +919,7 @@ class AutoLeaveBalanceService:
                 
                 if is_on_probation:
                     # Probation: 0 accrued, but can have carry forward
-                    balance.carry_forward = carry_forward_amount
-                    balance.total_leaves = carry_forward_amount
-                    balance.leaves_remaining = carry_forward_amount
+                    accrued_leaves = 0
                 else:
                     # Not on probation: Calculate accrued + carry forward
                     months_after_probation = ProbationService.get_months_after_probation(employee)
@@ -539,13 +933,16 @@ class AutoLeaveBalanceService:
                         # Joined in current year - count months from probation end
                         months_in_current_year = months_after_probation
                     
-                    accrued_leaves = float(Decimal(str(months_in_current_year)) * annual_leave.accrual_rate)
-                    
-                    balance.carry_forward = carry_forward_amount
-                    balance.total_leaves = accrued_leaves + carry_forward_amount
-                    balance.leaves_remaining = accrued_leaves + carry_forward_amount
+                    accrued_leaves = Decimal(str(months_in_current_year)) * annual_leave.accrual_rate
                 
-                balance.save()
+                opening = Decimal(str(accrued_leaves)) + Decimal(str(carry_forward_amount))
+                LeaveLedgerService.apply(
+                    balance, 'opening',
+                    total=opening,
+                    remaining=opening,
+                    carry_forward=carry_forward_amount,
+                    note='Opening balance for new employee'
+                )
                 created_balances.append(annual_leave.name)
                 
                 
@@ -555,8 +952,8 @@ class AutoLeaveBalanceService:
         # Only create optional leave if employee is NOT on probation
         if not is_on_probation:
             # Get or Create Optional Leave type
-            optional_leave_type, created = LeaveType.objects.get_or_create(
-                name='optional',
+            optional_leave_type = LeaveTypeRegistry.get_or_create(
+                'optional', 'optional',
                 defaults={
                     'max_days': 4, 
                     'is_active': True,
@@ -564,10 +961,10 @@ class AutoLeaveBalanceService:
                 }
             )
             
-            balance, created = LeaveBalance.objects.get_or_create(
-                employee=employee,
-                leave_type=optional_leave_type,
-                year=current_year,
+            balance, created = LeaveLedgerService.get_or_create(
+                employee,
+                optional_leave_type,
+                current_year,
                 defaults={
                     'total_leaves': 2,  # Only 2 days can be used out of 4 allocated
                     'leaves_taken': 0,
@@ -585,10 +982,10 @@ class AutoLeaveBalanceService:
         
         # Create Unpaid Leave Balance
         if unpaid_leave:
-            balance, created = LeaveBalance.objects.get_or_create(
-                employee=employee,
-                leave_type=unpaid_leave,
-                year=current_year,
+            balance, created = LeaveLedgerService.get_or_create(
+                employee,
+                unpaid_leave,
+                current_year,
                 defaults={
                     'total_leaves': 0,
                     'leaves_taken': 0,
@@ -612,29 +1009,17 @@ class AutoLeaveBalanceService:
         current_year = date.today().year
         
         # Get Earned Leave type
-        try:
-            annual_leave = LeaveType.objects.get(
-                is_active=True,
-                accrual_rate=Decimal('1.5')
-            )
-        except LeaveType.DoesNotExist:
-            annual_leave = None
+        annual_leave = LeaveTypeRegistry.get('earned')
         
         # Get Optional Leave type
-        try:
-            optional_leave = LeaveType.objects.get(
-                is_active=True,
-                is_optional=True
-            )
-        except LeaveType.DoesNotExist:
-            optional_leave = None
+        optional_leave = LeaveTypeRegistry.get('optional')
         
         # Update Earned Leave Balance
         if annual_leave:
-            balance, created = LeaveBalance.objects.get_or_create(
-                employee=employee,
-                leave_type=annual_leave,
-                year=current_year,
+            balance, created = LeaveLedgerService.get_or_create(
+                employee,
+                annual_leave,
+                current_year,
                 defaults={
                     'total_leaves': 0,
                     'leaves_taken': 0,
@@ -647,17 +1032,20 @@ class AutoLeaveBalanceService:
             months_after_probation = ProbationService.get_months_after_probation(employee)
             
             # Calculate accrued leaves (1.5 days per month after probation)
-            additional_leaves = float(Decimal(str(months_after_probation)) * annual_leave.accrual_rate)
-            balance.total_leaves = additional_leaves + balance.carry_forward
-            balance.leaves_remaining = additional_leaves + balance.carry_forward - balance.leaves_taken
-            balance.save()
+            additional_leaves = Decimal(str(months_after_probation)) * annual_leave.accrual_rate
+            LeaveLedgerService.adjust_to(
+                balance, 'accrual',
+                note='Accrual recalculated at probation end',
+                total_leaves=additional_leaves + balance.carry_forward,
+                leaves_remaining=additional_leaves + balance.carry_forward - balance.leaves_taken
+            )
         
         # Grant Optional Leave (2 days) - ONLY ADDED THIS PART
         if optional_leave:
-            balance, created = LeaveBalance.objects.get_or_create(
-                employee=employee,
-                leave_type=optional_leave,
-                year=current_year,
+            balance, created = LeaveLedgerService.get_or_create(
+                employee,
+                optional_leave,
+                current_year,
                 defaults={
                     'total_leaves': 2,
                     'leaves_taken': 0,
@@ -668,104 +1056,25 @@ class AutoLeaveBalanceService:
             
             if not created:
                 # Update existing balance to 2 days
-                balance.total_leaves = 2
-                balance.leaves_remaining = 2 - balance.leaves_taken
-                balance.save()
+                LeaveLedgerService.adjust_to(
+                    balance,
+                    note='Optional leave granted at probation end',
+                    total_leaves=2,
+                    leaves_remaining=2 - balance.leaves_taken
+                )
         
         return True
     
     @staticmethod
-    @transaction.atomic
     def monthly_accrual_cron():
         """
         Monthly cron job to accrue leaves for all employees
         Run this on 1st of every month
         
-        Only accrue Earned Leave (1.5 days/month) for non-probation employees
+        Only accrue Earned Leave (1.5 days/month) for non-probation employees.
+        Safe to rerun: see MonthlyAccrualService.
         """
-        from hr.models import Employee
-        
-        current_year = date.today().year
-        current_date = date.today()
-        
-        # Get all active employees not on probation
-        employees = Employee.objects.filter(status='active')
-        
-        # Get Earned Leave type
-        try:
-            annual_leave = LeaveType.objects.get(
-                is_active=True,
-                accrual_rate=Decimal('1.5')
-            )
-        except LeaveType.DoesNotExist:
-            return 0
-        
-        updated_count = 0
-        
-        for employee in employees:
-            # Check probation status
-            is_on_probation = ProbationService.is_on_probation(employee)
-            
-            # NEW: Check if probation ended in the last month
-            probation_ended_recently = False
-            if employee.probation_end_date:
-                # If probation ended in the last 30 days
-                days_since_probation_end = (current_date - employee.probation_end_date).days
-                probation_ended_recently = 0 <= days_since_probation_end <= 30
-            
-        
-            if is_on_probation and not probation_ended_recently:
-                continue
-            
-            # Get or create balance for annual leave
-            balance, created = LeaveBalance.objects.get_or_create(
-                employee=employee,
-                leave_type=annual_leave,
-                year=current_year,
-                defaults={
-                    'total_leaves': 0,
-                    'leaves_taken': 0,
-                    'leaves_remaining': 0,
-                    'carry_forward': 0
-                }
-            )
-            
-            # # Add monthly accrual (1.5 days)
-            # accrual_amount = annual_leave.accrual_rate
-            # balance.total_leaves = float(Decimal(str(balance.total_leaves)) + accrual_amount)
-            # balance.leaves_remaining = float(Decimal(str(balance.leaves_remaining)) + accrual_amount)
-            # balance.save()
-            # Calculate accrual based on probation status
-            accrual_amount = Decimal('0')
-            
-            if probation_ended_recently:
-                # NEW: If probation ended recently, calculate prorated accrual
-                probation_end_date = employee.probation_end_date
-                
-                # Calculate days from probation end to end of month
-                if probation_end_date.month == current_date.month:
-                    # Probation ended in current month
-                    days_in_month = calendar.monthrange(current_date.year, current_date.month)[1]
-                    days_after_probation = days_in_month - probation_end_date.day + 1
-                    
-                    # Prorate the 1.5 days for remaining days in month
-                    accrual_amount = (Decimal('1.5') * Decimal(str(days_after_probation))) / Decimal(str(days_in_month))
-                else:
-                    # Probation ended in previous month, full accrual for current month
-                    accrual_amount = annual_leave.accrual_rate
-                    
-            elif not is_on_probation:
-                # Regular monthly accrual for non-probation employees
-                accrual_amount = annual_leave.accrual_rate
-            
-            if accrual_amount > 0:
-                balance.total_leaves = float(Decimal(str(balance.total_leaves)) + accrual_amount)
-                balance.leaves_remaining = float(Decimal(str(balance.leaves_remaining)) + accrual_amount)
-                balance.save()
-                
-                updated_count += 1
-            
-            return updated_count
+        return MonthlyAccrualService.run()
         
     @staticmethod
     def ensure_unpaid_leave_balance(employee):
@@ -776,19 +1085,15 @@ class AutoLeaveBalanceService:
         current_year = date.today().year
             
         # Get Unpaid Leave type
-        try:
-            unpaid_leave = LeaveType.objects.get(
-                is_active=True,
-                name__icontains='unpaid'
-            )
-        except LeaveType.DoesNotExist:
+        unpaid_leave = LeaveTypeRegistry.get('unpaid')
+        if not unpaid_leave:
             return None
             
         # Get or create unpaid leave balance - STARTS AT 0
-        balance, created = LeaveBalance.objects.get_or_create(
-            employee=employee,
-            leave_type=unpaid_leave,
-            year=current_year,
+        balance, created = LeaveLedgerService.get_or_create(
+            employee,
+            unpaid_leave,
+            current_year,
             defaults={
                 'total_leaves': 0,  # Starts at 0
                 'leaves_taken': 0,
@@ -800,7 +1105,7 @@ class AutoLeaveBalanceService:
         return balance
     
     @staticmethod
-    def record_unpaid_leave(employee, days_taken):
+    def record_unpaid_leave(employee, days_taken, leave=None):
         """
         Record unpaid leave when taken
         This increases the unpaid leave balance (as a negative/tracking record)
@@ -808,19 +1113,15 @@ class AutoLeaveBalanceService:
         current_year = date.today().year
         
         # Get Unpaid Leave type
-        try:
-            unpaid_leave = LeaveType.objects.get(
-                is_active=True,
-                name__icontains='unpaid'
-            )
-        except LeaveType.DoesNotExist:
+        unpaid_leave = LeaveTypeRegistry.get('unpaid')
+        if not unpaid_leave:
             return None
         
         # Get or create unpaid leave balance
-        balance, created = LeaveBalance.objects.get_or_create(
-            employee=employee,
-            leave_type=unpaid_leave,
-            year=current_year,
+        balance, created = LeaveLedgerService.get_or_create(
+            employee,
+            unpaid_leave,
+            current_year,
             defaults={
                 'total_leaves': 0,
                 'leaves_taken': 0,
@@ -830,8 +1131,12 @@ class AutoLeaveBalanceService:
         )
         
         # Increase leaves_taken (this tracks how much unpaid leave was taken)
-        balance.leaves_taken = float(Decimal(str(balance.leaves_taken)) + Decimal(str(days_taken)))
-        balance.save()
+        LeaveLedgerService.apply(
+            balance, 'deduction',
+            taken=days_taken,
+            leave=leave,
+            note='Unpaid leave'
+        )
         
         return balance
     
@@ -841,10 +1146,10 @@ class AutoLeaveBalanceService:
         Helper to get or create balance with smart defaults
         Only for Earned Leave and Unpaid Leave
         """
-        balance, created = LeaveBalance.objects.get_or_create(
-            employee=employee,
-            leave_type=leave_type,
-            year=year,
+        balance, created = LeaveLedgerService.get_or_create(
+            employee,
+            leave_type,
+            year,
             defaults={
                 'total_leaves': 0,
                 'leaves_taken': 0,
@@ -858,10 +1163,9 @@ class AutoLeaveBalanceService:
             is_on_probation = ProbationService.is_on_probation(employee)
             
             # Check if this is unpaid leave
-            if 'unpaid' in leave_type.name.lower():
+            if LeaveTypeRegistry.is_kind(leave_type, 'unpaid'):
                 # Unpaid leave starts at 0
-                balance.total_leaves = 0
-                balance.leaves_remaining = 0
+                pass
             elif not is_on_probation and leave_type.accrual_rate > 0:
                 # Earned leave - calculate accrued leaves AFTER probation
                 probation_end_date = employee.probation_end_date
@@ -877,15 +1181,14 @@ class AutoLeaveBalanceService:
                     
                     months_after_probation = max(0, months_after_probation)
                     
-                    accrued = float(Decimal(str(months_after_probation)) * leave_type.accrual_rate)
-                    balance.total_leaves = accrued
-                    balance.leaves_remaining = accrued
-                else:
-                    # Still on probation or no probation end date
-                    balance.total_leaves = 0
-                    balance.leaves_remaining = 0
-            
-            balance.save()
+                    accrued = Decimal(str(months_after_probation)) * leave_type.accrual_rate
+                    LeaveLedgerService.apply(
+                        balance, 'opening',
+                        total=accrued,
+                        remaining=accrued,
+                        note='Accrued since probation end'
+                    )
+                # Still on probation or no probation end date: stays at 0
         
         return balance
 #-----------------------
@@ -942,22 +1245,18 @@ class DailyProbationService:
         )
         
         # Get Earned Leave type
-        try:
-            annual_leave = LeaveType.objects.get(
-                is_active=True,
-                accrual_rate=Decimal('1.5')
-            )
-        except LeaveType.DoesNotExist:
+        annual_leave = LeaveTypeRegistry.get('earned')
+        if not annual_leave:
             return 0
         
         updated_count = 0
         
         for employee in employees_ended_probation:
             # Get or create balance
-            balance, created = LeaveBalance.objects.get_or_create(
-                employee=employee,
-                leave_type=annual_leave,
-                year=current_year,
+            balance, created = LeaveLedgerService.get_or_create(
+                employee,
+                annual_leave,
+                current_year,
                 defaults={
                     'total_leaves': 0,
                     'leaves_taken': 0,
@@ -970,17 +1269,20 @@ class DailyProbationService:
             accrual_amount = Decimal('1.5')
             
             # Add the accrual
-            balance.total_leaves = float(Decimal(str(balance.total_leaves)) + accrual_amount)
-            balance.leaves_remaining = float(Decimal(str(balance.leaves_remaining)) + accrual_amount)
-            balance.save()
+            LeaveLedgerService.apply(
+                balance, 'accrual',
+                total=accrual_amount,
+                remaining=accrual_amount,
+                note='First accrual after probation'
+            )
             
             # Also grant optional leave (2 days)
-            try:
-                optional_leave = LeaveType.objects.get(is_active=True, is_optional=True)
-                optional_balance, _ = LeaveBalance.objects.get_or_create(
-                    employee=employee,
-                    leave_type=optional_leave,
-                    year=current_year,
+            optional_leave = LeaveTypeRegistry.get('optional')
+            if optional_leave:
+                optional_balance, _ = LeaveLedgerService.get_or_create(
+                    employee,
+                    optional_leave,
+                    current_year,
                     defaults={
                         'total_leaves': 2,
                         'leaves_taken': 0,
@@ -990,12 +1292,12 @@ class DailyProbationService:
                 )
                 
                 if not created:
-                    optional_balance.total_leaves = 2
-                    optional_balance.leaves_remaining = 2 - optional_balance.leaves_taken
-                    optional_balance.save()
-                    
-            except LeaveType.DoesNotExist:
-                pass
+                    LeaveLedgerService.adjust_to(
+                        optional_balance,
+                        note='Optional leave granted after probation',
+                        total_leaves=2,
+                        leaves_remaining=2 - optional_balance.leaves_taken
+                    )
             
             updated_count += 1
             print(f"DEBUG: Granted {accrual_amount} days leave accrual to {employee.first_name} after probation ended")
@@ -1021,7 +1323,7 @@ class CompOffService:
         existing_comp_off = Leave.objects.filter(
             employee=employee,
             start_date=work_date,
-            leave_type__name='comp_off',
+            leave_type_id__in=LeaveTypeRegistry.ids('comp_off'),
             status='approved'
         ).exists()
         
@@ -1029,8 +1331,8 @@ class CompOffService:
             return False, "Comp off already earned for this date"
         
         # Get or create comp off leave type
-        comp_off_type, created = LeaveType.objects.get_or_create(
-            name='comp_off',
+        comp_off_type = LeaveTypeRegistry.get_or_create(
+            'comp_off', 'comp_off',
             defaults={
                 'max_days': 30, 
                 'is_active': True
@@ -1041,10 +1343,10 @@ class CompOffService:
         valid_until = work_date + timedelta(days=CompOffService.COMP_OFF_VALIDITY_DAYS)
         
         # Create comp off balance entry
-        balance, created = LeaveBalance.objects.get_or_create(
-            employee=employee,
-            leave_type=comp_off_type,
-            year=work_date.year,
+        balance, created = LeaveLedgerService.get_or_create(
+            employee,
+            comp_off_type,
+            work_date.year,
             defaults={
                 'total_leaves': 1,
                 'leaves_remaining': 1,
@@ -1053,18 +1355,21 @@ class CompOffService:
                 'earned_date': work_date,
                 'valid_until': valid_until,
                 'is_expired': False
-            }
+            },
+            kind='accrual',
+            note=f"Comp off for working on {work_date}"
         )
         
         if not created:
-            balance.total_leaves += 1
-            balance.leaves_remaining += 1
+            LeaveLedgerService.apply(
+                balance, 'accrual',
+                total=1,
+                remaining=1,
+                note=f"Comp off for working on {work_date}"
+            )
             # Update earned_date and valid_until for the new comp off
-            if not balance.earned_date:
-                balance.earned_date = work_date
-            if not balance.valid_until:
-                balance.valid_until = valid_until
-            balance.save()
+            LeaveBalance.objects.filter(pk=balance.pk, earned_date__isnull=True).update(earned_date=work_date)
+            LeaveBalance.objects.filter(pk=balance.pk, valid_until__isnull=True).update(valid_until=valid_until)
         
         # Create comp off leave record
         comp_off_leave = Leave.objects.create(
@@ -1085,9 +1390,7 @@ class CompOffService:
         today = timezone.now().date()
         
         # Find comp off balances that are expired
-        comp_off_type = LeaveType.objects.filter(
-            name__icontains='comp off'
-        ).first()
+        comp_off_type = LeaveTypeRegistry.get('comp_off', active_only=False)
         
         if not comp_off_type:
             return 0
@@ -1100,12 +1403,16 @@ class CompOffService:
         )
         
         expired_count = 0
-        for balance in expired_balances:
+        for balance in expired_balances.select_related('employee'):
             # Mark as expired and zero out the remaining balance
             original_remaining = balance.leaves_remaining
-            balance.leaves_remaining = 0
-            balance.is_expired = True
-            balance.save()
+            with transaction.atomic():
+                LeaveLedgerService.adjust_to(
+                    balance, 'expiry',
+                    note=f"Comp off valid until {balance.valid_until} expired",
+                    leaves_remaining=0
+                )
+                LeaveBalance.objects.filter(pk=balance.pk).update(is_expired=True)
             
             expired_count += 1
             print(f"DEBUG: Expired {original_remaining} comp off days for {balance.employee.first_name}")
@@ -1119,9 +1426,7 @@ class CompOffService:
         today = date.today()
         
         # Find comp off leave type
-        comp_off_type = LeaveType.objects.filter(
-            name__icontains='comp off'
-        ).first()
+        comp_off_type = LeaveTypeRegistry.get('comp_off', active_only=False)
         
         if not comp_off_type:
             return None
@@ -1165,68 +1470,95 @@ class CompOffService:
 class YearEndService:
     """Handles year-end processing and automatic loss of excess leaves"""
     
+    # Leave type kinds (see LeaveTypeRegistry) whose remaining days are lost at year end
+    EXPIRING_LEAVE_TYPES = ['optional', 'sick', 'comp_off']
+    CHUNK_SIZE = 500
+    
     @staticmethod
-    def process_year_end():
-        """Process year-end for all employees"""
-        current_year = timezone.now().year
+    def process_year_end(current_year=None, employee_ids=None):
+        """
+        Process calendar year-end for all employees (or just employee_ids).
+        Earned Leave is not carried forward here: its balances follow the
+        financial year and are carried forward on April 1st (carry_forward_leaves).
+        """
+        current_year = current_year or timezone.now().year
         next_year = current_year + 1
         
-        employees = Employee.objects.filter(status='active')
-        
-        for employee in employees:
-            YearEndService.process_employee_year_end(employee, current_year, next_year)
+        expired = YearEndService.expire_balances(current_year, employee_ids)
+        initialized = YearEndService.initialize_optional_leave(next_year, employee_ids)
+        logger.info(
+            "Year end %s: %s balances expired, %s optional balances created", current_year, expired, initialized
+        )
     
     @staticmethod
     def process_employee_year_end(employee, current_year, next_year):
-        """Process year-end for a single employee"""
+        """Process calendar year-end for a single employee (no Earned Leave carry forward, see above)"""
         with transaction.atomic():
-            # Process annual leave carry forward
-            carry_forward = CarryForwardService.process_carry_forward(employee, next_year)
-            
-            # Reset optional leaves (lose remaining - max use 2 out of 4)
-            try:
-                optional_leave_type = LeaveType.objects.get(name='optional')
-                optional_balance = LeaveBalance.objects.get(
-                    employee=employee,
-                    leave_type=optional_leave_type,
-                    year=current_year
-                )
-                # Optional leaves don't carry forward - they're lost
-                optional_balance.leaves_remaining = 0
-                optional_balance.save()
-                
-                # Initialize next year's optional leaves
-                OptionalLeaveService.initialize_optional_leave(employee, next_year)
-                
-            except (LeaveType.DoesNotExist, LeaveBalance.DoesNotExist):
-                # Initialize if not exists
-                OptionalLeaveService.initialize_optional_leave(employee, next_year)
-            
-            # Reset sick leaves (typically don't carry forward)
-            try:
-                sick_leave_type = LeaveType.objects.get(name='sick')
-                sick_balance = LeaveBalance.objects.get(
-                    employee=employee,
-                    leave_type=sick_leave_type,
-                    year=current_year
+            YearEndService.expire_balances(current_year, [employee.pk])
+            YearEndService.initialize_optional_leave(next_year, [employee.pk])
+    
+    @staticmethod
+    def expire_balances(year, employee_ids=None):
+        """
+        Zero leaves_remaining on optional, sick and comp off balances for the
+        year, a chunk at a time (row locks are held only for one chunk)
+        """
+        balances = LeaveBalance.objects.filter(
+            year=year,
+            leave_type_id__in=LeaveTypeRegistry.ids(*YearEndService.EXPIRING_LEAVE_TYPES)
+        ).exclude(leaves_remaining=0)
+        if employee_ids is not None:
+            balances = balances.filter(employee_id__in=employee_ids)
+        ids = list(balances.order_by('id').values_list('id', flat=True))
+        
+        note = f"Year end {year}"
+        for start in range(0, len(ids), YearEndService.CHUNK_SIZE):
+            with transaction.atomic():
+                rows = list(LeaveBalance.objects.select_for_update().filter(
+                    pk__in=ids[start:start + YearEndService.CHUNK_SIZE]
+                ).exclude(leaves_remaining=0).values_list('id', 'leaves_remaining'))
+                LeaveBalanceTransaction.objects.bulk_create([
+                    LeaveBalanceTransaction(
+                        balance_id=balance_id,
+                        kind='expiry',
+                        remaining_delta=-remaining,
+                        note=note
+                    )
+                    for balance_id, remaining in rows
+                ])
+                LeaveBalance.objects.filter(pk__in=[balance_id for balance_id, remaining in rows]).update(
+                    leaves_remaining=0,
+                    updated_at=timezone.now()
                 )
-                sick_balance.leaves_remaining = 0
-                sick_balance.save()
-            except (LeaveType.DoesNotExist, LeaveBalance.DoesNotExist):
-                pass
-            
-            # Reset comp off (typically don't carry forward)
-            try:
-                comp_off_type = LeaveType.objects.get(name='comp_off')
-                comp_off_balance = LeaveBalance.objects.get(
-                    employee=employee,
-                    leave_type=comp_off_type,
-                    year=current_year
+        return len(ids)
+    
+    @staticmethod
+    def initialize_optional_leave(year, employee_ids=None):
+        """Give every active employee without one a 4 day optional leave balance for the year"""
+        optional_leave_type = LeaveTypeRegistry.get_or_create(
+            'optional', 'optional',
+            defaults={'max_days': 4, 'is_active': True}
+        )
+        employees = Employee.objects.filter(status='active').exclude(
+            pk__in=LeaveBalance.objects.filter(
+                leave_type=optional_leave_type,
+                year=year
+            ).values('employee_id')
+        )
+        if employee_ids is not None:
+            employees = employees.filter(pk__in=employee_ids)
+        missing = list(employees.order_by('id').values_list('id', flat=True))
+        
+        for start in range(0, len(missing), YearEndService.CHUNK_SIZE):
+            with transaction.atomic():
+                LeaveLedgerService.bulk_credit(
+                    optional_leave_type,
+                    year,
+                    {employee_id: Decimal('4') for employee_id in missing[start:start + YearEndService.CHUNK_SIZE]},
+                    'opening',
+                    'Opening balance'
                 )
-                comp_off_balance.leaves_remaining = 0
-                comp_off_balance.save()
-            except (LeaveType.DoesNotExist, LeaveBalance.DoesNotExist):
-                pass
+        return len(missing)
 
 class LeaveValidationService:
     """Centralized leave validation service"""
@@ -1241,7 +1573,7 @@ class LeaveValidationService:
         warnings = []
         
         # Check if unpaid leave - skip balance validation
-        is_unpaid = 'unpaid' in leave_type.name.lower()
+        is_unpaid = LeaveTypeRegistry.is_kind(leave_type, 'unpaid')
         
         if is_unpaid:
             # Unpaid leave is always valid (no balance check needed)
@@ -1282,46 +1614,51 @@ class LeaveValidationService:
     
 
     @staticmethod
-    def deduct_leave_balance(employee, leave_type, days, year):
-        """Deduct leave balance after approval"""
-        try:
-            balance = LeaveBalance.objects.get(
-                employee=employee,
-                leave_type=leave_type,
-                year=year
-            )
-            # Convert days to Decimal to handle 0.5 properly
-            days_decimal = Decimal(str(days))
-            if balance.leaves_remaining >= days_decimal:
-                balance.leaves_taken = Decimal(str(balance.leaves_taken)) + days_decimal
-                balance.leaves_remaining = Decimal(str(balance.leaves_remaining)) - days_decimal
-                balance.save()
-                return True
-            return False
-            
-        except LeaveBalance.DoesNotExist:
+    def deduct_leave_balance(employee, leave_type, days, year, leave=None):
+        """Deduct leave balance after approval (only while enough days remain)"""
+        balance_id = LeaveBalance.objects.filter(
+            employee=employee,
+            leave_type=leave_type,
+            year=year
+        ).values_list('id', flat=True).first()
+        if balance_id is None:
             return False
         
+        # Convert days to Decimal to handle 0.5 properly
+        days_decimal = Decimal(str(days))
+        return LeaveLedgerService.apply(
+            balance_id, 'deduction',
+            taken=days_decimal,
+            remaining=-days_decimal,
+            min_remaining=days_decimal,
+            leave=leave,
+            note='Leave approved'
+        )
+        
         
         
     @staticmethod
-    def restore_leave_balance(employee, leave_type, days, year):
+    def restore_leave_balance(employee, leave_type, days, year, leave=None):
         """Restore leave balance when leave is rejected or status changed from approved"""
         try:
-            balance = LeaveBalance.objects.get(
-                employee=employee,
-                leave_type=leave_type,
-                year=year
-            )
-            
             # Convert days to Decimal to handle 0.5 properly
             days_decimal = Decimal(str(days))
             print(f"DEBUG: Restored days requested {days} days")
-            # Restore the balance - reduce leaves_taken and increase leaves_remaining
-            balance.leaves_taken = max(Decimal('0'), Decimal(str(balance.leaves_taken)) - days_decimal)
-            balance.leaves_remaining = Decimal(str(balance.leaves_remaining)) + days_decimal
             
-            balance.save()
+            with transaction.atomic():
+                balance = LeaveBalance.objects.select_for_update().get(
+                    employee=employee,
+                    leave_type=leave_type,
+                    year=year
+                )
+                # Restore the balance - reduce leaves_taken (not below 0) and increase leaves_remaining
+                LeaveLedgerService.apply(
+                    balance, 'restoration',
+                    taken=-min(days_decimal, balance.leaves_taken),
+                    remaining=days_decimal,
+                    leave=leave,
+                    note='Approved leave reversed'
+                )
             
             # Debug logging
             print(f"DEBUG: Restored {days} days for {employee.first_name} - {leave_type.name}")
@@ -1339,9 +1676,7 @@ class LeaveValidationService:
 # Utility function to initialize leave balances for new employee
 def initialize_employee_leave_balances(employee, year):
     """Initialize all leave balances for a new employee"""
-    leave_types = LeaveType.objects.filter(is_active=True)
-    
-    for leave_type in leave_types:
+    for leave_type in LeaveTypeRegistry.all():
         defaults = {
             'total_leaves': 0,
             'leaves_remaining': 0,
@@ -1350,22 +1685,770 @@ def initialize_employee_leave_balances(employee, year):
         }
         
         # Set initial values based on leave type
-        if leave_type.name == 'Earned':
+        kind = LeaveTypeRegistry.kind_of(leave_type)
+        if kind == 'earned':
             # New employees start with 0 annual leaves (accrual starts next month)
             pass
-        elif leave_type.name == 'optional':
+        elif kind == 'optional':
             defaults['total_leaves'] = 4
             defaults['leaves_remaining'] = 4
-        elif leave_type.name == 'sick':
+        elif kind == 'sick':
             defaults['total_leaves'] = 12  # Example: 12 sick leaves per year
             defaults['leaves_remaining'] = 12
         elif leave_type.name == 'casual':
             defaults['total_leaves'] = 6   # Example: 6 casual leaves per year
             defaults['leaves_remaining'] = 6
         
-        LeaveBalance.objects.get_or_create(
-            employee=employee,
-            leave_type=leave_type,
-            year=year,
+        LeaveLedgerService.get_or_create(
+            employee,
+            leave_type,
+            year,
             defaults=defaults
-        )
\ No newline at end of file
+        )
+
+class WorkingDayCalendar:
+    """
+    Shared working-day calendar for leave, attendance and payroll day counts.
+
+    For each (holiday region, year) it builds a bitmap of working days once:
+    the weekly off (Sunday) and mandatory holidays are off, while optional
+    holidays count as working days unless the employee picks them. A prefix
+    sum over the bitmap makes counting any date range O(1) per year.
+
+    Mandatory holidays are the non-optional 'National Holiday' rows of every
+    region plus the non-optional 'State Holiday' rows of the employee's
+    region. The built years are kept in process and dropped whenever a
+    Holiday changes (hr.signals bumps the shared version key).
+    """
+
+    WEEKLY_OFF_DAYS = (6,)  # Sunday
+    STANDARD_HOURS = 9
+    SATURDAY_HOURS = 4
+    # Branches that work a longer Saturday
+    BRANCH_SATURDAY_HOURS = {'bhubaneswar': 6}
+
+    VERSION_KEY = 'working_day_calendar:version'
+
+    _years = {}
+    _version = None
+
+    @staticmethod
+    def is_weekly_off(day):
+        return day.weekday() in WorkingDayCalendar.WEEKLY_OFF_DAYS
+
+    @staticmethod
+    def standard_hours(location, day):
+        """Expected working hours for an employee of this branch on this day"""
+        if day.weekday() == 5:
+            branch = (location or '').strip().lower()
+            return WorkingDayCalendar.BRANCH_SATURDAY_HOURS.get(branch, WorkingDayCalendar.SATURDAY_HOURS)
+        return WorkingDayCalendar.STANDARD_HOURS
+
+    @staticmethod
+    def build_year(region_id, year):
+        """
+        Bitmap, prefix sums and holiday details of one region's calendar year.
+        Without a region (no or unknown location) the optional holidays of
+        every region are listed.
+        """
+        first_day = date(year, 1, 1)
+        day_count = (date(year + 1, 1, 1) - first_day).days
+
+        region_filter = Q(region_id=region_id) if region_id is not None else Q(is_optional=True)
+        holidays = Holiday.objects.filter(date__year=year).filter(
+            Q(holiday_type__iexact='National Holiday', is_optional=False) | region_filter
+        ).values('id', 'name', 'date', 'holiday_type', 'is_optional', 'region_id', 'region__name')
+
+        mandatory = set()
+        optional = {}
+        for holiday in holidays:
+            holiday_type = (holiday['holiday_type'] or '').strip().lower()
+            if holiday['is_optional']:
+                if holiday_type == 'optional holiday' and region_id in (None, holiday['region_id']):
+                    optional.setdefault(holiday['date'], []).append({
+                        'date': holiday['date'],
+                        'name': holiday['name'],
+                        'region': holiday['region__name'] or 'National',
+                        'id': holiday['id'],
+                    })
+            elif holiday_type == 'national holiday' or (
+                holiday_type == 'state holiday' and holiday['region_id'] == region_id
+            ):
+                mandatory.add(holiday['date'])
+
+        working = bytearray(day_count)
+        prefix = [0] * (day_count + 1)
+        for offset in range(day_count):
+            day = first_day + timedelta(days=offset)
+            if not WorkingDayCalendar.is_weekly_off(day) and day not in mandatory:
+                working[offset] = 1
+            prefix[offset + 1] = prefix[offset] + working[offset]
+
+        return {
+            'first_day': first_day,
+            'working': working,
+            'prefix': prefix,
+            'mandatory': mandatory,
+            'optional': optional,
+        }
+
+    @staticmethod
+    def get_year(region_id, year):
+        version = CacheVersion.get(WorkingDayCalendar.VERSION_KEY)
+        if version != WorkingDayCalendar._version:
+            WorkingDayCalendar._years.clear()
+            WorkingDayCalendar._version = version
+
+        key = (region_id, year)
+        calendar_year = WorkingDayCalendar._years.get(key)
+        if calendar_year is None:
+            calendar_year = WorkingDayCalendar._years[key] = WorkingDayCalendar.build_year(region_id, year)
+        return calendar_year
+
+    @staticmethod
+    def _year_slices(region_id, start_date, end_date):
+        """(calendar year, first offset, last offset) for each year the range touches"""
+        for year in range(start_date.year, end_date.year + 1):
+            calendar_year = WorkingDayCalendar.get_year(region_id, year)
+            first = max(start_date, calendar_year['first_day'])
+            last = min(end_date, date(year, 12, 31))
+            yield (
+                calendar_year,
+                (first - calendar_year['first_day']).days,
+                (last - calendar_year['first_day']).days,
+            )
+
+    @staticmethod
+    def count_working_days(region_id, start_date, end_date):
+        """Working days in [start_date, end_date]; optional holidays count as working days"""
+        if start_date > end_date:
+            return 0
+        return sum(
+            calendar_year['prefix'][last + 1] - calendar_year['prefix'][first]
+            for calendar_year, first, last in WorkingDayCalendar._year_slices(region_id, start_date, end_date)
+        )
+
+    @staticmethod
+    def is_working_day(region_id, day):
+        calendar_year = WorkingDayCalendar.get_year(region_id, day.year)
+        return bool(calendar_year['working'][(day - calendar_year['first_day']).days])
+
+    @staticmethod
+    def mandatory_holidays(region_id, year):
+        return set(WorkingDayCalendar.get_year(region_id, year)['mandatory'])
+
+    @staticmethod
+    def describe_range(region_id, start_date, end_date):
+        """
+        Working days plus the holidays inside the range, in the shape
+        leave.views.calculate_working_days_with_optional has always returned
+        """
+        if start_date > end_date:
+            return {
+                'working_days': 0,
+                'optional_holidays': [],
+                'mandatory_holidays': [],
+                'total_calendar_days': 0
+            }
+
+        mandatory_dates = []
+        optional_list = []
+        for calendar_year, _, _ in WorkingDayCalendar._year_slices(region_id, start_date, end_date):
+            mandatory_dates.extend(d for d in calendar_year['mandatory'] if start_date <= d <= end_date)
+            for day in sorted(calendar_year['optional']):
+                if start_date <= day <= end_date:
+                    optional_list.extend(calendar_year['optional'][day])
+
+        return {
+            'working_days': WorkingDayCalendar.count_working_days(region_id, start_date, end_date),
+            'optional_holidays': optional_list,
+            'mandatory_holidays': sorted(mandatory_dates),
+            'total_calendar_days': (end_date - start_date).days + 1
+        }
+
+    @staticmethod
+    def invalidate():
+        """Drop every built calendar year (called when a Holiday is saved or deleted)"""
+        CacheVersion.bump(WorkingDayCalendar.VERSION_KEY)
+
+
+class BulkLeaveActionService:
+    """
+    Approve or reject many leaves in one request.
+
+    The leaves and every balance they touch are locked and loaded up front
+    (one query each), each leave is validated in memory against the running
+    balance, and all balance changes and status updates are written in one
+    transaction. Returns one result per requested id, in request order.
+    """
+    
+    ACTIONS = ['approve', 'reject']
+    MAX_LEAVES = 200
+    
+    @staticmethod
+    def _result(leave_id, status, message):
+        return {'id': leave_id, 'status': status, 'message': message}
+    
+    @staticmethod
+    def apply(leave_ids, action, actor=None, rejection_reason='', scope=None):
+        """
+        action is 'approve' or 'reject'; scope (a LeaveScope) limits which
+        leaves the caller may act on, others come back as 'not found'
+        """
+        leave_ids = list(dict.fromkeys(int(leave_id) for leave_id in leave_ids))[:BulkLeaveActionService.MAX_LEAVES]
+        results = {
+            leave_id: BulkLeaveActionService._result(leave_id, 'error', 'Leave not found')
+            for leave_id in leave_ids
+        }
+        now = timezone.now()
+        
+        with transaction.atomic():
+            # Lock only the leave rows, then load them with their relations
+            locked = Leave.objects.select_for_update().filter(pk__in=leave_ids)
+            if scope is not None:
+                locked = locked.filter(scope.employee_filter('employee__'))
+            locked_ids = list(locked.values_list('pk', flat=True))
+            leaves = list(Leave.objects.filter(pk__in=locked_ids).select_related(
+                'employee', 'leave_type'
+            ).order_by('applied_date', 'id'))
+            
+            if action == 'approve':
+                done = BulkLeaveActionService._approve(leaves, results)
+                updates = {'status': 'approved', 'approved_date': now, 'approved_by': actor}
+            else:
+                done = BulkLeaveActionService._reject(leaves, results)
+                updates = {
+                    'status': 'rejected', 'approved_date': now, 'approved_by': actor,
+                    'rejection_reason': rejection_reason,
+                }
+            
+            if done:
+                Leave.objects.filter(pk__in=[leave.pk for leave in done]).update(**updates)
+                unpaid_ids = [leave.pk for leave in done if getattr(leave, '_bulk_unpaid', False)]
+                if unpaid_ids:
+                    Leave.objects.filter(pk__in=unpaid_ids).update(is_unpaid=True)
+                # update() skips post_save, so drop the cached calendar feeds here
+                transaction.on_commit(CalendarFeedService.invalidate)
+        
+        return [results[leave_id] for leave_id in leave_ids]
+    
+    @staticmethod
+    def _approve(leaves, results):
+        """Validate and deduct balances; returns the leaves that can be approved"""
+        today = date.today()
+        pending = []
+        for leave in leaves:
+            if leave.status not in ['pending', 'new']:
+                results[leave.pk] = BulkLeaveActionService._result(
+                    leave.pk, 'skipped', f'Leave is already {leave.status}'
+                )
+            elif leave.end_date < today:
+                results[leave.pk] = BulkLeaveActionService._result(
+                    leave.pk, 'error', 'Cannot approve leave: Cannot apply for leave in the past'
+                )
+            else:
+                pending.append(leave)
+        
+        unpaid = [leave for leave in pending if LeaveTypeRegistry.is_kind(leave.leave_type, 'unpaid')]
+        paid = [leave for leave in pending if leave not in unpaid]
+        entries = []
+        approved = []
+        
+        # Paid leave: all balances involved, locked, in one query
+        balances = {}
+        if paid:
+            rows = LeaveBalance.objects.select_for_update().filter(
+                employee_id__in={leave.employee_id for leave in paid},
+                leave_type_id__in={leave.leave_type_id for leave in paid},
+                year__in={leave.start_date.year for leave in paid}
+            ).values('id', 'employee_id', 'leave_type_id', 'year', 'leaves_remaining')
+            balances = {
+                (row['employee_id'], row['leave_type_id'], row['year']): row
+                for row in rows
+            }
+        for leave in paid:
+            days = Decimal(str(leave.days_requested or 0))
+            balance = balances.get((leave.employee_id, leave.leave_type_id, leave.start_date.year))
+            if balance is None:
+                message = f"No leave balance found for {leave.leave_type.name}"
+            elif balance['leaves_remaining'] < days:
+                message = (
+                    f"Insufficient {leave.leave_type.name} balance. "
+                    f"Available: {balance['leaves_remaining']}, Requested: {days}"
+                )
+            else:
+                # Later leaves for the same balance see what is left after this one
+                balance['leaves_remaining'] -= days
+                entries.append((balance['id'], leave, {'taken': days, 'remaining': -days}))
+                approved.append(leave)
+                continue
+            results[leave.pk] = BulkLeaveActionService._result(leave.pk, 'error', f"Cannot approve leave: {message}")
+        LeaveLedgerService.bulk_apply(entries, 'deduction', 'Leave approved')
+        
+        # Unpaid leave: no balance check, just track the days taken
+        unpaid_type = LeaveTypeRegistry.get('unpaid') if unpaid else None
+        if unpaid_type:
+            unpaid_balances = LeaveLedgerService.ensure_balances(
+                unpaid_type, today.year, list({leave.employee_id for leave in unpaid})
+            )
+            LeaveLedgerService.bulk_apply([
+                (unpaid_balances[leave.employee_id], leave, {'taken': leave.days_requested})
+                for leave in unpaid
+            ], 'deduction', 'Unpaid leave')
+        for leave in unpaid:
+            leave._bulk_unpaid = True
+            approved.append(leave)
+        
+        for leave in approved:
+            name = f"{leave.employee.first_name} {leave.employee.last_name}"
+            results[leave.pk] = BulkLeaveActionService._result(
+                leave.pk, 'approved',
+                f"Unpaid leave approved for {name}" if leave in unpaid else f"Leave approved for {name}"
+            )
+        return approved
+    
+    @staticmethod
+    def _reject(leaves, results):
+        """Restore balances of approved paid leaves; returns the leaves that can be rejected"""
+        rejectable = []
+        for leave in leaves:
+            if leave.status in ['pending', 'new', 'approved']:
+                rejectable.append(leave)
+            else:
+                results[leave.pk] = BulkLeaveActionService._result(
+                    leave.pk, 'skipped', f'Leave is already {leave.status}'
+                )
+        
+        restore = [leave for leave in rejectable if leave.status == 'approved' and not leave.is_unpaid]
+        balances = {}
+        if restore:
+            rows = LeaveBalance.objects.select_for_update().filter(
+                employee_id__in={leave.employee_id for leave in restore},
+                leave_type_id__in={leave.leave_type_id for leave in restore},
+                year__in={leave.start_date.year for leave in restore}
+            ).values('id', 'employee_id', 'leave_type_id', 'year', 'leaves_taken')
+            balances = {
+                (row['employee_id'], row['leave_type_id'], row['year']): row
+                for row in rows
+            }
+        
+        entries = []
+        for leave in rejectable:
+            name = f"{leave.employee.first_name} {leave.employee.last_name}"
+            message = f"Leave rejected for {name}"
+            if leave in restore:
+                balance = balances.get((leave.employee_id, leave.leave_type_id, leave.start_date.year))
+                days = Decimal(str(leave.days_requested or 0))
+                if balance is None:
+                    message += '; balance could not be restored, please check manually'
+                else:
+                    # Same rule as restore_leave_balance: leaves_taken never goes below 0
+                    taken = min(days, balance['leaves_taken'])
+                    balance['leaves_taken'] -= taken
+                    entries.append((balance['id'], leave, {'taken': -taken, 'remaining': days}))
+                    message += f'; {days} days restored'
+            results[leave.pk] = BulkLeaveActionService._result(leave.pk, 'rejected', message)
+        LeaveLedgerService.bulk_apply(entries, 'restoration', 'Approved leave reversed')
+        return rejectable
+
+
+class LeaveIntervalService:
+    """
+    Date-interval questions about leaves, one query each (served by the
+    (employee, start_date, end_date) index):
+
+    - overlaps(): leaves of a set of employees that intersect a window
+    - daily_headcount(): employees off per day, per department / location /
+      team, from a sweep over the interval end points
+    """
+
+    ACTIVE_STATUSES = ['pending', 'approved']
+    # Grouping for daily_headcount: (group key field, label fields)
+    GROUPS = {
+        'department': ('department', ['department']),
+        'location': ('location', ['location']),
+        'team': ('reports_to_id', ['reports_to__first_name', 'reports_to__last_name']),
+    }
+    # Approving a leave that takes more than this share of the team off warns the approver
+    CAPACITY_WARNING_RATIO = 0.3
+
+    @staticmethod
+    def overlaps(employee_ids, start_date, end_date, statuses=None, exclude_leave=None):
+        """Leaves (with leave_type) of these employees that intersect [start_date, end_date]"""
+        leaves = Leave.objects.filter(
+            employee_id__in=employee_ids,
+            start_date__lte=end_date,
+            end_date__gte=start_date,
+            status__in=statuses or LeaveIntervalService.ACTIVE_STATUSES
+        ).select_related('leave_type').order_by('employee_id', 'start_date')
+        if exclude_leave is not None:
+            leaves = leaves.exclude(pk=getattr(exclude_leave, 'pk', exclude_leave))
+        return list(leaves)
+
+    @staticmethod
+    def _sweep(intervals, days):
+        """
+        Headcount per day from {employee: [(start, end), ...]}; an employee
+        with several overlapping leaves is counted once per day
+        """
+        diff = [0] * (days + 1)
+        for spans in intervals.values():
+            spans.sort()
+            merged = []
+            for first, last in spans:
+                if merged and first <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], last)
+                else:
+                    merged.append([first, last])
+            for first, last in merged:
+                diff[first] += 1
+                diff[last + 1] -= 1
+
+        counts = []
+        running = 0
+        for day in range(days):
+            running += diff[day]
+            counts.append(running)
+        return counts
+
+    @staticmethod
+    def daily_headcount(employees, start_date, end_date, group_by='department', statuses=None):
+        """
+        {'days': [date, ...], 'groups': [{'key', 'label', 'headcount', 'on_leave': [per day]}]}
+        for the given Employee queryset, from one query: every employee row
+        comes back with its leaves in the window (if any) through a
+        FilteredRelation, which gives group sizes and intervals together.
+        """
+        field, label_fields = LeaveIntervalService.GROUPS[group_by]
+        days = (end_date - start_date).days + 1
+        window_leave = FilteredRelation('leave', condition=Q(
+            leave__status__in=statuses or ['approved'],
+            leave__start_date__lte=end_date,
+            leave__end_date__gte=start_date
+        ))
+        rows = employees.annotate(window_leave=window_leave).values(
+            'id', field, *label_fields, 'window_leave__start_date', 'window_leave__end_date'
+        ).order_by()
+
+        groups = {}
+        for row in rows:
+            key = row[field]
+            group = groups.get(key)
+            if group is None:
+                label = ' '.join(str(row[name]) for name in label_fields if row[name]) or 'Unassigned'
+                group = groups[key] = {'key': key, 'label': label, 'members': set(), 'intervals': {}}
+            group['members'].add(row['id'])
+            if row['window_leave__start_date']:
+                # Day offsets clipped to the window
+                first = max((row['window_leave__start_date'] - start_date).days, 0)
+                last = min((row['window_leave__end_date'] - start_date).days, days - 1)
+                group['intervals'].setdefault(row['id'], []).append((first, last))
+
+        return {
+            'days': [start_date + timedelta(days=offset) for offset in range(days)],
+            'groups': [
+                {
+                    'key': group['key'],
+                    'label': group['label'],
+                    'headcount': len(group['members']),
+                    'on_leave': LeaveIntervalService._sweep(group['intervals'], days),
+                }
+                for group in sorted(groups.values(), key=lambda g: g['label'].lower())
+            ],
+        }
+
+    @staticmethod
+    def capacity_warning(leave):
+        """
+        Message for the approver when approving this leave would take more
+        than CAPACITY_WARNING_RATIO of the employee's team off on some day,
+        else None. The team is the employee's manager's direct reports, or
+        their department when they have no manager.
+        """
+        employee = leave.employee
+        if employee.reports_to_id:
+            teammates = Employee.objects.filter(reports_to_id=employee.reports_to_id)
+            group_by = 'team'
+        elif employee.department:
+            teammates = Employee.objects.filter(department=employee.department)
+            group_by = 'department'
+        else:
+            return None
+        teammates = teammates.filter(status='active').exclude(pk=employee.pk)
+
+        heatmap = LeaveIntervalService.daily_headcount(teammates, leave.start_date, leave.end_date, group_by)
+        if not heatmap['groups']:
+            return None
+        group = heatmap['groups'][0]
+        team_size = group['headcount'] + 1
+        peak = max(group['on_leave'])
+        if peak == 0 or (peak + 1) / team_size <= LeaveIntervalService.CAPACITY_WARNING_RATIO:
+            return None
+        peak_day = heatmap['days'][group['on_leave'].index(peak)]
+        return (
+            f"{peak} of {team_size - 1} teammates are already on leave on "
+            f"{peak_day.strftime('%d %b %Y')}; approving leaves {team_size - peak - 1} of {team_size} available."
+        )
+
+
+class LeaveScope:
+    """
+    The employees (and so the leaves) the logged-in user may see on leave
+    pages, resolved once per request:
+
+    - ADMIN / HR / SUPER ADMIN: everyone
+    - BRANCH MANAGER: employees of their branch
+    - MANAGER / TL: their direct reports (HierarchyService.team_of with
+      depth=1, as the reporting_manager filters it replaced)
+    - anyone else: nobody
+
+    Build it with LeaveScope.for_request(request); the same object is
+    returned for the rest of the request.
+    """
+
+    ALL_ROLES = ['ADMIN', 'HR', 'SUPER ADMIN']
+    TEAM_ROLES = ['MANAGER', 'TL']
+
+    def __init__(self, user_role, employee=None):
+        self.user_role = user_role
+        self.employee = employee
+        if user_role in LeaveScope.ALL_ROLES:
+            self.kind = 'all'
+        elif employee is None:
+            self.kind = 'none'
+        elif user_role == 'BRANCH MANAGER':
+            self.kind = 'branch' if employee.location else 'none'
+        elif user_role in LeaveScope.TEAM_ROLES:
+            self.kind = 'team'
+        else:
+            self.kind = 'none'
+        self._team = None
+
+    @classmethod
+    def for_request(cls, request):
+        if not hasattr(request, '_leave_scope'):
+            from hr.services import CurrentEmployeeService
+            request._leave_scope = cls(
+                request.session.get('user_role'),
+                CurrentEmployeeService.resolve(request)
+            )
+        return request._leave_scope
+
+    def employee_filter(self, prefix=''):
+        """Q selecting the visible employees; prefix='employee__' filters Leave rows"""
+        if self.kind == 'all':
+            return Q()
+        if self.kind == 'branch':
+            return self.employee.branch_lookup(prefix)
+        if self.kind == 'team':
+            if self._team is None:
+                self._team = HierarchyService.team_of(self.employee, depth=1)
+            return Q(**{f'{prefix}pk__in' if prefix else 'pk__in': self._team.values('pk')})
+        return Q(pk__in=[])
+
+    def employees(self):
+        return Employee.objects.filter(self.employee_filter())
+
+    def leaves(self):
+        return Leave.objects.filter(self.employee_filter('employee__'))
+
+    @staticmethod
+    def window_filter(window_start, window_end, prefix=''):
+        """
+        Leaves overlapping the window; either side may be None (open-ended),
+        e.g. only a from date keeps every leave that has not ended by then
+        """
+        window = Q()
+        if window_start:
+            window &= Q(**{f'{prefix}end_date__gte': window_start})
+        if window_end:
+            window &= Q(**{f'{prefix}start_date__lte': window_end})
+        return window
+
+    def dashboard_counters(self, window_start, window_end, today, branch=None,
+                           notice_days=3, filter_error=False):
+        """
+        All leave dashboard counters in one query over the visible employees
+        and their leaves:
+
+        - total: visible employees
+        - on_leave: employees with approved leave overlapping the window
+        - planned / unplanned: approved leaves in the window applied at least
+          notice_days before they start, or not
+        - pending: pending/new leaves applied in or still open in the window
+
+        Either side of the window may be None, as with a one-sided date filter.
+        branch narrows planned/unplanned/pending to one branch, as the table does.
+        With filter_error the window is ignored for those counts and on_leave is 0.
+        """
+        approved = Q(leave__status='approved')
+        in_window = LeaveScope.window_filter(window_start, window_end, 'leave__')
+        pending = Q(leave__status__in=['pending', 'new'])
+        branch_filter = Q(location=branch) if branch else Q()
+
+        if filter_error:
+            on_leave = Q(pk__isnull=True)  # matches nothing
+            planned_window = Q()
+            pending_window = Q()
+        else:
+            on_leave = approved & in_window
+            planned_window = in_window
+            applied_in_window = Q()
+            if window_start:
+                applied_in_window &= Q(leave__applied_date__date__gte=window_start)
+            if window_end:
+                applied_in_window &= Q(leave__applied_date__date__lte=window_end)
+            pending_window = applied_in_window | in_window
+            if window_start:
+                pending_window |= Q(leave__end_date__gte=window_start)
+
+        applied = approved & Q(leave__applied_date__isnull=False) & planned_window & branch_filter
+        is_planned = Q(notice__gte=timedelta(days=notice_days))
+
+        return self.employees().alias(
+            notice=ExpressionWrapper(
+                F('leave__start_date') - TruncDate('leave__applied_date'),
+                output_field=DurationField()
+            )
+        ).aggregate(
+            total=Count('pk', distinct=True),
+            on_leave=Count('pk', filter=on_leave, distinct=True),
+            planned=Count('leave', filter=applied & is_planned, distinct=True),
+            unplanned=Count('leave', filter=applied & ~is_planned, distinct=True),
+            pending=Count('leave', filter=pending & pending_window & branch_filter, distinct=True),
+        )
+
+
+class CalendarFeedService:
+    """
+    Builds the FullCalendar feed (holidays + approved leaves) for one window
+    and one role scope.
+
+    Feeds are cached per (version, scope, window); hr.signals bumps the
+    version whenever a Holiday, Leave or Employee changes, which also
+    changes the ETag so browsers revalidate with a 304.
+    """
+
+    VERSION_KEY = 'calendar_events:version'
+    MODIFIED_KEY = 'calendar_events:modified'
+    CACHE_TIMEOUT = 60 * 10
+    # FullCalendar asks for at most ~6 weeks; anything wider is clamped
+    MAX_WINDOW_DAYS = 62
+
+    HOLIDAY_COLOUR = "#f87171"
+    LEAVE_COLOUR = "#60a5fa"
+
+    @staticmethod
+    def parse_window(start, end, today=None):
+        """
+        (first day, day after the last) from FullCalendar's start/end params,
+        which may be plain dates or ISO datetimes; defaults to the current month
+        """
+        def parse(value):
+            try:
+                return datetime.strptime((value or '')[:10], '%Y-%m-%d').date()
+            except ValueError:
+                return None
+
+        today = today or timezone.localdate()
+        start_date = parse(start) or today.replace(day=1)
+        end_date = parse(end) or (start_date.replace(day=1) + relativedelta(months=1))
+        if end_date <= start_date:
+            end_date = start_date + timedelta(days=1)
+        max_end = start_date + timedelta(days=CalendarFeedService.MAX_WINDOW_DAYS)
+        return start_date, min(end_date, max_end)
+
+    @staticmethod
+    def get_scope(employee, user_role):
+        """
+        (scope key, leave filter, holiday filter) for the caller; None for the
+        leave filter means no leaves are shown
+        """
+        if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
+            return 'all', Q(), Q()
+        if employee is None:
+            return 'holidays', None, Q()
+
+        holiday_filter = Q(holiday_type__iexact='National Holiday')
+        region_id = employee.holiday_region_id
+        if region_id:
+            holiday_filter |= Q(region_id=region_id)
+
+        if user_role == 'BRANCH MANAGER':
+            scope = f"branch:{employee.location_ref_id}:{(employee.location or '').strip().lower()}"
+            return scope, employee.branch_lookup('employee__'), holiday_filter
+        if user_role in ['MANAGER', 'TL']:
+            team = HierarchyService.team_of(employee, depth=1, include_self=True)
+            return f'team:{employee.pk}', Q(employee__in=team), holiday_filter
+        return f'self:{employee.pk}', Q(employee=employee), holiday_filter
+
+    @staticmethod
+    def get_version():
+        """(version number, datetime of the last change)"""
+        version = CacheVersion.get(CalendarFeedService.VERSION_KEY)
+        modified = cache.get(CalendarFeedService.MODIFIED_KEY)
+        if modified is None:
+            modified = timezone.now().replace(microsecond=0)
+            cache.set(CalendarFeedService.MODIFIED_KEY, modified, None)
+        return version, modified
+
+    @staticmethod
+    def etag(version, scope, start_date, end_date):
+        key = f"{version}|{scope}|{start_date.isoformat()}|{end_date.isoformat()}"
+        return hashlib.md5(key.encode()).hexdigest()
+
+    @staticmethod
+    def build_events(start_date, end_date, leave_filter, holiday_filter):
+        """Holiday and approved-leave events overlapping [start_date, end_date)"""
+        events = []
+        seen_holidays = set()
+
+        holidays = Holiday.objects.filter(
+            holiday_filter, date__gte=start_date, date__lt=end_date
+        ).order_by('date', 'name').values_list('name', 'date')
+        for name, day in holidays:
+            # National holidays are stored once per region
+            if (name, day) in seen_holidays:
+                continue
+            seen_holidays.add((name, day))
+            events.append({
+                "title": f"Holiday: {name}",
+                "start": day.strftime("%Y-%m-%d"),
+                "allDay": True,
+                "color": CalendarFeedService.HOLIDAY_COLOUR,
+            })
+
+        if leave_filter is not None:
+            leaves = Leave.objects.filter(
+                leave_filter,
+                status="approved",
+                start_date__lt=end_date,
+                end_date__gte=start_date,
+            ).order_by('start_date', 'id').values_list(
+                'employee__first_name', 'employee__last_name', 'start_date', 'end_date'
+            )
+            for first_name, last_name, leave_start, leave_end in leaves:
+                events.append({
+                    "title": f"Leave: {first_name} {last_name}",
+                    "start": leave_start.strftime("%Y-%m-%d"),
+                    "end": (leave_end + timedelta(days=1)).strftime("%Y-%m-%d"),
+                    "allDay": True,
+                    "color": CalendarFeedService.LEAVE_COLOUR,
+                })
+
+        return events
+
+    @staticmethod
+    def get_events(version, scope, start_date, end_date, leave_filter, holiday_filter):
+        key = f"calendar_events:{CalendarFeedService.etag(version, scope, start_date, end_date)}"
+        events = cache.get(key)
+        if events is None:
+            events = CalendarFeedService.build_events(start_date, end_date, leave_filter, holiday_filter)
+            cache.set(key, events, CalendarFeedService.CACHE_TIMEOUT)
+        return events
+
+    @staticmethod
+    def invalidate():
+        """Called when a Holiday, Leave or Employee is saved or deleted"""
+        CacheVersion.bump(CalendarFeedService.VERSION_KEY)
+        cache.set(CalendarFeedService.MODIFIED_KEY, timezone.now().replace(microsecond=0), None)
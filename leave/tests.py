@@ -1,3 +1,56 @@
-from django.test import TestCase
+from datetime import date
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from hr.models import Employee
+from hr.tests import make_employee
+from .models import Leave, LeaveType
+from .services import LeaveIntervalService, LeaveTypeRegistry
+
+
+class LeaveSweepTests(SimpleTestCase):
+
+    def test_counts_each_employee_once_per_day(self):
+        counts = LeaveIntervalService._sweep({
+            1: [(0, 3), (2, 5)],   # overlapping leaves
+            2: [(4, 4), (5, 6)],   # adjacent leaves
+            3: [(1, 1), (1, 1)],   # the same day twice
+        }, 8)
+        self.assertEqual(counts, [1, 2, 1, 1, 2, 2, 1, 0])
+
+    def test_unsorted_and_nested_intervals(self):
+        counts = LeaveIntervalService._sweep({1: [(5, 6), (0, 9), (2, 3)]}, 10)
+        self.assertEqual(counts, [1] * 10)
+
+    def test_no_leaves(self):
+        self.assertEqual(LeaveIntervalService._sweep({}, 3), [0, 0, 0])
+
+
+class DailyHeadcountTests(TestCase):
+
+    def setUp(self):
+        LeaveTypeRegistry.invalidate()
+
+    def test_overlapping_leaves_are_counted_once(self):
+        leave_type = LeaveType.objects.create(name='Casual Leave')
+        alice = make_employee('E1', department='Dev')
+        bob = make_employee('E2', department='Dev')
+        make_employee('E3', department='Sales')
+        for employee, start, end in [
+            (alice, date(2025, 3, 3), date(2025, 3, 5)),
+            (alice, date(2025, 3, 4), date(2025, 3, 7)),
+            (bob, date(2025, 2, 27), date(2025, 3, 4)),
+        ]:
+            Leave.objects.create(
+                employee=employee, leave_type=leave_type, colour='blue', start_date=start,
+                end_date=end, reason='test', status='approved', days_requested=1
+            )
+
+        heatmap = LeaveIntervalService.daily_headcount(
+            Employee.objects.all(), date(2025, 3, 3), date(2025, 3, 8)
+        )
+        self.assertEqual(heatmap['days'][0], date(2025, 3, 3))
+        dev, sales = heatmap['groups']
+        self.assertEqual((dev['label'], dev['headcount']), ('Dev', 2))
+        self.assertEqual(dev['on_leave'], [2, 2, 1, 1, 1, 0])
+        self.assertEqual((sales['headcount'], sales['on_leave']), (1, [0] * 6))
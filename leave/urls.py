@@ -6,10 +6,12 @@ urlpatterns = [
     path('list/', views.leave_list, name='leave_list'),
     path('apply/', views.apply_leave, name='apply_leave'),
     path('approve/<int:leave_id>/', views.approve_leave, name='approve_leave'),
+    path('bulk-action/', views.bulk_leave_action, name='bulk_leave_action'),
     # path('detail/<int:leave_id>/', views.leave_detail, name='leave_detail'),
     path('regions/', views.manage_regions, name='manage_regions'),
     path('api/stats/', views.get_leave_stats_api, name='leave_stats_api'),
     path('calendar-events/', views.calendar_events, name='calendar_events'),
+    path('api/team-capacity/', views.team_capacity_api, name='team_capacity_api'),
     path('holiday/add/', views.add_holiday, name='add_holiday'),
     path('event/add/', views.add_custom_event, name='add_custom_event'),
     path('edit-holiday/', views.edit_holiday, name='edit_holiday'),
@@ -1,15 +1,21 @@
+import json
 from decimal import Decimal
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import JsonResponse
-from django.db.models import Count, Q ,Sum
+from django.db.models import Count, DecimalField, Q ,Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from datetime import date, datetime, timedelta,time
 
 from django.contrib import messages
 from django.core.paginator import Paginator
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
 from leave.forms import LeaveTypeForm
 from .models import Leave, LeaveType, Region, Holiday ,LeaveBalance
+from hr.utils import get_current_employee
+from hr.services import HierarchyService
 from hr.models import Employee, Location
 from calendar import monthrange
 
@@ -20,6 +26,13 @@ from .services import (
     ProbationService, 
     LeaveAccrualService,
     OptionalLeaveService,
+    LeaveLedgerService,
+    LeaveTypeRegistry,
+    WorkingDayCalendar,
+    CalendarFeedService,
+    LeaveIntervalService,
+    LeaveScope,
+    BulkLeaveActionService,
     initialize_employee_leave_balances
 )
 
@@ -35,115 +48,33 @@ def leave_dashboard(request):
     today = timezone.now().date()
     current_year = today.year
     
+    # Who the user can see, resolved once for every count and list below
+    scope = LeaveScope.for_request(request)
+    employee = scope.employee
+    
     # Get logged-in user's region/location
-    user_email = request.session.get('user_email')
     user_region = None
     default_region_id = None
-    current_branch_manager_location = None
-    
-    try:
-        # Try to get employee's location
-        employee = Employee.objects.get(email=user_email)
-        if employee.location:
-            # Find matching region by location name
-            region = Location.objects.filter(
-                Q(name__iexact=employee.location) | 
-                Q(code__iexact=employee.location),
-                is_active=True
-            ).first()
-            if region:
-                user_region = region
-                default_region_id = region.id
-            current_branch_manager_location = employee.location
-    except Employee.DoesNotExist:
-        pass
-    
-    # ✅ Role-based employee filtering for statistics
-    if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
-        total_employees = Employee.objects.count()
-    elif user_role == 'BRANCH MANAGER':
-        try:
-            current_branch_manager = Employee.objects.get(email=user_email)
-            if current_branch_manager.location:
-                total_employees = Employee.objects.filter(
-                    location__iexact=current_branch_manager.location
-                ).count()
-            else:
-                total_employees = 0
-        except Employee.DoesNotExist:
-            total_employees = 0
-    elif user_role in ['MANAGER','TL']:
-        # Get the current manager's employee record
-        current_manager = Employee.objects.get(email=user_email)
-           
-        # Filter by reporting_manager_id OR by reporting_manager name (fallback)
-        total_employees = Employee.objects.filter(
-             Q(reporting_manager_id=current_manager.id) |
-                Q(reporting_manager__icontains=current_manager.first_name)
-            ).order_by('first_name').count()
-        # Existing manager logic
-        # total_employees = Employee.objects.filter(
-        #     department=request.session.get('user_department')
-        # ).count()
-    else:
-        total_employees = 0
-    
-    # Today Present (employees not on leave today)
-    if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
-        employees_on_leave_today = Leave.objects.filter(
-            start_date__lte=today,
-            end_date__gte=today,
-            status='approved'
-        ).values_list('employee_id', flat=True)
-    elif user_role == 'BRANCH MANAGER':
-        try:
-            current_branch_manager = Employee.objects.get(email=user_email)
-            if current_branch_manager.location:
-                employees_on_leave_today = Leave.objects.filter(
-                    start_date__lte=today,
-                    end_date__gte=today,
-                    status='approved',
-                    employee__location__iexact=current_branch_manager.location
-                ).values_list('employee_id', flat=True)
-            else:
-                employees_on_leave_today = []
-        except Employee.DoesNotExist:
-            employees_on_leave_today = []
-    elif user_role in ['MANAGER','TL']:
-        try:
-            # FIX: Get the current manager's employee record
-            current_manager = Employee.objects.get(email=user_email)
-            
-            # FIX: Get team members using the SAME filter as total_employees
-            manager_team_qs = Employee.objects.filter(
-                Q(reporting_manager_id=current_manager.id) |
-                Q(reporting_manager__icontains=current_manager.first_name)
-            )
-            
-            # Get approved leaves for these team members today
-            employees_on_leave_today = Leave.objects.filter(
-                start_date__lte=today,
-                end_date__gte=today,
-                status='approved',
-                employee__in=manager_team_qs
-            ).values_list('employee_id', flat=True)
-        except Employee.DoesNotExist:
-            employees_on_leave_today = []
-    else:
-        employees_on_leave_today = []
-        
-    today_present = total_employees - len(set(employees_on_leave_today))
-    today_present_percentage = int((today_present / total_employees) * 100) if total_employees > 0 else 0
+    if employee and employee.location:
+        # Find matching region by location name
+        user_region = Location.objects.filter(
+            Q(name__iexact=employee.location) | 
+            Q(code__iexact=employee.location),
+            is_active=True
+        ).first()
+        if user_region:
+            default_region_id = user_region.id
     
     # =============================================
     # NOTICE THRESHOLD (used later)
     # =============================================
-    NOTICE_THRESHOLD = timedelta(days=3)
+    NOTICE_THRESHOLD_DAYS = 3
     
     # 🔹 Handle date filtering (from query params)
     from_date = request.GET.get('from_date')
     to_date = request.GET.get('to_date')
     status_filter = request.GET.get('status', '')  # 🆕 Get status filter
+    branch_filter = request.GET.get('branch', '')
     
     # Variables for display in template (DD-MM-YYYY format)
     from_date_display = from_date
@@ -191,120 +122,54 @@ def leave_dashboard(request):
         if from_date_db > to_date_db:
             filter_error = "From date cannot be greater than To date"
     
-    # ✅ employees_on_leave_today should also count from from_date to to_date
-    if not filter_error:
-        # safety: if one side is missing, default it to today (shouldn't happen with your logic)
-        if not from_date_db:
-            from_date_db = today
-        if not to_date_db:
-            to_date_db = today
-
-        # base overlap condition for the selected range
-        base_filter = Q(
-            start_date__lte=to_date_db,
-            end_date__gte=from_date_db,
-            status='approved'
-        )
-
-        if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
-            employees_on_leave_today_qs = Leave.objects.filter(base_filter)
-        elif user_role == 'BRANCH MANAGER':
-            if current_branch_manager_location:
-                employees_on_leave_today_qs = Leave.objects.filter(
-                    base_filter,
-                    employee__location__iexact=current_branch_manager_location
-                )
-            else:
-                employees_on_leave_today_qs = Leave.objects.none()
-        elif user_role in ['MANAGER','TL']:
-            # FIX: Use reporting manager filter here too
-            try:
-                current_manager = Employee.objects.get(email=user_email)
-                manager_team_qs = Employee.objects.filter(
-                    Q(reporting_manager_id=current_manager.id) |
-                    Q(reporting_manager__icontains=current_manager.first_name)
-                )
-                
-                employees_on_leave_today_qs = Leave.objects.filter(
-                    base_filter,
-                    employee__in=manager_team_qs
-                )
-            except Employee.DoesNotExist:
-                employees_on_leave_today_qs = Leave.objects.none()
-        else:
-            employees_on_leave_today_qs = Leave.objects.none()
-
-        employees_on_leave_today = employees_on_leave_today_qs.values_list(
-            'employee_id', flat=True
-        )
-    else:
-        employees_on_leave_today = []
-
-    today_present = total_employees - len(set(employees_on_leave_today))
-    today_present_percentage = int((today_present / total_employees) * 100) if total_employees > 0 else 0
+    # =============================================
+    # ALL COUNTERS (present / on leave / planned / short notice / pending)
+    # in one aggregate query over the visible employees
+    # =============================================
+    counters = scope.dashboard_counters(
+        from_date_db, to_date_db, today,
+        branch=branch_filter,
+        notice_days=NOTICE_THRESHOLD_DAYS,
+        filter_error=bool(filter_error)
+    )
+    total_employees = counters['total']
+    employees_on_leave = counters['on_leave']
+    planned_leaves = counters['planned']
+    unplanned_leaves = counters['unplanned']
+    pending_requests = counters['pending']
     
-     # Get current user employee object for exclusion
-    current_user_emp = None
-    try:
-        current_user_emp = Employee.objects.get(email=user_email)
-    except Employee.DoesNotExist:
-        pass
+    def percentage(count):
+        return int((count / total_employees) * 100) if total_employees > 0 else 0
     
+    today_present = total_employees - employees_on_leave
+    today_present_percentage = percentage(today_present)
+    planned_leaves_percentage = percentage(planned_leaves)
+    unplanned_leaves_percentage = percentage(unplanned_leaves)
+    pending_requests_percentage = percentage(pending_requests)
     
     # Recent leaves with role-based filtering
     recent_leaves = Leave.objects.select_related('employee', 'leave_type')
     
     # EXCLUDE CURRENT USER'S LEAVES from recent_leaves
-    if current_user_emp:
-        recent_leaves = recent_leaves.exclude(employee=current_user_emp)
-        
-        
-    if user_role in ['MANAGER', 'TL']:
-      
-        current_manager = Employee.objects.get(email=user_email)
-
-        manager_team_qs = Employee.objects.filter(
-             Q(reporting_manager_id=current_manager.id) |
-                Q(reporting_manager__icontains=current_manager.first_name)
-            )
-        recent_leaves = recent_leaves.filter(employee__in=list(manager_team_qs))
-    elif user_role == 'BRANCH MANAGER' and current_branch_manager_location:
-        recent_leaves = recent_leaves.filter(employee__location__iexact=current_branch_manager_location)
+    if employee:
+        recent_leaves = recent_leaves.exclude(employee=employee)
+    
+    if scope.kind != 'all' and user_role in ['MANAGER', 'TL', 'BRANCH MANAGER']:
+        recent_leaves = recent_leaves.filter(scope.employee_filter('employee__'))
 
     # 🔹 UPDATED: Show pending status leaves if end date hasn't passed
     if not filter_error:
-        if from_date_db and to_date_db:
-            # When both dates are provided, show leaves that:
-            # 1. Overlap with the date range OR
-            # 2. Are pending/new AND end date hasn't passed
-            recent_leaves = recent_leaves.filter(
-                # Leaves that overlap with the selected date range
-                Q(start_date__lte=to_date_db, end_date__gte=from_date_db) |
-                # Pending/New leaves that haven't ended yet
-                Q(status__in=['pending', 'new'], end_date__gte=today)
-            ).distinct()
-        elif from_date_db:
-            # Only from_date provided - show leaves that:
-            recent_leaves = recent_leaves.filter(
-                Q(end_date__gte=from_date_db) |
-                Q(status__in=['pending', 'new'], end_date__gte=today)
-            ).distinct()
-        elif to_date_db:
-            # Only to_date provided - show leaves that:
-            recent_leaves = recent_leaves.filter(
-                Q(start_date__lte=to_date_db) |
-                Q(status__in=['pending', 'new'], end_date__gte=today)
-            ).distinct()
-        else:
-            # No date filters - show leaves that are either:
-            # - Within today's date range OR
-            # - Are pending/new and haven't ended yet
-            recent_leaves = recent_leaves.filter(
-                Q(start_date__lte=today, end_date__gte=today) |
-                Q(status__in=['pending', 'new'], end_date__gte=today)
-            ).distinct()
+        # Show leaves that:
+        # 1. Overlap with the date range OR
+        # 2. Are pending/new AND end date hasn't passed
+        recent_leaves = recent_leaves.filter(
+            # Leaves that overlap with the selected date range
+            # (one-sided when only a from or to date is given)
+            LeaveScope.window_filter(from_date_db, to_date_db) |
+            # Pending/New leaves that haven't ended yet
+            Q(status__in=['pending', 'new'], end_date__gte=today)
+        )
     
-    branch_filter = request.GET.get('branch', '')
     # 🆕 Apply status filter to the table (if provided)
     if status_filter:
         recent_leaves = recent_leaves.filter(status=status_filter)
@@ -312,159 +177,6 @@ def leave_dashboard(request):
         recent_leaves = recent_leaves.filter(employee__location=branch_filter)
         
     recent_leaves = recent_leaves.order_by('-applied_date')[:50]  # limit for performance
-
-    # =============================================
-    # INTEGRATED PLANNED vs SHORT-NOTICE LOGIC (FILTERED)
-    # =============================================
-    # Base queryset for approved leaves (role-based)
-    if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
-        planned_unplanned_base = Leave.objects.filter(
-            status='approved',
-            applied_date__isnull=False
-        )
-    elif user_role == 'BRANCH MANAGER':
-        try:
-            current_branch_manager = Employee.objects.get(email=user_email)
-            if current_branch_manager.location:
-                planned_unplanned_base = Leave.objects.filter(
-                    status='approved',
-                    applied_date__isnull=False,
-                    employee__location__iexact=current_branch_manager.location
-                )
-            else:
-                planned_unplanned_base = Leave.objects.none()
-        except Employee.DoesNotExist:
-            planned_unplanned_base = Leave.objects.none()
-    elif user_role in ['MANAGER','TL']:
-        # FIX: Use reporting manager filter instead of department
-        try:
-            current_manager = Employee.objects.get(email=user_email)
-            manager_team_qs = Employee.objects.filter(
-                Q(reporting_manager_id=current_manager.id) |
-                Q(reporting_manager__icontains=current_manager.first_name)
-            )
-            
-            planned_unplanned_base = Leave.objects.filter(
-                status='approved',
-                applied_date__isnull=False,
-                employee__in=manager_team_qs
-            )
-        except Employee.DoesNotExist:
-            planned_unplanned_base = Leave.objects.none()
-            
-    else:
-        planned_unplanned_base = Leave.objects.none()
-
-    # Apply date overlap filters to match recent_leaves window (or today's window when no filters)
-    if not filter_error:
-        if from_date_db and to_date_db:
-            planned_unplanned_base = planned_unplanned_base.filter(
-                Q(start_date__lte=to_date_db, end_date__gte=from_date_db)
-            )
-        elif from_date_db:
-            planned_unplanned_base = planned_unplanned_base.filter(
-                Q(end_date__gte=from_date_db)
-            )
-        elif to_date_db:
-            planned_unplanned_base = planned_unplanned_base.filter(
-                Q(start_date__lte=to_date_db)
-            )
-        else:
-            planned_unplanned_base = planned_unplanned_base.filter(
-                Q(start_date__lte=today, end_date__gte=today)
-            )
-
-    # Apply branch filter if present so counts match the table's branch selection
-    if branch_filter:
-        planned_unplanned_base = planned_unplanned_base.filter(employee__location=branch_filter)
-
-    # Compute planned vs unplanned using NOTICE_THRESHOLD
-    planned_leaves = 0
-    unplanned_leaves = 0
-
-    for leave in planned_unplanned_base.only('start_date', 'applied_date'):
-        try:
-            applied_raw = leave.applied_date
-            applied_date = applied_raw.date() if hasattr(applied_raw, 'date') else applied_raw
-
-            if not applied_date or not leave.start_date:
-                unplanned_leaves += 1
-                continue
-
-            delta = leave.start_date - applied_date
-            if delta >= NOTICE_THRESHOLD:
-                planned_leaves += 1
-            else:
-                unplanned_leaves += 1
-        except Exception:
-            unplanned_leaves += 1
-
-    planned_leaves_percentage = int((planned_leaves / total_employees) * 100) if total_employees > 0 else 0
-    unplanned_leaves_percentage = int((unplanned_leaves / total_employees) * 100) if total_employees > 0 else 0
-
-    # =============================================
-    # PENDING REQUESTS WITH DATE FILTERING + ROLE-BASED (FIXED)
-    # -> Now mirrors the table's date/branch scope so counts align
-    # =============================================
-    if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
-        pending_base = Leave.objects.filter(
-            status__in=['pending', 'new']
-        ).exclude(status='withdrawn')
-    elif user_role == 'BRANCH MANAGER':
-        try:
-            current_branch_manager = Employee.objects.get(email=user_email)
-            if current_branch_manager.location:
-                pending_base = Leave.objects.filter(
-                    status__in=['pending', 'new'],
-                    employee__location__iexact=current_branch_manager.location
-                ).exclude(status='withdrawn')
-            else:
-                pending_base = Leave.objects.none()
-        except Employee.DoesNotExist:
-            pending_base = Leave.objects.none()
-    elif user_role in ['MANAGER','TL']:
-        current_manager = Employee.objects.get(email=user_email)
-        pending_base = Leave.objects.filter(
-            status__in=['pending', 'new'],
-            employee__in=Employee.objects.filter(
-            Q(reporting_manager_id=current_manager.id) |
-            Q(reporting_manager__icontains=current_manager.first_name)
-        )).exclude(status='withdrawn')
-    else:
-        pending_base = Leave.objects.none()
-
-    # Apply SAME date overlap logic as recent_leaves so pending count respects selected range
-    if not filter_error:
-        if from_date_db and to_date_db:
-            pending_base = pending_base.filter(
-                Q(applied_date__date__range=(from_date_db, to_date_db)) |
-                Q(start_date__lte=to_date_db, end_date__gte=from_date_db) |
-                Q(end_date__gte=from_date_db)
-            )
-        elif from_date_db:
-            pending_base = pending_base.filter(
-                Q(applied_date__date__gte=from_date_db) |
-                Q(end_date__gte=from_date_db)
-            )
-        elif to_date_db:
-            pending_base = pending_base.filter(
-                Q(applied_date__date__lte=to_date_db) |
-                Q(start_date__lte=to_date_db)
-            )
-        else:
-            # default -> today's window
-            pending_base = pending_base.filter(
-                Q(applied_date__date=today) |
-                Q(start_date__lte=today, end_date__gte=today) |
-                Q(end_date__gte=today)
-            )
-
-    # Apply branch filter to pending count as well
-    if branch_filter:
-        pending_base = pending_base.filter(employee__location=branch_filter)
-
-    pending_requests = pending_base.distinct().count()
-    pending_requests_percentage = int((pending_requests / total_employees) * 100) if total_employees > 0 else 0
     
     # =============================================
     # ADD NOTICE TYPE TO RECENT LEAVES
@@ -493,7 +205,7 @@ def leave_dashboard(request):
                 
                 # Check for short notice (less than 3 days notice)
                 if days_until_start >= 0:  # Only check if applied before or on start date
-                    if days_until_start < 3:  # Less than 3 days notice
+                    if days_until_start < NOTICE_THRESHOLD_DAYS:  # Less than 3 days notice
                         notice = 'short_notice'
                     else:
                         notice = 'planned'
@@ -542,7 +254,7 @@ def leave_dashboard(request):
         ).count()
     context = {
         'is_hr_admin_manager': is_hr_admin_manager,
-        'employees_on_leave_today': len(set(employees_on_leave_today)),
+        'employees_on_leave_today': employees_on_leave,
         'today_present': today_present,
         'today_present_total': total_employees,
         'today_present_percentage': today_present_percentage,
@@ -572,7 +284,7 @@ def leave_dashboard(request):
         'current_year_holidays_count': current_year_holidays_count,
         'user_region': user_region,
         'default_region_id': default_region_id,
-        'notice_threshold_days': 3,  
+        'notice_threshold_days': NOTICE_THRESHOLD_DAYS,
         # 'advance_notice_warning':advance_notice_warning
     }
     
@@ -696,95 +408,12 @@ def calculate_working_days_with_optional(start_date, end_date, location=None):
         location (str): Employee's location/region name
     
     Returns:
-        int: Number of working days
-    """
-    if start_date > end_date:
-        return {
-            'working_days': 0,
-            'optional_holidays': [],
-            'mandatory_holidays': [],
-            'total_calendar_days': 0
-        }
-    
-    working_days = 0
-    current_date = start_date
-    
-    # Get mandatory holidays (National + State, non-optional)
-    mandatory_holiday_dates = set()
-    
-    # National mandatory holidays (holiday_type = 'National Holiday' AND is_optional = False)
-    national_holidays = Holiday.objects.filter(
-        Q(holiday_type__iexact='National Holiday'),
-        date__gte=start_date,
-        date__lte=end_date,
-        is_optional=False
-    ).values_list('date', flat=True)
-    
-    mandatory_holiday_dates.update(national_holidays)
-    
-    # State mandatory holidays for the specific location
-    if location:
-        matching_region = Location.objects.filter(
-            name__iexact=location
-        ).first()
-        
-        if matching_region:
-            state_holidays = Holiday.objects.filter(
-                region=matching_region,
-                holiday_type__iexact='State Holiday',
-                date__gte=start_date,
-                date__lte=end_date,
-                is_optional=False
-            ).values_list('date', flat=True)
-            
-            mandatory_holiday_dates.update(state_holidays)
-    
-    # Get optional holidays (holiday_type = 'Optional Holiday' AND is_optional = True)
-    optional_holidays_query = Holiday.objects.filter(
-        holiday_type__iexact='Optional Holiday',
-        date__gte=start_date,
-        date__lte=end_date,
-        is_optional=True
-    )
+        dict: working_days, optional_holidays, mandatory_holidays, total_calendar_days
     
-    # Filter by region if location provided
-    if location:
-        matching_region = Location.objects.filter(name__iexact=location).first()
-        if matching_region:
-            optional_holidays_query = optional_holidays_query.filter(
-                Q(region=matching_region) | Q(region__isnull=True)
-            )
-    
-    optional_holidays_list = []
-    optional_holiday_dates = set()
-    
-    for holiday in optional_holidays_query:
-        optional_holidays_list.append({
-            'date': holiday.date,
-            'name': holiday.name,
-            'region': holiday.region.name if holiday.region else 'National',
-            'id': holiday.id
-        })
-        optional_holiday_dates.add(holiday.date)
-    
-    # Calculate working days (exclude Sundays and mandatory holidays)
-    total_calendar_days = 0
-    while current_date <= end_date:
-        total_calendar_days += 1
-        
-        # Exclude Sundays (weekday 6) and mandatory holidays
-        # Optional holidays are COUNTED as working days initially
-        if current_date.weekday() != 6 and current_date not in mandatory_holiday_dates:
-            working_days += 1
-        
-        current_date += timedelta(days=1)
-    
-    return {
-        'working_days': working_days,
-        'optional_holidays': optional_holidays_list,
-        'mandatory_holidays': list(mandatory_holiday_dates),
-        'total_calendar_days': total_calendar_days
-    }
+    Backed by WorkingDayCalendar, so repeated calls do no per-day work.
+    """
+    region_id = Location.match(None, location) if location else None
+    return WorkingDayCalendar.describe_range(region_id, start_date, end_date)
 
 
 def apply_leave(request):
@@ -792,7 +421,7 @@ def apply_leave(request):
     user_role = request.session.get('user_role')
     
     try:
-        employee = Employee.objects.get(email=user_email)
+        employee = get_current_employee(request)
     except Employee.DoesNotExist:
         messages.error(request, 'Employee profile not found.')
         return redirect('employee_dashboard')
@@ -856,14 +485,9 @@ def apply_leave(request):
                 return redirect('apply_leave')
             
             # Check for overlapping leaves
-            overlapping_leaves = Leave.objects.filter(
-                employee=employee,
-                status__in=['pending', 'approved'],
-                start_date__lte=end_date_obj,
-                end_date__gte=start_date_obj
-            ).exclude(status='rejected')
+            overlapping_leaves = LeaveIntervalService.overlaps([employee.pk], start_date_obj, end_date_obj)
 
-            if overlapping_leaves.exists():
+            if overlapping_leaves:
                 overlap_details = []
                 for leave in overlapping_leaves:
                     status_display = "Applied" if leave.status == 'pending' else "Approved"
@@ -909,14 +533,13 @@ def apply_leave(request):
                 return redirect('apply_leave')
             
             # Get requested leave type
-            try:
-                requested_leave_type = LeaveType.objects.get(id=leave_type_id)
-            except LeaveType.DoesNotExist:
+            requested_leave_type = LeaveTypeRegistry.by_id(leave_type_id) if str(leave_type_id).isdigit() else None
+            if requested_leave_type is None:
                 messages.warning(request, 'Invalid leave type selected.')
                 return redirect('apply_leave')
             
             # Check if requested leave type is Optional Leave
-            is_optional_leave_type = 'optional' in requested_leave_type.name.lower()
+            is_optional_leave_type = LeaveTypeRegistry.is_kind(requested_leave_type, 'optional')
             
             # ============================================
             # OPTIONAL LEAVE STRICT VALIDATION (SINGLE DAY ONLY)
@@ -983,16 +606,12 @@ def apply_leave(request):
             # Get Optional Leave type (initialize it early so it's available in all cases)
             optional_leave_type = None
             if not is_half_day and (optional_days_count > 0 or is_optional_leave_type):
-                optional_leave_type = LeaveType.objects.filter(
-                    Q(name__icontains='optional') | Q(name__icontains='Optional')
-                ).first()
+                optional_leave_type = LeaveTypeRegistry.get('optional', active_only=False)
                 
                 if not optional_leave_type:
-                    optional_leave_type = LeaveType.objects.create(
-                        name='Optional Leave',
-                        description='Optional holidays leave',
-                        is_active=True,
-                        colour='#28a745'
+                    optional_leave_type = LeaveTypeRegistry.get_or_create(
+                        'optional', 'Optional Leave',
+                        defaults={'is_active': True, 'is_optional': True, 'remark': 'Optional holidays leave'}
                     )
                     messages.info(request, 'Created Optional Leave type automatically.')
             
@@ -1039,10 +658,7 @@ def apply_leave(request):
                         is_optional_partial_unpaid = True
                         
                         # Get unpaid leave type for optional portion
-                        unpaid_leave_type = LeaveType.objects.filter(
-                            is_active=True,
-                            name__icontains='unpaid'
-                        ).first()
+                        unpaid_leave_type = LeaveTypeRegistry.get('unpaid')
                         
                         if unpaid_leave_type:
                             # Create paid optional leave
@@ -1106,10 +722,7 @@ def apply_leave(request):
                 if not created_leaves or (created_leaves and not is_optional_partial_unpaid):
                     # Handle fully unpaid optional leave
                     if is_optional_partial_unpaid and optional_unpaid_days > 0:
-                        unpaid_leave_type = LeaveType.objects.filter(
-                            is_active=True,
-                            name__icontains='unpaid'
-                        ).first()
+                        unpaid_leave_type = LeaveTypeRegistry.get('unpaid')
                         
                         if unpaid_leave_type:
                             optional_final_leave_type = unpaid_leave_type
@@ -1205,10 +818,7 @@ def apply_leave(request):
                             is_optional_partial_unpaid = True
                             
                             # Get unpaid leave type
-                            unpaid_leave_type = LeaveType.objects.filter(
-                                is_active=True,
-                                name__icontains='unpaid'
-                            ).first()
+                            unpaid_leave_type = LeaveTypeRegistry.get('unpaid')
                             
                             if unpaid_leave_type:
                                 # Create paid optional leave
@@ -1273,10 +883,7 @@ def apply_leave(request):
                     if not created_leaves:
                         # Handle fully unpaid optional leave
                         if is_optional_partial_unpaid and optional_unpaid_days > 0:
-                            unpaid_leave_type = LeaveType.objects.filter(
-                                is_active=True,
-                                name__icontains='unpaid'
-                            ).first()
+                            unpaid_leave_type = LeaveTypeRegistry.get('unpaid')
                             
                             if unpaid_leave_type:
                                 optional_final_leave_type = unpaid_leave_type
@@ -1354,10 +961,7 @@ def apply_leave(request):
                             is_partial_unpaid = True
                             
                             # Get unpaid leave type
-                            unpaid_leave_type = LeaveType.objects.filter(
-                                is_active=True,
-                                name__icontains='unpaid'
-                            ).first()
+                            unpaid_leave_type = LeaveTypeRegistry.get('unpaid')
                             
                             if unpaid_leave_type:
                                 # Create paid leave record
@@ -1429,10 +1033,7 @@ def apply_leave(request):
                     # If we reach here, it's either fully paid or fully unpaid (not partial)
                     if is_partial_unpaid and unpaid_days > 0:
                         # Fully unpaid leave
-                        unpaid_leave_type = LeaveType.objects.filter(
-                            is_active=True,
-                            name__icontains='unpaid'
-                        ).first()
+                        unpaid_leave_type = LeaveTypeRegistry.get('unpaid')
                         
                         if unpaid_leave_type:
                             final_leave_type = unpaid_leave_type
@@ -1506,7 +1107,7 @@ def apply_leave(request):
             return redirect('employee_leave_details')
     
     # GET request - show form (same as before)
-    leave_types = LeaveType.objects.filter(is_active=True)
+    leave_types = LeaveTypeRegistry.all()
     
     # Get leave balances for current year
     leave_balances = LeaveBalance.objects.filter(
@@ -1521,24 +1122,8 @@ def apply_leave(request):
         probation_message = "⚠️ You are currently on probation. You have no earned leave balance. Any leave taken will be unpaid."
     
     # Get mandatory holidays for JavaScript calculation
-    national_holidays = Holiday.objects.filter(
-        Q(holiday_type__iexact='National Holiday'),
-        date__year=date.today().year,
-        is_optional=False
-    ).values_list('date', flat=True)
-    
-    state_holidays = []
-    if employee.location:
-        matching_region = Location.objects.filter(name__iexact=employee.location).first()
-        if matching_region:
-            state_holidays = Holiday.objects.filter(
-                region=matching_region,
-                holiday_type__iexact='State Holiday',
-                date__year=date.today().year,
-                is_optional=False
-            ).values_list('date', flat=True)
-    
-    all_mandatory_holidays = set(national_holidays) | set(state_holidays)
+    region_id = employee.holiday_region_id if employee.location else None
+    all_mandatory_holidays = WorkingDayCalendar.mandatory_holidays(region_id, date.today().year)
     holiday_dates_json = [f'"{holiday.isoformat()}"' for holiday in all_mandatory_holidays]
     
     context = {
@@ -1557,10 +1142,8 @@ def apply_leave(request):
 
 
 def get_existing_leaves(request):
-    user_email = request.session.get('user_email')
-    
     try:
-        employee = Employee.objects.get(email=user_email)
+        employee = get_current_employee(request)
         
         # Get existing pending and approved leaves
         existing_leaves = Leave.objects.filter(
@@ -1611,10 +1194,9 @@ def get_optional_holidays_api(request):
     """API endpoint to get optional holidays for a date range"""
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
-    user_email = request.session.get('user_email')
     
     try:
-        employee = Employee.objects.get(email=user_email)
+        employee = get_current_employee(request)
         
         start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
         end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
@@ -1646,7 +1228,7 @@ def approve_leave(request, leave_id):
     if not request.session.get('user_authenticated'):
         return redirect('login')
     try:
-        updated_by = Employee.objects.get(email=request.session.get('user_email'))
+        updated_by = get_current_employee(request)
     except Employee.DoesNotExist:
         messages.error(request, 'Employee profile not found.')
         return redirect('leave_dashboard')
@@ -1663,13 +1245,14 @@ def approve_leave(request, leave_id):
         
         if action == 'approve':
             # Check if this is unpaid leave TYPE (not just the flag)
-            is_unpaid_leave = 'unpaid' in leave.leave_type.name.lower()
+            is_unpaid_leave = LeaveTypeRegistry.is_kind(leave.leave_type, 'unpaid')
             
             if is_unpaid_leave:
                 # UNPAID LEAVE - No balance check needed, just record it
                 AutoLeaveBalanceService.record_unpaid_leave(
                     leave.employee,
-                    leave.days_requested
+                    leave.days_requested,
+                    leave=leave
                 )
                 
                 leave.status = 'approved'
@@ -1705,7 +1288,8 @@ def approve_leave(request, leave_id):
                         leave.employee,
                         leave.leave_type,
                         leave.days_requested,
-                        leave.start_date.year
+                        leave.start_date.year,
+                        leave=leave
                     )
                     
                     if not success:
@@ -1725,6 +1309,12 @@ def approve_leave(request, leave_id):
                     f'✅ Leave approved for {leave.employee.first_name} {leave.employee.last_name}'
                 )
             
+            # Let the approver know when the team is getting thin on these dates
+            if previous_status != 'approved':
+                capacity_warning = LeaveIntervalService.capacity_warning(leave)
+                if capacity_warning:
+                    messages.warning(request, f'⚠ {capacity_warning}')
+            
         elif action == 'reject':
             # If previously approved, restore the leave balance
             if previous_status == 'approved' and not leave.is_unpaid:
@@ -1732,7 +1322,8 @@ def approve_leave(request, leave_id):
                     leave.employee,
                     leave.leave_type,
                     leave.days_requested,
-                    leave.start_date.year
+                    leave.start_date.year,
+                    leave=leave
                 )
                 
                 if success:
@@ -1756,6 +1347,62 @@ def approve_leave(request, leave_id):
         
     return redirect(request.META.get('HTTP_REFERER', 'leave_dashboard'))
 
+def bulk_leave_action(request):
+    """
+    Approve or reject several leaves at once.
+    POST leave_ids (repeated or comma separated), action, rejection_reason;
+    a JSON body with the same keys also works. Returns per-leave results.
+    """
+    if not request.session.get('user_authenticated'):
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    
+    scope = LeaveScope.for_request(request)
+    if scope.kind == 'none':
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+    
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or '{}')
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        leave_ids = data.get('leave_ids') or []
+        action = data.get('action')
+        rejection_reason = data.get('rejection_reason', '')
+    else:
+        leave_ids = [
+            value for raw in request.POST.getlist('leave_ids') for value in raw.split(',') if value.strip()
+        ]
+        action = request.POST.get('action')
+        rejection_reason = request.POST.get('rejection_reason', '')
+    
+    if action not in BulkLeaveActionService.ACTIONS:
+        return JsonResponse({'error': 'action must be approve or reject'}, status=400)
+    try:
+        leave_ids = [int(leave_id) for leave_id in leave_ids]
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'leave_ids must be numbers'}, status=400)
+    if not leave_ids:
+        return JsonResponse({'error': 'No leaves selected'}, status=400)
+    if len(leave_ids) > BulkLeaveActionService.MAX_LEAVES:
+        return JsonResponse({'error': f'At most {BulkLeaveActionService.MAX_LEAVES} leaves at a time'}, status=400)
+    
+    results = BulkLeaveActionService.apply(
+        leave_ids,
+        action,
+        actor=scope.employee,
+        rejection_reason=rejection_reason,
+        scope=scope
+    )
+    succeeded = sum(1 for result in results if result['status'] in ['approved', 'rejected'])
+    return JsonResponse({
+        'action': action,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results,
+    })
+
 def update_leave_status(request, leave_id):
     """Handle leave status changes from edit page with balance management"""
     if not request.session.get('user_authenticated'):
@@ -1763,7 +1410,7 @@ def update_leave_status(request, leave_id):
     
     leave = get_object_or_404(Leave, id=leave_id)
     try:
-        updated_by = Employee.objects.get(email=request.session.get('user_email'))
+        updated_by = get_current_employee(request)
     except Employee.DoesNotExist:
         messages.error(request, 'Employee profile not found.')
         return redirect('leave_dashboard')
@@ -1790,7 +1437,8 @@ def update_leave_status(request, leave_id):
                     leave.employee,
                     leave.leave_type,
                     leave.days_requested,
-                    leave.start_date.year
+                    leave.start_date.year,
+                    leave=leave
                 )
                     
                 if success:
@@ -1816,7 +1464,8 @@ def update_leave_status(request, leave_id):
                         leave.employee,
                         leave.leave_type,
                         leave.days_requested,
-                        leave.start_date.year
+                        leave.start_date.year,
+                        leave=leave
                     )
                         
                     if success:
@@ -1857,8 +1506,7 @@ def withdraw_leave(request, leave_id):
     
     try:
         # Get current employee
-        user_email = request.session.get('user_email')
-        current_employee = Employee.objects.get(email=user_email)
+        current_employee = get_current_employee(request)
         
         # Get the leave application
         leave = Leave.objects.get(id=leave_id)
@@ -1882,7 +1530,8 @@ def withdraw_leave(request, leave_id):
                 leave.employee,
                 leave.leave_type,
                 leave.days_requested,
-                leave.start_date.year
+                leave.start_date.year,
+                leave=leave
             )
             
             if success:
@@ -2021,31 +1670,70 @@ def leave_view(request):
     return redirect('leave_dashboard')
 
 def calendar_events(request):
-    """Return holidays and approved leaves as JSON for FullCalendar"""
-    events = []
+    """Return holidays and approved leaves in FullCalendar's start/end window as JSON"""
+    start_date, end_date = CalendarFeedService.parse_window(
+        request.GET.get('start'), request.GET.get('end')
+    )
 
-    # 1. Holidays
-    holidays = Holiday.objects.all()
-    for h in holidays:
-        events.append({
-            "title": f"Holiday: {h.name}",
-            "start": h.date.strftime("%Y-%m-%d"),
-            "allDay": True,
-            "color": "#f87171",
-        })
+    user_role = request.session.get('user_role')
+    try:
+        employee = get_current_employee(request)
+    except Employee.DoesNotExist:
+        employee = None
+    scope, leave_filter, holiday_filter = CalendarFeedService.get_scope(employee, user_role)
 
-    # 2. Approved Leaves
-    leaves = Leave.objects.filter(status="approved")
-    for l in leaves:
-        events.append({
-            "title": f"Leave: {l.employee.first_name} {l.employee.last_name}",
-            "start": l.start_date.strftime("%Y-%m-%d"),
-            "end": (l.end_date + timedelta(days=1)).strftime("%Y-%m-%d"),
-            "allDay": True,
-            "color": "#60a5fa",
-        })
+    version, modified = CalendarFeedService.get_version()
+    etag = f'"{CalendarFeedService.etag(version, scope, start_date, end_date)}"'
+    last_modified = modified.timestamp()
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        events = CalendarFeedService.get_events(
+            version, scope, start_date, end_date, leave_filter, holiday_filter
+        )
+        response = JsonResponse(events, safe=False)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Per-user feed: browsers may keep it but must revalidate every time
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+def team_capacity_api(request):
+    """
+    Day-by-day count of employees on approved leave, per department,
+    location or team (?group_by=), for the employees the user can see.
+    Takes the same start/end window as calendar_events.
+    """
+    if not request.session.get('user_authenticated'):
+        return JsonResponse({'error': 'Not authenticated'}, status=401)
+    
+    scope = LeaveScope.for_request(request)
+    if scope.kind == 'none':
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+    
+    group_by = request.GET.get('group_by') or ('department' if scope.kind == 'all' else 'team')
+    if group_by not in LeaveIntervalService.GROUPS:
+        return JsonResponse({'error': f'group_by must be one of {", ".join(LeaveIntervalService.GROUPS)}'}, status=400)
+    
+    start_date, end_date = CalendarFeedService.parse_window(
+        request.GET.get('start'), request.GET.get('end')
+    )
+    # parse_window's end is exclusive, daily_headcount's is inclusive
+    heatmap = LeaveIntervalService.daily_headcount(
+        scope.employees().filter(status='active'),
+        start_date,
+        end_date - timedelta(days=1),
+        group_by
+    )
+    
+    return JsonResponse({
+        'start': start_date.isoformat(),
+        'end': (end_date - timedelta(days=1)).isoformat(),
+        'group_by': group_by,
+        'days': [day.isoformat() for day in heatmap['days']],
+        'groups': heatmap['groups'],
+    })
 
-    return JsonResponse(events, safe=False)
 def get_region_holidays_api(request, region_id):
     """API to fetch holidays for a specific region"""
     holidays = Holiday.objects.filter(
@@ -2231,7 +1919,7 @@ def employee_leave_details(request):
         return redirect('login')
 
     try:
-        employee = Employee.objects.get(email=user_email)
+        employee = get_current_employee(request)
         current_employee_id = employee.id
     except Employee.DoesNotExist:
         messages.error(request, 'Employee profile not found.')
@@ -2263,8 +1951,7 @@ def employee_leave_details(request):
     
     for balance in leave_balances:
         # Check if this is comp off
-        is_comp_off = any(keyword in balance.leave_type.name.lower() 
-                         for keyword in ['comp off', 'compensatory', 'compoff', 'comp-off'])
+        is_comp_off = balance.is_comp_off
         
         if is_comp_off:
             # Get expiration info from the balance itself
@@ -2396,135 +2083,102 @@ def edit_leave_details(request, leave_id):
 def leave_balance_summary(request):
     user_role = request.session.get('user_role')          
     user_department = request.session.get('user_department')
-    user_email = request.session.get('user_email')
-    
-    # Get base queryset
-    leave_balances = LeaveBalance.objects.select_related('employee', 'leave_type')
+    current_year = date.today().year
+    search_query = request.GET.get('search', '').strip()
     
-    # ✅ Role-based filtering for leave balances
+    # ✅ Role-based employee filtering
+    employees = Employee.objects.filter(status='active')
     if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
-        leave_balances = leave_balances  # No additional filter for admin
+        pass  # No additional filter for admin
     elif user_role == 'BRANCH MANAGER':
         try:
-            current_branch_manager = Employee.objects.get(email=user_email)
+            current_branch_manager = get_current_employee(request)
             if current_branch_manager.location:
-                leave_balances = leave_balances.filter(
-                    employee__location__iexact=current_branch_manager.location
-                )
+                employees = employees.filter(current_branch_manager.branch_lookup())
             else:
-                leave_balances = leave_balances.none()
+                employees = employees.none()
         except Employee.DoesNotExist:
-            leave_balances = leave_balances.none()
+            employees = employees.none()
     elif user_role == 'MANAGER' and user_department:
-        leave_balances = leave_balances.filter(employee__department=user_department)
+        employees = employees.filter(department=user_department)
     else:
-        leave_balances = leave_balances.none()
+        employees = employees.none()
     
-    # Get all balances at once
-    all_balances = list(leave_balances)
+    if search_query:
+        employees = employees.filter(
+            Q(first_name__icontains=search_query) |
+            Q(last_name__icontains=search_query) |
+            Q(employee_id__icontains=search_query)
+        )
     
-    # ✅ Role-based employee filtering
-    if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
-        employees = Employee.objects.filter(status='active').order_by('first_name')
-    elif user_role == 'BRANCH MANAGER':
-        try:
-            current_branch_manager = Employee.objects.get(email=user_email)
-            if current_branch_manager.location:
-                employees = Employee.objects.filter(
-                    status='active',
-                    location__iexact=current_branch_manager.location
-                ).order_by('first_name')
-            else:
-                employees = Employee.objects.none()
-        except Employee.DoesNotExist:
-            employees = Employee.objects.none()
-    elif user_role == 'MANAGER' and user_department:
-        employees = Employee.objects.filter(department=user_department, status='active').order_by('first_name')
-    else:
-        employees = Employee.objects.none()
-        
-    # NEW: Get unpaid leave counts from Leave model
-    unpaid_counts = {}
-    for employee in employees:
-        # Count unpaid leaves for this employee in current year
-        unpaid_count = Leave.objects.filter(
-            employee=employee,
-            is_unpaid=True,
-            status='approved',
-            start_date__year=date.today().year
-        ).aggregate(total_unpaid=Sum('days_requested'))['total_unpaid'] or Decimal('0.00')
-        
-        unpaid_counts[employee.id] = unpaid_count
-    # NEW: Get paid leave counts (exclude unpaid leaves from taken count)
-    paid_leave_counts = {}
-    for employee in employees:
-        # Count only paid leaves (non-unpaid) for this employee in current year
-        paid_count = Leave.objects.filter(
-            employee=employee,
-            is_unpaid=False,  # Only paid leaves
-            status='approved',
-            start_date__year=date.today().year
-        ).aggregate(total_paid=Sum('days_requested'))['total_paid'] or Decimal('0.00')
-        
-        paid_leave_counts[employee.id] = paid_count
+    # Paid and unpaid (LOP) days approved this year, summed per employee in the same query
+    approved_this_year = Q(leave__status='approved', leave__start_date__year=current_year)
+    employees = employees.annotate(
+        paid_taken=Coalesce(
+            Sum('leave__days_requested', filter=approved_this_year & Q(leave__is_unpaid=False)),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=7, decimal_places=2)
+        ),
+        unpaid_taken=Coalesce(
+            Sum('leave__days_requested', filter=approved_this_year & Q(leave__is_unpaid=True)),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=7, decimal_places=2)
+        ),
+    ).order_by('first_name', 'id').values(
+        'id', 'employee_id', 'first_name', 'last_name', 'paid_taken', 'unpaid_taken'
+    )
+    
+    page_size = request.GET.get('page_size', '25')
+    page_size = min(int(page_size), 100) if page_size.isdigit() and int(page_size) > 0 else 25
+    employees_page = Paginator(employees, page_size).get_page(request.GET.get('page'))
+    
+    # One grouped query for the balances of the employees on this page
+    is_optional = Q(leave_type__name__icontains='optional')
+    totals = {
+        row['employee_id']: row
+        for row in LeaveBalance.objects.filter(
+            employee_id__in=[employee['id'] for employee in employees_page]
+        ).values('employee_id').annotate(
+            regular_total=Sum('total_leaves', filter=~is_optional),
+            regular_carry_forward=Sum('carry_forward', filter=~is_optional),
+            optional_total=Sum('total_leaves', filter=is_optional),
+            optional_taken=Sum('leaves_taken', filter=is_optional),
+        ).order_by()
+    }
     
     # Prepare balances list
     balances = []
-    
-    for employee in employees:
-        # Initialize counters
-        total_leaves = 0
-        leaves_taken = 0
-        carry_forward = 0
-        optional_total = 0
-        optional_taken = 0
-        
-        # Find balances for this employee
-        for balance in all_balances:
-            if balance.employee.id == employee.id:
-                if 'optional' in balance.leave_type.name.lower():
-                    # Optional leave
-                    optional_total += balance.total_leaves or 0
-                    optional_taken += balance.leaves_taken or 0
-                else:
-                    # Regular leave
-                    total_leaves += balance.total_leaves or 0
-                    leaves_taken += balance.leaves_taken or 0
-                    carry_forward += balance.carry_forward or 0
+    for employee in employees_page:
+        row = totals.get(employee['id'], {})
+        total_leaves = row.get('regular_total') or 0
+        optional_total = row.get('optional_total') or 0
+        optional_taken = row.get('optional_taken') or 0
         
         #This ensures we're only counting paid leaves in the "taken" column
-        actual_paid_taken = paid_leave_counts.get(employee.id, Decimal('0.00'))
-        
-        # Calculate remaining leaves
-        leaves_remaining = total_leaves - actual_paid_taken
-        optional_remaining = optional_total - optional_taken
-        
-        # Get unpaid count for this employee
-        unpaid_taken = unpaid_counts.get(employee.id, Decimal('0.00'))
-        
-        # Add to balances list
         balances.append({
-            'employee__id': employee.id,
-            'employee__first_name': employee.first_name,
-            'employee__last_name': employee.last_name,
+            'employee__id': employee['id'],
+            'employee__employee_id': employee['employee_id'],
+            'employee__first_name': employee['first_name'],
+            'employee__last_name': employee['last_name'],
             'total_leaves': total_leaves,
-            'leaves_taken': actual_paid_taken,
-            'leaves_remaining': leaves_remaining,
-            'carry_forward': carry_forward,
+            'leaves_taken': employee['paid_taken'],
+            'leaves_remaining': total_leaves - employee['paid_taken'],
+            'carry_forward': row.get('regular_carry_forward') or 0,
             'optional_total': optional_total,
             'optional_taken': optional_taken,
-            'optional_remaining': optional_remaining,
-            'unpaid_taken': unpaid_taken
+            'optional_remaining': optional_total - optional_taken,
+            'unpaid_taken': employee['unpaid_taken']
         })
     
     # Get data for modal dropdowns
     leave_types = LeaveType.objects.filter(is_active=True)
-    current_year = date.today().year
     years = range(current_year - 2, current_year + 3)
 
     context = {
         'balances': balances,
-        'employees': employees,
+        'page_obj': employees_page,
+        'page_size': page_size,
+        'search_query': search_query,
         'leave_types': leave_types,
         'years': years,
         'current_year': current_year,
@@ -2578,9 +2232,7 @@ def add_leave_balance(request):
             print(f"DEBUG: Processing leave type: '{leave_type.name}' (ID: {leave_type.id})")
             
             # Check if this is Comp Off leave
-            comp_off_keywords = ['comp off', 'compensatory', 'compoff', 'comp-off']
-            leave_type_lower = leave_type.name.lower()
-            is_comp_off = any(keyword in leave_type_lower for keyword in comp_off_keywords)
+            is_comp_off = LeaveTypeRegistry.is_kind(leave_type, 'comp_off')
             
             print(f"DEBUG: Is Comp Off: {is_comp_off}")
             
@@ -2597,17 +2249,20 @@ def add_leave_balance(request):
                 
                 if existing_balance:
                     # Update existing Comp Off balance
-                    existing_balance.total_leaves += total_leaves
-                    existing_balance.leaves_remaining += total_leaves + carry_forward
-                    existing_balance.carry_forward += carry_forward
+                    LeaveLedgerService.apply(
+                        existing_balance, 'accrual',
+                        total=total_leaves,
+                        remaining=total_leaves + carry_forward,
+                        carry_forward=carry_forward,
+                        note='Comp off added by HR'
+                    )
                     
                     # Update expiration date (extend if not expired)
                     if not existing_balance.is_expired:
                         existing_balance.valid_until = valid_until
                         if not existing_balance.earned_date:
                             existing_balance.earned_date = today
-                            
-                    existing_balance.save()
+                        existing_balance.save(update_fields=['valid_until', 'earned_date'])
                     
                     messages.success(
                         request, 
@@ -2617,17 +2272,20 @@ def add_leave_balance(request):
                 else:
                     # Create new Comp Off balance
                     leaves_remaining = total_leaves + carry_forward
-                    LeaveBalance.objects.create(
-                        employee=employee,
-                        leave_type=leave_type,
-                        total_leaves=total_leaves,
-                        leaves_taken=0,
-                        leaves_remaining=leaves_remaining,
-                        carry_forward=carry_forward,
-                        year=year,
-                        earned_date=today,
-                        valid_until=valid_until,
-                        is_expired=False
+                    LeaveLedgerService.get_or_create(
+                        employee,
+                        leave_type,
+                        year,
+                        defaults={
+                            'total_leaves': total_leaves,
+                            'leaves_taken': 0,
+                            'leaves_remaining': leaves_remaining,
+                            'carry_forward': carry_forward,
+                            'earned_date': today,
+                            'valid_until': valid_until,
+                            'is_expired': False
+                        },
+                        note='Comp off added by HR'
                     )
                     
                     messages.success(
@@ -2657,14 +2315,17 @@ def add_leave_balance(request):
                 leaves_remaining = total_leaves + carry_forward
                 
                 # Create new leave balance
-                LeaveBalance.objects.create(
-                    employee=employee,
-                    leave_type=leave_type,
-                    total_leaves=total_leaves,
-                    leaves_taken=0,
-                    leaves_remaining=leaves_remaining,
-                    carry_forward=carry_forward,
-                    year=year
+                LeaveLedgerService.get_or_create(
+                    employee,
+                    leave_type,
+                    year,
+                    defaults={
+                        'total_leaves': total_leaves,
+                        'leaves_taken': 0,
+                        'leaves_remaining': leaves_remaining,
+                        'carry_forward': carry_forward
+                    },
+                    note='Balance added by HR'
                 )
                 
                 messages.success(
@@ -2715,19 +2376,17 @@ def edit_leave_balance(request):
             if primary_leave_balance:
                 # ADD to total_leaves instead of carry_forward field
                 # Convert 1.5 to Decimal before adding
-                primary_leave_balance.total_leaves = carry_forward_decimal + Decimal('1.5')
-               
+                new_total = carry_forward_decimal + Decimal('1.5')
                 
                 # Recalculate remaining leaves based on new total
-                primary_leave_balance.leaves_remaining = (
-                    primary_leave_balance.total_leaves - 
-                    primary_leave_balance.leaves_taken
+                LeaveLedgerService.adjust_to(
+                    primary_leave_balance,
+                    note='Carry forward edited by HR',
+                    total_leaves=new_total,
+                    leaves_remaining=new_total - primary_leave_balance.leaves_taken,
+                    carry_forward=carry_forward_decimal
                 )
                 
-                primary_leave_balance.carry_forward = carry_forward_decimal
-                
-                primary_leave_balance.save()
-                
                 # For other leave types, just reset their carry_forward to 0
                 other_balances = LeaveBalance.objects.filter(
                     employee=employee,
@@ -2735,10 +2394,13 @@ def edit_leave_balance(request):
                 ).exclude(id=primary_leave_balance.id)
                 
                 for balance in other_balances:
-                    balance.carry_forward = Decimal('0.00')
                     # Recalculate remaining for other leave types
-                    balance.leaves_remaining = balance.total_leaves - balance.leaves_taken
-                    balance.save()
+                    LeaveLedgerService.adjust_to(
+                        balance,
+                        note='Carry forward edited by HR',
+                        carry_forward=Decimal('0.00'),
+                        leaves_remaining=balance.total_leaves - balance.leaves_taken
+                    )
                 
                 messages.success(
                     request, 
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0002_payslip_run_employee_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payslip',
+            name='paid_days',
+            field=models.DecimalField(decimal_places=1, max_digits=4),
+        ),
+        migrations.AlterField(
+            model_name='payslip',
+            name='leave_days',
+            field=models.DecimalField(decimal_places=1, default=0, max_digits=4),
+        ),
+    ]
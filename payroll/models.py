@@ -116,8 +116,9 @@ class Payslip(models.Model):
     total_deductions = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     net_salary = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     working_days = models.IntegerField()
-    paid_days = models.IntegerField()
-    leave_days = models.IntegerField(default=0)
+    # Half days (half-day attendance, half-day leave) make these fractional
+    paid_days = models.DecimalField(max_digits=4, decimal_places=1)
+    leave_days = models.DecimalField(max_digits=4, decimal_places=1, default=0)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='generated')
     generated_at = models.DateTimeField(auto_now_add=True)
     approved_at = models.DateTimeField(null=True, blank=True)
@@ -125,6 +126,9 @@ class Payslip(models.Model):
     
     class Meta:
         db_table = 'payroll_payslip'
+        indexes = [
+            models.Index(fields=['payroll_run', 'employee'], name='payslip_run_employee_idx'),
+        ]
 
 class PayslipComponent(models.Model):
     COMPONENT_TYPES = [
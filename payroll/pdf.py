@@ -0,0 +1,280 @@
+# payroll/pdf.py
+# Payslip PDF rendering. Deliberately free of Django model imports so that
+# process pool workers can render payslips from plain dicts.
+import copy
+import io
+import os
+from datetime import datetime
+
+from fontTools import ttLib
+from fpdf import FPDF
+
+from hrms import settings
+
+FONT_PATH = os.path.join(settings.BASE_DIR, "static", "fonts", "DejaVuSans.ttf")
+LOGO_PATH = os.path.join(settings.BASE_DIR, "static", "img", "ikontellogot.png")
+
+# Part of every stored PDF's content address; bump it whenever the rendered
+# layout changes so previously stored payslips are rendered again
+LAYOUT_VERSION = 1
+
+# Loaded once per process by load_assets()
+_fonts = None
+_font_data = None
+_logo = None
+
+
+def load_assets():
+    """Parse the DejaVu font and read the logo once per process (pool initializer)"""
+    global _fonts, _font_data, _logo
+    if _fonts is None:
+        with open(FONT_PATH, "rb") as f:
+            _font_data = f.read()
+        template = FPDF()
+        for style in ("", "B", "I"):
+            template.add_font("DejaVu", style, FONT_PATH)
+        _fonts = template.fonts
+    if _logo is None:
+        try:
+            with open(LOGO_PATH, "rb") as f:
+                _logo = f.read()
+        except OSError:
+            _logo = b""
+
+
+def number_to_words(number):
+    """Convert number to words (basic implementation)"""
+    try:
+        num = float(number)
+        if num == 0:
+            return "Zero rupees only"
+
+        # Basic implementation - you can enhance this
+        units = ["", "One", "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine"]
+        teens = ["Ten", "Eleven", "Twelve", "Thirteen", "Fourteen", "Fifteen", "Sixteen", "Seventeen", "Eighteen", "Nineteen"]
+        tens = ["", "", "Twenty", "Thirty", "Forty", "Fifty", "Sixty", "Seventy", "Eighty", "Ninety"]
+
+        def convert_below_100(n):
+            if n < 10:
+                return units[n]
+            elif n < 20:
+                return teens[n-10]
+            else:
+                return tens[n//10] + (" " + units[n%10] if n%10 != 0 else "")
+
+        def convert_below_1000(n):
+            if n < 100:
+                return convert_below_100(n)
+            else:
+                return units[n//100] + " Hundred" + (" " + convert_below_100(n%100) if n%100 != 0 else "")
+
+        # For simplicity, handling up to 99,999
+        if num <= 99999:
+            if num < 1000:
+                words = convert_below_1000(int(num))
+            else:
+                words = convert_below_1000(int(num)//1000) + " Thousand"
+                if num % 1000 != 0:
+                    words += " " + convert_below_1000(int(num)%1000)
+
+            return words + " rupees only"
+        else:
+            return f"{num:,.2f} rupees only"
+
+    except:
+        return f"{number} rupees only"
+
+
+def month_name(month):
+    return datetime(1900, int(month), 1).strftime("%B") if month else "Month"
+
+
+def payslip_filename(data):
+    employee_name = f"{data['first_name']}_{data['last_name']}".replace(" ", "_")
+    return f"Payslip_{employee_name}_{month_name(data['month'])}_{data['year'] or 'Year'}.pdf"
+
+
+class PayslipPDF(FPDF):
+    def __init__(self, month_name="", year=""):
+        super().__init__()
+        self.month_name = month_name
+        self.year = year
+        # ✅ Use Unicode-supported DejaVuSans font. The metrics parsed by
+        # load_assets() are copied; fpdf subsets the fontTools font in place
+        # on output, so each document opens its own from the cached bytes.
+        load_assets()
+        fonts = copy.deepcopy(_fonts)
+        for font in fonts.values():
+            font.ttfont = ttLib.TTFont(io.BytesIO(_font_data), recalcTimestamp=False, lazy=True)
+        self.fonts.update(fonts)
+        self.set_auto_page_break(auto=True, margin=15)
+
+    def header(self):
+        # ✅ Company Logo + Header
+        if _logo:
+            try:
+                self.image(io.BytesIO(_logo), 155, 12, 45)
+            except:
+                pass
+
+        self.set_font("DejaVu", "B", 16)
+        self.cell(
+            0,
+            10,
+            f"PAYSLIP - {self.month_name.upper()} {self.year}",
+            ln=True,
+            align="L",
+        )
+
+        self.set_font("DejaVu", "", 9)
+        self.multi_cell(
+            0,
+            5,
+            "\nIKONTEL SOLUTIONS PVT LTD\n\n"
+            "NO.72, 73 & 74, 1ST FLOOR AMRBP BUILDING, MARGOSA ROAD, 17TH CROSS RD,"
+            "\nMALLESWARAM"
+            "\nBENGALURU, KARNATAKA | IKONTEL SOLUTIONS PVT LTD",
+            align="L",
+        )
+        self.ln(5)
+
+    def section_box(self, title):
+        self.set_font("DejaVu", "B", 11)
+        self.set_fill_color(240, 240, 240)
+        self.cell(0, 8, f" {title}", ln=True, fill=True)
+        self.ln(2)
+
+    def cell_pair(self, label, value, w=45):
+        """Label-value pair (no borders)"""
+        self.set_font("DejaVu", "", 9)
+        self.cell(w, 7, f"{label}:", align="L")
+        self.cell(w + 25, 7, f"{value}", align="L")
+
+    def salary_table(self, title, rows, total_label, basic_salary=None):
+        """
+        Salary components (no borders)
+        - rows are (component name, amount) pairs
+        - basic_salary, when given, is listed first (EARNINGS only)
+        """
+        self.section_box(title)
+        self.set_font("DejaVu", "B", 9)
+        self.cell(100, 8, "Component", align="L")
+        self.cell(50, 8, "Amount (₹)", align="R", ln=True)
+
+        self.set_font("DejaVu", "", 9)
+
+        total = 0.0
+
+        if basic_salary is not None:
+            basic_salary = float(basic_salary or 0)
+            self.cell(100, 7, "Basic Salary", align="L")
+            self.cell(50, 7, f"{basic_salary:,.2f}", align="R", ln=True)
+            total += basic_salary
+
+        for comp_name, comp_amount in rows:
+            comp_amount = float(comp_amount or 0)
+            self.cell(100, 7, comp_name, align="L")
+            self.cell(50, 7, f"{comp_amount:,.2f}", align="R", ln=True)
+            total += comp_amount
+
+        # Total row
+        self.set_font("DejaVu", "B", 9)
+        self.cell(100, 8, total_label, align="L")
+        self.cell(50, 8, f"{total:,.2f}", align="R", ln=True)
+        self.ln(4)
+
+
+def render_payslip(data):
+    """Render one payslip (a dict from PayslipExportService.payslip_data) to PDF bytes"""
+    pdf = PayslipPDF(month_name=month_name(data["month"]), year=data["year"] or "Year")
+    pdf.add_page()
+
+    # Employee Info
+    pdf.set_font("DejaVu", "B", 10)
+    pdf.cell(0, 7, f"{data['first_name']} {data['last_name']}", ln=True)
+
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_line_width(0.4)
+    pdf.line(10, pdf.get_y() + 2, 200, pdf.get_y() + 2)
+    pdf.ln(5)
+
+    def add_row(labels_values):
+        col_width = 47
+        for label, value in labels_values:
+            pdf.set_font("DejaVu", "B", 9)
+            pdf.cell(col_width, 6, label, border=0)
+        pdf.ln(5)
+        for label, value in labels_values:
+            pdf.set_font("DejaVu", "", 9)
+            pdf.cell(col_width, 6, str(value), border=0)
+        pdf.ln(8)
+
+    date_joined = data["date_of_joining"]
+    add_row(
+        [
+            ("Employee Code", data["employee_code"]),
+            ("Date Joined", date_joined.strftime("%d %b %Y") if date_joined else "N/A"),
+            ("Department", data["department"] or "N/A"),
+            ("Designation", data["designation"] or "N/A"),
+        ]
+    )
+    add_row(
+        [
+            ("Bank", data["bank_name"] or "N/A"),
+            ("Bank Account", data["account_number"] or "N/A"),
+            ("Bank IFSC", data["ifsc_code"] or "N/A"),
+            ("Payment Mode", "Bank Transfer"),
+        ]
+    )
+    add_row(
+        [
+            ("UAN", data["uan"] or "N/A"),
+            ("PF Number", data["pf_number"] or "N/A"),
+            ("ESI Number", data["esi_number"] or "N/A"),
+            ("", ""),
+        ]
+    )
+
+    pdf.ln(3)
+
+    # Salary Details
+    pdf.cell(0, 7, "Salary Details", ln=True)
+
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_line_width(0.4)
+    pdf.line(10, pdf.get_y() + 2, 200, pdf.get_y() + 2)
+    pdf.ln(5)
+
+    pdf.set_font("DejaVu", "B", 9)
+    pdf.cell(47.5, 6, "Total Working Days", border=0)
+    pdf.cell(47.5, 6, "Paid Days", border=0)
+    pdf.cell(47.5, 6, "Loss of Pay", border=0)
+    pdf.cell(47.5, 6, "Total Payable Days", border=0)
+    pdf.ln(6)
+
+    # paid_days already excludes unpaid leave and LOP, so whatever is left of
+    # the working days is loss of pay
+    working_days = data["working_days"] or 0
+    paid_days = data["paid_days"] or 0
+    pdf.set_font("DejaVu", "", 9)
+    pdf.cell(47.5, 6, str(working_days), border=0)
+    pdf.cell(47.5, 6, str(paid_days), border=0)
+    pdf.cell(47.5, 6, str(max(working_days - paid_days, 0)), border=0)
+    pdf.cell(47.5, 6, str(paid_days), border=0)
+    pdf.ln(10)
+
+    pdf.salary_table("EARNINGS", data["earnings"], "Total Earnings (A)", basic_salary=data["basic_salary"])
+    pdf.salary_table("DEDUCTIONS", data["deductions"], "Total Deductions (B)")
+
+    # Summary
+    net_salary = data["net_salary"]
+    pdf.section_box("SUMMARY")
+    pdf.cell(100, 8, "Net Salary Payable (A - B)", align="L")
+    pdf.cell(50, 8, f"₹{net_salary:.2f}", align="R", ln=True)
+    pdf.ln(4)
+    pdf.multi_cell(0, 7, f"Net Salary (in words): {number_to_words(net_salary)}", align="L")
+    pdf.ln(5)
+    pdf.set_font("DejaVu", "I", 8)
+    pdf.multi_cell(0, 6, "*Note: All amounts displayed in this payslip are in INR.")
+
+    return bytes(pdf.output())
@@ -0,0 +1,959 @@
+# payroll/services.py
+import ast
+import calendar
+import hashlib
+import json
+import logging
+import multiprocessing
+import operator
+import os
+import re
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, DurationField, ExpressionWrapper, F, Q, Value, When
+
+from attendance.models import Attendance
+from attendance.services import HALF_DAY_HOURS, LOP_HOURS
+from hr.models import Employee, Location
+from hr.services import CacheVersion
+from leave.models import Leave, LeaveBalance
+from leave.services import LeaveTypeRegistry, WorkingDayCalendar
+from .models import EmployeeSalary, EmployeeSalaryComponent, Payslip, PayslipComponent, SalaryComponent
+from .pdf import LAYOUT_VERSION, load_assets, payslip_filename, render_payslip
+
+logger = logging.getLogger(__name__)
+
+
+class FormulaError(ValueError):
+    """A salary component formula that cannot be compiled"""
+
+
+class SalaryPlan:
+    """
+    Compiled evaluation plan for the active salary components.
+
+    steps is a list of (component, name, evaluate) in dependency order;
+    evaluate(columns, size) returns the component's amount for every
+    employee of the batch. A None amount means the formula could not be
+    evaluated for that employee (e.g. a division by zero).
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def evaluate(self, rows):
+        """
+        Evaluate every component for a batch of employees in one pass.
+
+        rows is a list of dicts holding the base variables (basic_salary,
+        unpaid_balance, ...), 'fixed' (component pk -> stored amount of the
+        employee's fixed components) and optionally 'proration' (the share
+        of the month that is paid). Prorating scales basic_salary and the
+        fixed earnings; formula and percentage components follow from them.
+        Returns one dict per row: basic_salary (as earned), amounts
+        (component pk -> Decimal or None), gross_earnings,
+        total_deductions, net_salary and errors (component names that
+        could not be evaluated).
+        """
+        size = len(rows)
+        columns = {
+            name: [SalaryFormulaEngine.to_decimal(row.get(name)) for row in rows]
+            for name in SalaryFormulaEngine.BASE_VARIABLES
+        }
+        proration = [SalaryFormulaEngine.to_decimal(row.get('proration', 1)) for row in rows]
+        # The daily rate is always that of the full monthly salary
+        columns['per_day_salary'] = [
+            SalaryFormulaEngine.money(basic / SalaryFormulaEngine.PER_DAY_DIVISOR)
+            for basic in columns['basic_salary']
+        ]
+        columns['basic_salary'] = [
+            SalaryFormulaEngine.money(basic * ratio) for basic, ratio in zip(columns['basic_salary'], proration)
+        ]
+        earnings = [Decimal('0.00')] * size
+        deductions = [Decimal('0.00')] * size
+
+        for component, name, evaluate in self.steps:
+            if component is None:
+                # gross_salary: every earning is already in
+                columns[name] = [basic + earned for basic, earned in zip(columns['basic_salary'], earnings)]
+                continue
+            if component.calculation_type in ('formula', 'percentage'):
+                amounts = [
+                    None if amount is None else SalaryFormulaEngine.money(amount)
+                    for amount in evaluate(columns, size)
+                ]
+            else:
+                amounts = [
+                    SalaryFormulaEngine.to_decimal(row.get('fixed', {}).get(component.pk))
+                    for row in rows
+                ]
+                if component.component_type == 'earning':
+                    amounts = [SalaryFormulaEngine.money(amount * ratio) for amount, ratio in zip(amounts, proration)]
+            columns[name] = amounts
+            totals = earnings if component.component_type == 'earning' else deductions
+            for i, amount in enumerate(amounts):
+                if amount is not None:
+                    totals[i] += amount
+
+        results = []
+        for i in range(size):
+            amounts = {}
+            errors = []
+            for component, name, _ in self.steps:
+                if component is None:
+                    continue
+                amounts[component.pk] = columns[name][i]
+                if columns[name][i] is None:
+                    errors.append(component.name)
+            gross = columns['basic_salary'][i] + earnings[i]
+            results.append({
+                'basic_salary': columns['basic_salary'][i],
+                'amounts': amounts,
+                'gross_earnings': gross,
+                'total_deductions': deductions[i],
+                'net_salary': gross - deductions[i],
+                'errors': errors,
+            })
+        return results
+
+
+class SalaryFormulaEngine:
+    """
+    Safe evaluator for 'formula' and 'percentage' salary components.
+
+    Each formula is parsed once into a restricted AST (numbers, variables,
+    + - * / % //, comparisons, `x if cond else y`, min/max/round/abs) and
+    compiled into a function over Decimal columns, so a whole payroll run
+    is evaluated one component at a time instead of one employee at a
+    time. Components may refer to the base variables and to each other by
+    name (lowercase, non-alphanumerics as '_', e.g. "Medical Allowance" ->
+    medical_allowance); they are evaluated in dependency order.
+    gross_salary is available once every earning is known, so only
+    deductions can use it. Comparisons and and/or evaluate to 1 or 0.
+
+    The compiled plan is kept in process and rebuilt whenever a salary
+    component changes (hr.signals bumps the shared version key).
+    """
+
+    BASE_VARIABLES = (
+        'basic_salary', 'unpaid_balance', 'working_days', 'paid_days',
+        'days_present', 'leave_days', 'unpaid_leave_days', 'lop_days', 'absent_days',
+    )
+    DERIVED_VARIABLES = ('per_day_salary', 'gross_salary')
+    ALIASES = {'basic': 'basic_salary', 'gross': 'gross_salary'}
+    PER_DAY_DIVISOR = 26
+
+    BINARY_OPS = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.FloorDiv: operator.floordiv,
+        ast.Mod: operator.mod,
+    }
+    UNARY_OPS = {
+        ast.USub: operator.neg,
+        ast.UAdd: operator.pos,
+    }
+    COMPARE_OPS = {
+        ast.Lt: operator.lt,
+        ast.LtE: operator.le,
+        ast.Gt: operator.gt,
+        ast.GtE: operator.ge,
+        ast.Eq: operator.eq,
+        ast.NotEq: operator.ne,
+    }
+    FUNCTIONS = {
+        'min': min,
+        'max': max,
+        'abs': abs,
+        'round': lambda value, places=0: value.quantize(Decimal(1).scaleb(-int(places)), rounding=ROUND_HALF_UP),
+    }
+    # (min args, max args or None)
+    FUNCTION_ARITY = {
+        'min': (2, None),
+        'max': (2, None),
+        'abs': (1, 1),
+        'round': (1, 2),
+    }
+    # Stand-in employee used to trial-run the plan when a component is saved
+    SAMPLE_ROW = {
+        'basic_salary': Decimal('30000.00'),
+        'working_days': Decimal('22'),
+        'paid_days': Decimal('22'),
+        'days_present': Decimal('22'),
+    }
+
+    VERSION_KEY = 'salary_plan:version'
+
+    _plan = None
+    _version = None
+
+    @staticmethod
+    def to_decimal(value):
+        if value is None or value == '':
+            return Decimal('0.00')
+        return value if isinstance(value, Decimal) else Decimal(str(value))
+
+    @staticmethod
+    def money(value):
+        return value.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    @staticmethod
+    def variable_name(name):
+        """The name a component (or percentage_of value) is referred to by in formulas"""
+        name = re.sub(r'[^0-9a-z]+', '_', (name or '').strip().lower()).strip('_')
+        return SalaryFormulaEngine.ALIASES.get(name, name)
+
+    @staticmethod
+    def _map(function, *columns):
+        """Apply function element-wise; a None input or an evaluation error gives None"""
+        results = []
+        for values in zip(*columns):
+            if any(value is None for value in values):
+                results.append(None)
+                continue
+            try:
+                results.append(function(*values))
+            except (ArithmeticError, TypeError, ValueError):
+                results.append(None)
+        return results
+
+    @staticmethod
+    def _flag(value):
+        """Comparison results are 1/0 so they can be used in arithmetic, e.g. (basic > 1000) * 500"""
+        return Decimal(1) if value else Decimal(0)
+
+    @staticmethod
+    def _compile(node, names):
+        """Compile an AST node into evaluate(columns, size); variables used are added to names"""
+        _map = SalaryFormulaEngine._map
+
+        def compile_node(child):
+            return SalaryFormulaEngine._compile(child, names)
+
+        if isinstance(node, ast.Expression):
+            return compile_node(node.body)
+
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            value = Decimal(str(node.value))
+            return lambda columns, size: [value] * size
+
+        if isinstance(node, ast.Name):
+            name = SalaryFormulaEngine.ALIASES.get(node.id.lower(), node.id.lower())
+            names.add(name)
+            return lambda columns, size: columns[name]
+
+        if isinstance(node, ast.BinOp) and type(node.op) in SalaryFormulaEngine.BINARY_OPS:
+            op = SalaryFormulaEngine.BINARY_OPS[type(node.op)]
+            left, right = compile_node(node.left), compile_node(node.right)
+            return lambda columns, size: _map(op, left(columns, size), right(columns, size))
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in SalaryFormulaEngine.UNARY_OPS:
+            op = SalaryFormulaEngine.UNARY_OPS[type(node.op)]
+            operand = compile_node(node.operand)
+            return lambda columns, size: _map(op, operand(columns, size))
+
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in SalaryFormulaEngine.COMPARE_OPS:
+            op = SalaryFormulaEngine.COMPARE_OPS[type(node.ops[0])]
+            flag = SalaryFormulaEngine._flag
+            left, right = compile_node(node.left), compile_node(node.comparators[0])
+            return lambda columns, size: _map(lambda a, b: flag(op(a, b)), left(columns, size), right(columns, size))
+
+        if isinstance(node, ast.BoolOp):
+            combine = all if isinstance(node.op, ast.And) else any
+            flag = SalaryFormulaEngine._flag
+            values = [compile_node(value) for value in node.values]
+            return lambda columns, size: _map(
+                lambda *flags: flag(combine(flags)), *(value(columns, size) for value in values)
+            )
+
+        if isinstance(node, ast.IfExp):
+            test, body, orelse = compile_node(node.test), compile_node(node.body), compile_node(node.orelse)
+            # Each element takes the arm its test picks, so an error in the other
+            # arm (e.g. the division a guard protects) does not make it None
+            return lambda columns, size: [
+                None if flag is None else (yes if flag else no)
+                for flag, yes, no in zip(test(columns, size), body(columns, size), orelse(columns, size))
+            ]
+
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id in SalaryFormulaEngine.FUNCTIONS and not node.keywords):
+            fewest, most = SalaryFormulaEngine.FUNCTION_ARITY[node.func.id]
+            if len(node.args) < fewest or (most is not None and len(node.args) > most):
+                expected = f"{fewest}" if fewest == most else (
+                    f"{fewest} or more" if most is None else f"{fewest} to {most}"
+                )
+                plural = '' if expected == '1' else 's'
+                raise FormulaError(f'"{ast.unparse(node)}": {node.func.id}() takes {expected} argument{plural}')
+            if any(isinstance(arg, ast.Starred) for arg in node.args):
+                raise FormulaError(f'"{ast.unparse(node)}" is not allowed in a salary formula')
+            function = SalaryFormulaEngine.FUNCTIONS[node.func.id]
+            args = [compile_node(arg) for arg in node.args]
+            return lambda columns, size: _map(function, *(arg(columns, size) for arg in args))
+
+        raise FormulaError(f'"{ast.unparse(node)}" is not allowed in a salary formula')
+
+    @staticmethod
+    def compile_expression(expression):
+        """(evaluate, variable names used) for a formula string"""
+        try:
+            tree = ast.parse((expression or '').strip(), mode='eval')
+        except SyntaxError:
+            raise FormulaError(f"Invalid formula '{expression}'")
+        names = set()
+        return SalaryFormulaEngine._compile(tree, names), names
+
+    @staticmethod
+    def compile_component(component):
+        """(evaluate, dependencies) for one component; fixed components have no dependencies"""
+        if component.calculation_type == 'formula':
+            if not (component.formula or '').strip():
+                raise FormulaError(f"{component.name}: formula is empty")
+            try:
+                return SalaryFormulaEngine.compile_expression(component.formula)
+            except FormulaError as e:
+                raise FormulaError(f"{component.name}: {e}")
+
+        if component.calculation_type == 'percentage':
+            base = SalaryFormulaEngine.variable_name(component.percentage_of) or 'basic_salary'
+            rate = SalaryFormulaEngine.to_decimal(component.value) / 100
+            return (
+                lambda columns, size: SalaryFormulaEngine._map(lambda amount: amount * rate, columns[base]),
+                {base},
+            )
+
+        return None, set()
+
+    @staticmethod
+    def compile(components):
+        """Order components by their dependencies and compile them into a SalaryPlan"""
+        nodes = {}
+        for component in components:
+            name = SalaryFormulaEngine.variable_name(component.name)
+            if not name:
+                raise FormulaError(f"'{component.name}' cannot be used as a formula variable")
+            if name in nodes or name in SalaryFormulaEngine.BASE_VARIABLES + SalaryFormulaEngine.DERIVED_VARIABLES:
+                raise FormulaError(f"More than one salary component or variable is called '{name}'")
+            evaluate, dependencies = SalaryFormulaEngine.compile_component(component)
+            nodes[name] = (component, evaluate, dependencies)
+
+        # gross_salary waits for every earning
+        nodes['gross_salary'] = (None, None, {
+            name for name, (component, _, _) in nodes.items()
+            if component is not None and component.component_type == 'earning'
+        })
+
+        known = set(nodes) | set(SalaryFormulaEngine.BASE_VARIABLES) | {'per_day_salary'}
+        for name, (component, _, dependencies) in nodes.items():
+            unknown = dependencies - known
+            if unknown:
+                raise FormulaError(f"{component.name}: unknown variable '{sorted(unknown)[0]}'")
+
+        # Kahn's algorithm, keeping the given order among independent components
+        steps = []
+        done = set(SalaryFormulaEngine.BASE_VARIABLES) | {'per_day_salary'}
+        pending = list(nodes)
+        while pending:
+            ready = [name for name in pending if nodes[name][2] <= done]
+            if not ready:
+                raise FormulaError(
+                    "Salary component formulas refer to each other in a cycle: " + ', '.join(sorted(pending))
+                )
+            for name in ready:
+                component, evaluate, _ = nodes[name]
+                steps.append((component, name, evaluate))
+                done.add(name)
+            pending = [name for name in pending if name not in done]
+        return SalaryPlan(steps)
+
+    @staticmethod
+    def validate(component, components=None):
+        """
+        Raise FormulaError if saving component would leave the active
+        component set uncompilable, or if the compiled plan fails on a
+        sample employee
+        """
+        if components is None:
+            components = SalaryComponent.objects.filter(is_active=True).order_by('id')
+        others = [other for other in components if other.pk != component.pk]
+        plan = SalaryFormulaEngine.compile(others + ([component] if component.is_active else []))
+        try:
+            plan.evaluate([dict(SalaryFormulaEngine.SAMPLE_ROW)])
+        except Exception as e:
+            raise FormulaError(f"{component.name}: formula fails when evaluated ({e})")
+
+    @staticmethod
+    def get_plan():
+        version = CacheVersion.get(SalaryFormulaEngine.VERSION_KEY)
+        if SalaryFormulaEngine._plan is None or version != SalaryFormulaEngine._version:
+            SalaryFormulaEngine._plan = SalaryFormulaEngine.compile(
+                list(SalaryComponent.objects.filter(is_active=True).order_by('id'))
+            )
+            SalaryFormulaEngine._version = version
+        return SalaryFormulaEngine._plan
+
+    @staticmethod
+    def invalidate():
+        """Recompile the plan in every process (called when a SalaryComponent is saved or deleted)"""
+        SalaryFormulaEngine._plan = None
+        CacheVersion.bump(SalaryFormulaEngine.VERSION_KEY)
+
+
+class PayrollAttendanceService:
+    """
+    Attendance stage of a payroll run: working, present, leave and LOP
+    days of every employee for the run month, from a few grouped queries
+    per chunk (attendance, approved leaves) plus the cached
+    WorkingDayCalendar.
+
+    - working_days: the month's working days for the employee's holiday
+      region (weekly offs and mandatory holidays are off)
+    - days before the date of joining are not paid
+    - approved unpaid leave (Leave.is_unpaid) is not paid
+    - attendance on a working day that is not covered by approved leave
+      follows the all_attendance rules: under LOP_HOURS is a full LOP day,
+      under HALF_DAY_HOURS (or a check-in without a check-out) half a day
+    - a working day up to today with neither attendance nor approved
+      leave is an unexcused absence (absent_days) and is not paid unless
+      settings.PAYROLL_DEDUCT_ABSENT_DAYS is turned off; days still to
+      come in the month are never counted as absent
+    """
+
+    @staticmethod
+    def month_range(year, month):
+        return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+    @staticmethod
+    def region_ids(employees):
+        """employee pk -> holiday region id, with at most one Location query"""
+        locations = None
+        regions = {}
+        for employee in employees:
+            if employee.location_ref_id:
+                regions[employee.pk] = employee.location_ref_id
+                continue
+            if locations is None:
+                locations = {name.strip().lower(): pk for name, pk in Location.objects.values_list('name', 'pk')}
+            regions[employee.pk] = locations.get((employee.location or '').strip().lower())
+        return regions
+
+    @staticmethod
+    def attendance_days(employee_ids, start_date, end_date):
+        """
+        (present, short_days): employee pk -> set of dates with a completed
+        day of at least HALF_DAY_HOURS, and employee pk -> {date: 'lop' or
+        'half_day'} for the shorter ones, in two queries
+        """
+        worked = ExpressionWrapper(F('check_out') - F('check_in'), output_field=DurationField())
+        completed = Q(check_in__isnull=False, check_out__isnull=False)
+        records = Attendance.objects.filter(
+            employee_id__in=employee_ids,
+            date__range=(start_date, end_date)
+        ).annotate(worked=worked)
+
+        present = defaultdict(set)
+        for employee_id, day in records.filter(
+            completed, worked__gte=timedelta(hours=HALF_DAY_HOURS)
+        ).values_list('employee_id', 'date'):
+            present[employee_id].add(day)
+
+        short_days = defaultdict(dict)
+        for employee_id, day, status in records.filter(
+            Q(check_in__isnull=False, check_out__isnull=True)
+            | Q(completed, worked__lt=timedelta(hours=HALF_DAY_HOURS))
+        ).annotate(day_status=Case(
+            When(completed & Q(worked__lt=timedelta(hours=LOP_HOURS)), then=Value('lop')),
+            default=Value('half_day'),
+        )).values_list('employee_id', 'date', 'day_status'):
+            short_days[employee_id][day] = status
+        return present, short_days
+
+    @staticmethod
+    def approved_leaves(employee_ids, start_date, end_date):
+        """employee pk -> approved leaves overlapping the range, in one query"""
+        leaves = defaultdict(list)
+        for leave in Leave.objects.filter(
+            employee_id__in=employee_ids,
+            status='approved',
+            start_date__lte=end_date,
+            end_date__gte=start_date
+        ).values('employee_id', 'start_date', 'end_date', 'is_unpaid', 'is_half_day'):
+            leaves[leave['employee_id']].append(leave)
+        return leaves
+
+    @staticmethod
+    def compute(employees, year, month):
+        """
+        employee pk -> {working_days, paid_days, days_present, leave_days,
+        unpaid_leave_days, lop_days, absent_days} for the month
+        """
+        first_day, last_day = PayrollAttendanceService.month_range(year, month)
+        employee_ids = [employee.pk for employee in employees]
+        regions = PayrollAttendanceService.region_ids(employees)
+        present, short_days = PayrollAttendanceService.attendance_days(employee_ids, first_day, last_day)
+        leaves = PayrollAttendanceService.approved_leaves(employee_ids, first_day, last_day)
+        half = Decimal('0.5')
+        deduct_absent = getattr(settings, 'PAYROLL_DEDUCT_ABSENT_DAYS', True)
+        # Days that have not happened yet cannot be absences
+        cutoff = min(last_day, date.today())
+
+        days = {}
+        for employee in employees:
+            region_id = regions[employee.pk]
+            working_days = WorkingDayCalendar.count_working_days(region_id, first_day, last_day)
+            start = max(first_day, employee.date_of_joining or first_day)
+            employed_days = WorkingDayCalendar.count_working_days(region_id, start, last_day)
+
+            leave_days = Decimal('0')
+            unpaid_leave_days = Decimal('0')
+            on_leave = set()
+            for leave in leaves[employee.pk]:
+                leave_start, leave_end = max(leave['start_date'], start), min(leave['end_date'], last_day)
+                if leave_start > leave_end:
+                    continue
+                if leave['is_half_day']:
+                    amount = half if WorkingDayCalendar.is_working_day(region_id, leave_start) else Decimal('0')
+                else:
+                    amount = Decimal(WorkingDayCalendar.count_working_days(region_id, leave_start, leave_end))
+                leave_days += amount
+                if leave['is_unpaid']:
+                    unpaid_leave_days += amount
+                on_leave.update(leave_start + timedelta(days=offset) for offset in range((leave_end - leave_start).days + 1))
+
+            lop_days = Decimal('0')
+            for day, status in short_days[employee.pk].items():
+                if day < start or day in on_leave or not WorkingDayCalendar.is_working_day(region_id, day):
+                    continue
+                lop_days += 1 if status == 'lop' else half
+
+            attended = present[employee.pk] | set(short_days[employee.pk])
+            absent_days = Decimal('0')
+            day = start
+            while day <= cutoff:
+                if day not in attended and day not in on_leave and WorkingDayCalendar.is_working_day(region_id, day):
+                    absent_days += 1
+                day += timedelta(days=1)
+
+            paid_days = Decimal(employed_days) - unpaid_leave_days - lop_days
+            if deduct_absent:
+                paid_days -= absent_days
+            days[employee.pk] = {
+                'working_days': working_days,
+                'paid_days': max(paid_days, Decimal('0')),
+                'days_present': len(present[employee.pk]),
+                'leave_days': leave_days,
+                'unpaid_leave_days': unpaid_leave_days,
+                'lop_days': lop_days,
+                'absent_days': absent_days,
+            }
+        return days
+
+
+class PayrollEngine:
+    """
+    Batched payslip generation for a payroll run.
+
+    Employees, their active salaries and salary components are loaded in a
+    fixed number of queries, paid days come from PayrollAttendanceService,
+    payslips are computed in memory (component amounts through the
+    SalaryFormulaEngine plan, one pass per chunk, earnings prorated by
+    paid days) and written with bulk_create, one transaction per chunk of
+    employees.
+    """
+
+    CHUNK_SIZE = 500
+    DEFAULT_WORKING_DAYS = 22
+
+    @staticmethod
+    def payslip_number(payroll_run, employee):
+        return f"PS{payroll_run.payroll_year}{payroll_run.payroll_month:02d}{employee.employee_id}_{payroll_run.id}"
+
+    @staticmethod
+    def unpaid_days(employee_ids, year):
+        """employee pk -> unpaid leave days taken in the year, in one query"""
+        return dict(LeaveBalance.objects.filter(
+            employee_id__in=employee_ids,
+            leave_type_id__in=LeaveTypeRegistry.ids('unpaid'),
+            year=year
+        ).values_list('employee_id', 'leaves_taken'))
+
+    @staticmethod
+    def variables(basic_salary, fixed, unpaid_balance=None, days=None):
+        """
+        The SalaryPlan.evaluate row for one employee. days is their
+        PayrollAttendanceService result; without it (salary structures)
+        the whole month of DEFAULT_WORKING_DAYS is paid.
+        """
+        if days is None:
+            days = {
+                'working_days': PayrollEngine.DEFAULT_WORKING_DAYS,
+                'paid_days': PayrollEngine.DEFAULT_WORKING_DAYS,
+            }
+        working_days = days['working_days']
+        proration = min(days['paid_days'] / working_days, Decimal('1')) if working_days else Decimal('1')
+        return dict(
+            days,
+            basic_salary=basic_salary,
+            unpaid_balance=unpaid_balance,
+            fixed=fixed,
+            proration=proration,
+        )
+
+    @staticmethod
+    def salary_variables(salary, salary_components, unpaid_balance=None, days=None):
+        return PayrollEngine.variables(
+            salary.basic_salary,
+            {salary_component.component_id: salary_component.amount for salary_component in salary_components},
+            unpaid_balance,
+            days
+        )
+
+    @staticmethod
+    def load(employee_ids):
+        """
+        (employees, salaries, components) for the given employee pks:
+        employee pk -> Employee, employee pk -> active EmployeeSalary and
+        salary pk -> [EmployeeSalaryComponent]
+        """
+        employees = Employee.objects.in_bulk(employee_ids)
+
+        salaries = {}
+        for salary in EmployeeSalary.objects.filter(
+            employee_id__in=employee_ids,
+            is_active=True
+        ).order_by('id'):
+            # The oldest active salary wins, as .first() did
+            salaries.setdefault(salary.employee_id, salary)
+
+        components = defaultdict(list)
+        for salary_component in EmployeeSalaryComponent.objects.filter(
+            employee_salary_id__in=[salary.pk for salary in salaries.values()]
+        ).order_by('id'):
+            components[salary_component.employee_salary_id].append(salary_component)
+
+        return employees, salaries, components
+
+    @staticmethod
+    def calculation_note(component):
+        if component.calculation_type == 'formula':
+            return component.formula
+        if component.calculation_type == 'percentage':
+            return f"{component.value}% of {SalaryFormulaEngine.variable_name(component.percentage_of) or 'basic_salary'}"
+        return None
+
+    @staticmethod
+    def compute(payroll_run, employee, days, plan, result):
+        """Unsaved (Payslip, [PayslipComponent]) for one employee from their paid days and SalaryPlan result"""
+        if result['errors']:
+            raise FormulaError(f"could not evaluate {', '.join(result['errors'])}")
+
+        payslip = Payslip(
+            payroll_run=payroll_run,
+            employee=employee,
+            payslip_number=PayrollEngine.payslip_number(payroll_run, employee),
+            basic_salary=result['basic_salary'],
+            gross_earnings=result['gross_earnings'],
+            total_deductions=result['total_deductions'],
+            net_salary=result['net_salary'],
+            working_days=days['working_days'],
+            paid_days=days['paid_days'],
+            leave_days=days['leave_days'],
+            status='generated'
+        )
+        payslip_components = [
+            PayslipComponent(
+                component=component,
+                component_type=component.component_type,
+                amount=result['amounts'][component.pk],
+                calculation_note=PayrollEngine.calculation_note(component)
+            )
+            for component, _, _ in plan.steps
+            if component is not None and result['amounts'][component.pk]
+        ]
+        return payslip, payslip_components
+
+    @staticmethod
+    def write_chunk(computed):
+        """
+        bulk_create the payslips and then their components in one transaction.
+        Payslip pks are read back by payslip number, since MySQL does not
+        return them from a bulk insert.
+        """
+        with transaction.atomic():
+            Payslip.objects.bulk_create([payslip for payslip, _ in computed])
+            payslip_ids = dict(Payslip.objects.filter(
+                payslip_number__in=[payslip.payslip_number for payslip, _ in computed]
+            ).values_list('payslip_number', 'id'))
+
+            payslip_components = []
+            for payslip, components in computed:
+                payslip.pk = payslip_ids[payslip.payslip_number]
+                for payslip_component in components:
+                    payslip_component.payslip_id = payslip.pk
+                    payslip_components.append(payslip_component)
+            PayslipComponent.objects.bulk_create(payslip_components, batch_size=PayrollEngine.CHUNK_SIZE)
+
+    @staticmethod
+    def run(payroll_run, employee_ids, chunk_size=None):
+        """
+        Generate payslips for employee_ids (employee pks) in payroll_run.
+
+        Returns a summary dict: created, total_amount and errors (list of
+        (employee code, reason); the submitted id stands in for employees
+        that do not exist). A chunk
+        that fails to write is rolled back and every employee in it is
+        reported; the other chunks are kept.
+        """
+        chunk_size = chunk_size or PayrollEngine.CHUNK_SIZE
+        summary = {
+            'created': 0,
+            'total_amount': Decimal('0.00'),
+            'errors': [],
+        }
+
+        pks = []
+        for employee_id in employee_ids:
+            try:
+                pks.append(int(employee_id))
+            except (TypeError, ValueError):
+                summary['errors'].append((employee_id, 'invalid employee id'))
+        pks = list(dict.fromkeys(pks))
+        plan = SalaryFormulaEngine.get_plan()
+
+        for start in range(0, len(pks), chunk_size):
+            chunk = pks[start:start + chunk_size]
+            employees, salaries, components = PayrollEngine.load(chunk)
+            unpaid_days = PayrollEngine.unpaid_days(chunk, payroll_run.payroll_year)
+
+            payable = []
+            for pk in chunk:
+                employee = employees.get(pk)
+                if employee is None:
+                    summary['errors'].append((pk, 'employee not found'))
+                    continue
+                salary = salaries.get(pk)
+                if salary is None:
+                    summary['errors'].append((employee.employee_id, 'no active salary'))
+                    continue
+                payable.append((employee, salary))
+
+            days = PayrollAttendanceService.compute(
+                [employee for employee, _ in payable], payroll_run.payroll_year, payroll_run.payroll_month
+            )
+            try:
+                results = plan.evaluate([
+                    PayrollEngine.salary_variables(salary, components[salary.pk], unpaid_days.get(employee.pk), days[employee.pk])
+                    for employee, salary in payable
+                ])
+            except Exception as e:
+                logger.exception("Salary plan failed for payroll run %s", payroll_run.id)
+                summary['errors'].extend((employee.employee_id, str(e)) for employee, _ in payable)
+                continue
+
+            computed = []
+            for (employee, salary), result in zip(payable, results):
+                try:
+                    computed.append(PayrollEngine.compute(payroll_run, employee, days[employee.pk], plan, result))
+                except Exception as e:
+                    summary['errors'].append((employee.employee_id, str(e)))
+
+            # Skip employees that already have this payslip number
+            existing = set(Payslip.objects.filter(
+                payslip_number__in=[payslip.payslip_number for payslip, _ in computed]
+            ).values_list('payslip_number', flat=True))
+            for payslip, _ in computed:
+                if payslip.payslip_number in existing:
+                    summary['errors'].append((payslip.employee.employee_id, 'payslip already exists'))
+            computed = [item for item in computed if item[0].payslip_number not in existing]
+
+            if not computed:
+                continue
+            try:
+                PayrollEngine.write_chunk(computed)
+            except Exception as e:
+                logger.exception("Error writing payslips for payroll run %s", payroll_run.id)
+                summary['errors'].extend(
+                    (payslip.employee.employee_id, str(e)) for payslip, _ in computed
+                )
+                continue
+
+            summary['created'] += len(computed)
+            summary['total_amount'] += sum((payslip.net_salary for payslip, _ in computed), Decimal('0.00'))
+
+        return summary
+
+
+class _ZipStream:
+    """Write-only file object that hands zipfile output back in chunks"""
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class PayslipExportService:
+    """Content-addressed payslip PDF storage, rendered in bulk and streamed back as a ZIP"""
+
+    STORAGE_DIR = 'payslips'
+    # Below this many payslips starting worker processes costs more than it saves
+    POOL_THRESHOLD = 8
+    MAX_WORKERS = 4
+    READ_CHUNK = 64 * 1024
+
+    @staticmethod
+    def payslip_data(payslips):
+        """Plain, picklable render input for each payslip, in two queries"""
+        payslips = list(payslips.select_related('employee', 'payroll_run').order_by('employee__employee_id'))
+        components = defaultdict(lambda: {'earning': [], 'deduction': []})
+        for row in PayslipComponent.objects.filter(
+            payslip__in=payslips
+        ).select_related('component').order_by('id'):
+            components[row.payslip_id].setdefault(row.component_type, []).append(
+                (row.component.name, row.amount)
+            )
+
+        rows = []
+        for payslip in payslips:
+            employee = payslip.employee
+            run = payslip.payroll_run
+            rows.append({
+                'payslip_id': payslip.id,
+                'payslip_number': payslip.payslip_number,
+                'month': run.payroll_month if run else None,
+                'year': run.payroll_year if run else None,
+                'first_name': employee.first_name,
+                'last_name': employee.last_name,
+                'employee_code': employee.employee_id,
+                'date_of_joining': employee.date_of_joining,
+                'department': employee.department,
+                'designation': employee.designation,
+                'bank_name': employee.bank_name,
+                'account_number': employee.account_number,
+                'ifsc_code': employee.ifsc_code,
+                'uan': employee.uan,
+                'pf_number': employee.pf_number,
+                'esi_number': employee.esi_number,
+                'working_days': payslip.working_days,
+                'paid_days': payslip.paid_days,
+                'basic_salary': payslip.basic_salary,
+                'net_salary': payslip.net_salary,
+                'earnings': components[payslip.id]['earning'],
+                'deductions': components[payslip.id]['deduction'],
+            })
+        return rows
+
+    @staticmethod
+    def worker_count():
+        """CPUs this process may actually use (containers often pin fewer than cpu_count)"""
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = os.cpu_count() or 1
+        return min(cpus, PayslipExportService.MAX_WORKERS)
+
+    @staticmethod
+    def render(rows, workers=None):
+        """Yield (row, pdf bytes), spreading large batches over a process pool"""
+        workers = workers or PayslipExportService.worker_count()
+        if workers < 2 or len(rows) < PayslipExportService.POOL_THRESHOLD:
+            for row in rows:
+                yield row, render_payslip(row)
+            return
+
+        # spawn rather than fork: workers must not inherit the parent's DB connections.
+        # Each worker parses the font and logo once in its initializer.
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=load_assets,
+        ) as executor:
+            chunksize = max(1, len(rows) // (workers * 4))
+            yield from zip(rows, executor.map(render_payslip, rows, chunksize=chunksize))
+
+    @staticmethod
+    def digest(row):
+        """Content address of a payslip PDF: its render data plus the layout version"""
+        payload = json.dumps(row, sort_keys=True, default=str)
+        return hashlib.sha256(f"{LAYOUT_VERSION}:{payload}".encode()).hexdigest()
+
+    @staticmethod
+    def storage_path(digest):
+        return f"{PayslipExportService.STORAGE_DIR}/{digest[:2]}/{digest}.pdf"
+
+    @staticmethod
+    def store(rows, workers=None):
+        """
+        Make sure a stored PDF exists for every row; returns [(row, digest, storage path)].
+
+        PDFs are stored under the hash of what they render, so a changed
+        payslip, component, employee detail or LAYOUT_VERSION simply maps to
+        a new file and only those payslips are rendered again.
+        """
+        entries = []
+        missing = []
+        for row in rows:
+            digest = PayslipExportService.digest(row)
+            path = PayslipExportService.storage_path(digest)
+            entries.append((row, digest, path))
+            if not default_storage.exists(path):
+                missing.append((row, path))
+
+        rendered = PayslipExportService.render([row for row, _ in missing], workers)
+        for (_, path), (_, content) in zip(missing, rendered):
+            name = default_storage.save(path, ContentFile(content))
+            if name != path:
+                # A concurrent request stored the same content first
+                default_storage.delete(name)
+        return entries
+
+    @staticmethod
+    def archive_name(row):
+        return f"{row['employee_code']}_{payslip_filename(row)}"
+
+    @staticmethod
+    def generate(payroll_run, workers=None):
+        """Store every payslip PDF of the run; returns [(archive name, storage path)]"""
+        rows = PayslipExportService.payslip_data(Payslip.objects.filter(payroll_run=payroll_run))
+        return [
+            (PayslipExportService.archive_name(row), path)
+            for row, _, path in PayslipExportService.store(rows, workers)
+        ]
+
+    @staticmethod
+    def stream_zip(files):
+        """Yield a ZIP of the stored PDFs chunk by chunk, without building it in memory"""
+        stream = _ZipStream()
+        # PDFs are already compressed, so store them as-is
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+            for name, path in files:
+                with default_storage.open(path, 'rb') as source, archive.open(name, 'w') as entry:
+                    for chunk in iter(lambda: source.read(PayslipExportService.READ_CHUNK), b''):
+                        entry.write(chunk)
+                        yield stream.pop()
+                yield stream.pop()
+        yield stream.pop()
@@ -1,3 +1,194 @@
-from django.test import TestCase
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import make_aware
+
+from attendance.models import Attendance
+from hr.tests import make_employee
+from leave.models import Leave, LeaveType
+from leave.services import LeaveTypeRegistry
+from .models import SalaryComponent
+from .services import FormulaError, PayrollAttendanceService, SalaryFormulaEngine
+
+
+def component(pk, name, component_type='earning', calculation_type='formula', formula=None, **fields):
+    return SalaryComponent(
+        pk=pk, name=name, component_type=component_type,
+        calculation_type=calculation_type, formula=formula, **fields
+    )
+
+
+class SalaryFormulaEngineTests(SimpleTestCase):
+
+    def evaluate(self, expression, **variables):
+        evaluate, _ = SalaryFormulaEngine.compile_expression(expression)
+        columns = {name: [Decimal(value)] for name, value in variables.items()}
+        return evaluate(columns, 1)[0]
+
+    def test_arithmetic_and_functions(self):
+        self.assertEqual(self.evaluate('basic_salary * 0.4', basic_salary='30000'), Decimal('12000.0'))
+        self.assertEqual(self.evaluate('max(basic_salary, 15000) - 1000', basic_salary='12000'), Decimal('14000'))
+        self.assertEqual(self.evaluate('round(basic_salary / 3, 2)', basic_salary='100'), Decimal('33.33'))
+        self.assertEqual(self.evaluate('1800 if basic_salary > 15000 else 0', basic_salary='20000'), Decimal('1800'))
+
+    def test_comparisons_are_one_or_zero(self):
+        self.assertEqual(self.evaluate('(basic_salary > 1000) * 500', basic_salary='2000'), Decimal('500'))
+        self.assertEqual(self.evaluate('basic_salary > 1000 and lop_days', basic_salary='2000', lop_days='0'), Decimal('0'))
+
+    def test_division_by_zero_gives_no_amount(self):
+        self.assertIsNone(self.evaluate('basic_salary / working_days', basic_salary='30000', working_days='0'))
+
+    def test_guarded_division_by_zero(self):
+        evaluate, _ = SalaryFormulaEngine.compile_expression('basic_salary / days_present if days_present > 0 else 0')
+        columns = {'basic_salary': [Decimal('500'), Decimal('500')], 'days_present': [Decimal('0'), Decimal('20')]}
+        self.assertEqual(evaluate(columns, 2), [Decimal('0'), Decimal('25')])
+        # The guard itself failing still gives no amount
+        self.assertIsNone(self.evaluate('1 if basic_salary / days_present > 1 else 0', basic_salary='1', days_present='0'))
+
+    def test_rejects_unsafe_or_malformed_expressions(self):
+        for expression in ['__import__("os")', 'basic_salary.real', 'abs()', 'min(basic_salary)',
+                           'round(basic_salary, 1, 2)', 'min(*basic_salary)', 'basic_salary +']:
+            with self.subTest(expression=expression):
+                with self.assertRaises(FormulaError):
+                    SalaryFormulaEngine.compile_expression(expression)
+
+    def test_components_are_evaluated_in_dependency_order(self):
+        plan = SalaryFormulaEngine.compile([
+            component(1, 'Special Allowance', formula='hra / 2'),
+            component(2, 'HRA', formula='basic * 0.4'),
+            component(3, 'PF', component_type='deduction', calculation_type='percentage',
+                      value=Decimal('12'), percentage_of='Basic'),
+            component(4, 'Professional Tax', component_type='deduction', formula='200 if gross > 15000 else 0'),
+        ])
+        result = plan.evaluate([{'basic_salary': Decimal('10000')}])[0]
+        self.assertEqual(result['amounts'], {
+            1: Decimal('2000.00'), 2: Decimal('4000.00'), 3: Decimal('1200.00'), 4: Decimal('200.00'),
+        })
+        self.assertEqual(result['gross_earnings'], Decimal('16000.00'))
+        self.assertEqual(result['net_salary'], Decimal('14600.00'))
+        self.assertEqual(result['errors'], [])
+
+    def test_cycle_is_rejected(self):
+        with self.assertRaisesMessage(FormulaError, 'cycle'):
+            SalaryFormulaEngine.compile([
+                component(1, 'A', formula='b + 1'),
+                component(2, 'B', formula='a + 1'),
+            ])
+
+    def test_earnings_cannot_use_gross_salary(self):
+        with self.assertRaisesMessage(FormulaError, 'cycle'):
+            SalaryFormulaEngine.compile([component(1, 'Bonus', formula='gross * 0.1')])
+
+    def test_unknown_variable_is_rejected(self):
+        with self.assertRaisesMessage(FormulaError, "unknown variable 'bonus'"):
+            SalaryFormulaEngine.compile([component(1, 'HRA', formula='bonus * 2')])
+
+    def test_proration_scales_basic_and_fixed_earnings(self):
+        plan = SalaryFormulaEngine.compile([
+            component(1, 'Conveyance', calculation_type='fixed'),
+            component(2, 'HRA', formula='basic * 0.5'),
+            component(3, 'Day Rate', formula='per_day_salary'),
+            component(4, 'Loan', component_type='deduction', calculation_type='fixed'),
+        ])
+        result = plan.evaluate([{
+            'basic_salary': Decimal('26000'),
+            'fixed': {1: Decimal('1000'), 4: Decimal('500')},
+            'proration': Decimal('0.5'),
+        }])[0]
+        self.assertEqual(result['basic_salary'], Decimal('13000.00'))
+        self.assertEqual(result['amounts'], {
+            1: Decimal('500.00'), 2: Decimal('6500.00'), 3: Decimal('1000.00'), 4: Decimal('500.00'),
+        })
+        self.assertEqual(result['net_salary'], Decimal('20500.00'))
+
+    def test_validate(self):
+        with self.assertRaises(FormulaError):
+            SalaryFormulaEngine.validate(component(1, 'HRA', formula='missing * 2'), components=[])
+        # A division by zero is reported per employee instead of failing the save
+        SalaryFormulaEngine.validate(component(2, 'Bonus', formula='basic_salary / lop_days'), components=[])
+
+
+class PayrollAttendanceServiceTests(TestCase):
+    """March 2025 has 26 working days (Sundays off, no holidays in the test database)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.leave_type = LeaveType.objects.create(name='Casual Leave')
+
+    def setUp(self):
+        # Leave types created by an earlier test were rolled back
+        LeaveTypeRegistry.invalidate()
+
+    def employee(self, code, skip=(), **fields):
+        """An employee who worked a full day on every working day of March 2025 except skip"""
+        employee = make_employee(code, **fields)
+        day = max(date(2025, 3, 1), employee.date_of_joining)
+        while day <= date(2025, 3, 31):
+            if day.weekday() != 6 and day not in skip:
+                self.attend(employee, day, hours=9)
+            day += timedelta(days=1)
+        return employee
+
+    def attend(self, employee, day, hours=None):
+        check_in = make_aware(datetime(day.year, day.month, day.day, 9, 30))
+        Attendance.objects.update_or_create(employee=employee, date=day, defaults={
+            'check_in': check_in,
+            'check_out': check_in + timedelta(hours=hours) if hours is not None else None,
+        })
+
+    def leave(self, employee, start, end, **fields):
+        return Leave.objects.create(
+            employee=employee, leave_type=self.leave_type, colour='blue', start_date=start,
+            end_date=end, reason='test', status='approved', days_requested=1, **fields
+        )
+
+    def compute(self, employee):
+        return PayrollAttendanceService.compute([employee], 2025, 3)[employee.pk]
+
+    def test_full_month(self):
+        days = self.compute(self.employee('E1'))
+        self.assertEqual(days['working_days'], 26)
+        self.assertEqual(days['paid_days'], 26)
+        self.assertEqual(days['days_present'], 26)
+        self.assertEqual(days['absent_days'], 0)
+
+    def test_half_day_leave(self):
+        paid = self.employee('E1', skip={date(2025, 3, 3)})
+        self.leave(paid, date(2025, 3, 3), date(2025, 3, 3), is_half_day=True)
+        unpaid = self.employee('E2', skip={date(2025, 3, 3)})
+        self.leave(unpaid, date(2025, 3, 3), date(2025, 3, 3), is_half_day=True, is_unpaid=True)
+
+        days = self.compute(paid)
+        self.assertEqual((days['leave_days'], days['paid_days'], days['absent_days']), (Decimal('0.5'), 26, 0))
+        days = self.compute(unpaid)
+        self.assertEqual((days['unpaid_leave_days'], days['paid_days']), (Decimal('0.5'), Decimal('25.5')))
+
+    def test_short_days_are_loss_of_pay(self):
+        employee = self.employee('E1')
+        self.attend(employee, date(2025, 3, 3), hours=1)
+        self.attend(employee, date(2025, 3, 4), hours=3)
+        self.attend(employee, date(2025, 3, 5))
+        # A short day covered by approved leave is not LOP
+        self.attend(employee, date(2025, 3, 6), hours=1)
+        self.leave(employee, date(2025, 3, 6), date(2025, 3, 6))
+
+        days = self.compute(employee)
+        self.assertEqual(days['lop_days'], 2)
+        self.assertEqual(days['paid_days'], 24)
+        self.assertEqual(days['days_present'], 22)
+
+    def test_mid_month_joining(self):
+        days = self.compute(self.employee('E1', date_of_joining=date(2025, 3, 17)))
+        self.assertEqual(days['working_days'], 26)
+        self.assertEqual(days['paid_days'], 13)
+        self.assertEqual(days['absent_days'], 0)
+
+    def test_unexcused_absence(self):
+        employee = self.employee('E1', skip={date(2025, 3, 10), date(2025, 3, 11)})
+        self.leave(employee, date(2025, 3, 11), date(2025, 3, 11))
+
+        days = self.compute(employee)
+        self.assertEqual((days['absent_days'], days['paid_days']), (1, 25))
+        with override_settings(PAYROLL_DEDUCT_ABSENT_DAYS=False):
+            self.assertEqual(self.compute(employee)['paid_days'], 26)
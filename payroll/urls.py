@@ -21,6 +21,7 @@ urlpatterns = [
     path('payroll-runs/process/<int:run_id>/', views.process_payroll_run, name='process_payroll_run'),
     path('payroll-runs/view/<int:run_id>/', views.view_payroll_run, name='view_payroll_run'),
     path('payroll-runs/delete/<int:run_id>/', views.delete_payroll_run, name='delete_payroll_run'),
+    path('payroll-runs/payslips/<int:run_id>/', views.download_payroll_run_payslips, name='download_payroll_run_payslips'),
     
     # Payslips
     path('payslips/', views.payslips, name='payslips'),
@@ -1,16 +1,21 @@
-import os
+import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Q, Sum
 from django.utils import timezone
-from datetime import datetime, date
+from datetime import date
 from decimal import Decimal
+from hr.utils import get_current_employee
 from hr.models import Department, Employee
-from hrms import settings
 from leave.models import LeaveBalance
 from .models import SalaryComponent, EmployeeSalary, EmployeeSalaryComponent, PayrollRun, Payslip, PayslipComponent
-from django.http import HttpResponse
+from .pdf import month_name, payslip_filename
+from .services import FormulaError, PayrollEngine, PayslipExportService, SalaryFormulaEngine
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
 from django.template.loader import render_to_string
 from xhtml2pdf import pisa
 from reportlab.pdfgen import canvas
@@ -20,7 +25,12 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib import colors
 from reportlab.lib.units import inch
 import io
-from fpdf import FPDF
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Roles that see (and can bulk download) every employee's payslips
+PAYSLIP_ADMIN_ROLES = ['SUPER ADMIN', 'ACCOUNTS']
 
 # Salary Components Views
 def salary_components(request):
@@ -70,6 +80,7 @@ def add_salary_component(request):
                 percentage_of=percentage_of,
                 is_taxable=is_taxable
             )
+            SalaryFormulaEngine.validate(component)
             component.save()
             
             messages.success(request, f'Salary component "{name}" added successfully!')
@@ -100,6 +111,7 @@ def edit_salary_component(request, component_id):
             component.formula = request.POST.get('formula', '')
             component.percentage_of = request.POST.get('percentage_of', '')
             component.is_taxable = request.POST.get('is_taxable') == 'on'
+            SalaryFormulaEngine.validate(component)
             component.save()
             
             messages.success(request, f'Salary component "{component.name}" updated successfully!')
@@ -124,6 +136,14 @@ def delete_salary_component(request, component_id):
     
     if request.method == 'POST':
         component_name = component.name
+        try:
+            # Other formulas may refer to this component
+            SalaryFormulaEngine.compile(list(
+                SalaryComponent.objects.filter(is_active=True).exclude(pk=component.pk).order_by('id')
+            ))
+        except FormulaError as e:
+            messages.error(request, f'Cannot delete salary component "{component_name}": {e}')
+            return redirect('salary_components')
         component.delete()
         messages.success(request, f'Salary component "{component_name}" deleted successfully!')
     
@@ -135,6 +155,11 @@ def toggle_salary_component(request, component_id):
     
     component = get_object_or_404(SalaryComponent, id=component_id)
     component.is_active = not component.is_active
+    try:
+        SalaryFormulaEngine.validate(component)
+    except FormulaError as e:
+        messages.error(request, f'Cannot change salary component "{component.name}": {e}')
+        return redirect('salary_components')
     component.save()
     
     status = "activated" if component.is_active else "deactivated"
@@ -174,37 +199,39 @@ def add_employee_salary(request):
             
             employee = Employee.objects.get(id=employee_id)
             
-            # Deactivate old salary if exists
-            EmployeeSalary.objects.filter(employee=employee, is_active=True).update(is_active=False)
-            
-            # Create new salary
-            salary = EmployeeSalary(
-                employee=employee,
-                effective_date=effective_date,
-                basic_salary=basic_salary,
-                gross_salary=basic_salary,  # Will be calculated with components
-                net_salary=basic_salary,    # Will be calculated with components
-                is_active=True
-            )
-            salary.save()
-            
-            # Add salary components
-            for component in components:
-                amount_key = f'component_{component.id}'
-                amount = request.POST.get(amount_key)
-                if amount and Decimal(amount) > 0:
-                    salary_component = EmployeeSalaryComponent(
-                        employee_salary=salary,
-                        component=component,
-                        amount=Decimal(amount),
-                        created_by=request.session.get('user_name'),
+            # A formula error in the recalculation rolls the whole change back
+            with transaction.atomic():
+                # Deactivate old salary if exists
+                EmployeeSalary.objects.filter(employee=employee, is_active=True).update(is_active=False)
+
+                # Create new salary
+                salary = EmployeeSalary(
+                    employee=employee,
+                    effective_date=effective_date,
+                    basic_salary=basic_salary,
+                    gross_salary=basic_salary,  # Will be calculated with components
+                    net_salary=basic_salary,    # Will be calculated with components
+                    is_active=True
+                )
+                salary.save()
+
+                # Add salary components
+                for component in components:
+                    amount_key = f'component_{component.id}'
+                    amount = request.POST.get(amount_key)
+                    if amount and Decimal(amount) > 0:
+                        salary_component = EmployeeSalaryComponent(
+                            employee_salary=salary,
+                            component=component,
+                            amount=Decimal(amount),
+                            created_by=request.session.get('user_name'),
+
+                        )
+                        salary_component.save()
+
+                # Recalculate totals
+                salary = calculate_salary_totals(salary)
 
-                    )
-                    salary_component.save()
-            
-            # Recalculate totals
-            salary = calculate_salary_totals(salary)
-            
             messages.success(request, f'Salary structure created for {employee.first_name} {employee.last_name}!')
             return redirect('employee_salaries')
             
@@ -221,59 +248,70 @@ def add_employee_salary(request):
     return render(request, 'payroll/add_employee_salary.html', context)
 
 def calculate_salary_totals(salary):
-    """Calculate gross and net salary based on components"""
-    components = EmployeeSalaryComponent.objects.filter(employee_salary=salary).select_related('component')
-    
-    total_earnings = Decimal('0.00')
-    total_deductions = Decimal('0.00')
-    
-    for comp in components:
-        if comp.component.component_type == 'earning':
-            total_earnings += comp.amount
-        else:
-            total_deductions += comp.amount
-    
-    salary.gross_salary = salary.basic_salary + total_earnings
-    salary.net_salary = salary.gross_salary - total_deductions
+    """
+    Calculate the formula/percentage component amounts and the gross and
+    net salary of a salary structure
+    """
+    components = list(EmployeeSalaryComponent.objects.filter(employee_salary=salary))
+    unpaid_balance = PayrollEngine.unpaid_days([salary.employee_id], date.today().year).get(salary.employee_id)
+    plan = SalaryFormulaEngine.get_plan()
+    result = plan.evaluate([PayrollEngine.salary_variables(salary, components, unpaid_balance)])[0]
+    if result['errors']:
+        raise FormulaError(f"Could not evaluate {', '.join(result['errors'])}")
+    
+    # Store the computed amounts so the salary breakdown matches the totals
+    existing = {comp.component_id: comp for comp in components}
+    for component, _, _ in plan.steps:
+        if component is None or component.calculation_type not in ('formula', 'percentage'):
+            continue
+        amount = result['amounts'][component.pk]
+        comp = existing.get(component.pk)
+        if comp and amount:
+            if comp.amount != amount:
+                comp.amount = amount
+                comp.save(update_fields=['amount', 'updated_at'])
+        elif comp:
+            comp.delete()
+        elif amount:
+            EmployeeSalaryComponent.objects.create(employee_salary=salary, component=component, amount=amount)
+    
+    salary.gross_salary = result['gross_earnings']
+    salary.net_salary = result['net_salary']
     salary.save()
     
     return salary
 
 def calculate_salary_api(request):
-    """API endpoint for salary calculation"""
+    """
+    API endpoint for salary calculation: basic_salary, optional
+    unpaid_balance and components (JSON of component id -> amount for the
+    fixed components); formula and percentage components are computed
+    """
     if request.method == 'POST':
         try:
-            basic_salary = Decimal(request.POST.get('basic_salary', 0))
-            components_data = request.POST.get('components', '{}')
+            basic_salary = Decimal(request.POST.get('basic_salary', 0) or 0)
+            components_data = json.loads(request.POST.get('components', '{}') or '{}')
             
-            # This would be more complex in real implementation
-            # For now, return a simple calculation
-            hra = basic_salary * Decimal('0.40')  # 40% HRA
-            conveyance = Decimal('1600.00')
-            medical = Decimal('1250.00')
+            plan = SalaryFormulaEngine.get_plan()
+            result = plan.evaluate([PayrollEngine.variables(
+                basic_salary,
+                {int(component_id): amount for component_id, amount in components_data.items()},
+                request.POST.get('unpaid_balance')
+            )])[0]
             
-            total_earnings = hra + conveyance + medical
-            gross_salary = basic_salary + total_earnings
-            
-            # Deductions
-            pf = basic_salary * Decimal('0.12')  # 12% PF
-            professional_tax = Decimal('200.00')
-            total_deductions = pf + professional_tax
-            
-            net_salary = gross_salary - total_deductions
+            breakdown = {'basic_salary': float(basic_salary)}
+            for component, name, _ in plan.steps:
+                if component is not None:
+                    amount = result['amounts'][component.pk]
+                    breakdown[name] = float(amount) if amount is not None else None
             
             return JsonResponse({
-                'success': True,
-                'gross_salary': float(gross_salary),
-                'net_salary': float(net_salary),
-                'breakdown': {
-                    'basic_salary': float(basic_salary),
-                    'hra': float(hra),
-                    'conveyance': float(conveyance),
-                    'medical': float(medical),
-                    'pf': float(pf),
-                    'professional_tax': float(professional_tax)
-                }
+                'success': not result['errors'],
+                'gross_salary': float(result['gross_earnings']),
+                'net_salary': float(result['net_salary']),
+                'total_deductions': float(result['total_deductions']),
+                'breakdown': breakdown,
+                'errors': result['errors'],
             })
             
         except Exception as e:
@@ -435,71 +473,12 @@ def process_payroll_run(request, run_id):
             payroll_run.save()
             return redirect('view_payroll_run', run_id=run_id)
         
-        total_amount = Decimal('0.00')
-        payslips_created = 0
-        
-        for employee_id in selected_employee_ids:
-            try:
-                employee = Employee.objects.get(id=employee_id)
-                
-                # Get active salary for employee
-                salary = EmployeeSalary.objects.filter(
-                    employee=employee, 
-                    is_active=True
-                ).first()
-                
-                if not salary:
-                    continue
-                
-                # Generate payslip number
-                payslip_number = f"PS{payroll_run.payroll_year}{payroll_run.payroll_month:02d}{employee.employee_id}_{payroll_run.id}"
-                
-                # Check if payslip already exists (double check)
-                if Payslip.objects.filter(payslip_number=payslip_number).exists():
-                    continue
-                
-                # Calculate working days (you can customize this logic)
-                working_days = 22  # Default working days
-                paid_days = working_days  # Default paid days
-                leave_days = 0  # You can integrate with leave system here
-                
-                # Create payslip
-                payslip = Payslip(
-                    payroll_run=payroll_run,
-                    employee=employee,
-                    payslip_number=payslip_number,
-                    basic_salary=salary.basic_salary,
-                    gross_earnings=salary.gross_salary,
-                    total_deductions=salary.gross_salary - salary.net_salary,
-                    net_salary=salary.net_salary,
-                    working_days=working_days,
-                    paid_days=paid_days,
-                    leave_days=leave_days,
-                    status='generated'
-                )
-                payslip.save()
-                
-                # Create payslip components from salary components
-                salary_components = EmployeeSalaryComponent.objects.filter(employee_salary=salary)
-                for sc in salary_components:
-                    payslip_component = PayslipComponent(
-                        payslip=payslip,
-                        component=sc.component,
-                        component_type=sc.component.component_type,
-                        amount=sc.amount
-                    )
-                    payslip_component.save()
-                
-                total_amount += salary.net_salary
-                payslips_created += 1
-                
-            except Exception as e:
-                print(f"Error processing employee {employee_id}: {str(e)}")
-                continue
+        summary = PayrollEngine.run(payroll_run, selected_employee_ids)
+        payslips_created = summary['created']
         
         # Update payroll run totals
         payroll_run.total_employees = payslips_created
-        payroll_run.total_amount = total_amount
+        payroll_run.total_amount = summary['total_amount']
         payroll_run.status = 'completed'
         payroll_run.save()
         
@@ -509,6 +488,13 @@ def process_payroll_run(request, run_id):
         
         messages.success(request, f'Payroll run processed successfully! Generated {payslips_created} payslips.')
         
+        errors = summary['errors']
+        if errors:
+            details = "; ".join(f"{employee_id}: {reason}" for employee_id, reason in errors[:5])
+            if len(errors) > 5:
+                details += f"; and {len(errors) - 5} more"
+            messages.warning(request, f"⚠ {len(errors)} employee(s) skipped – {details}")
+        
     except Exception as e:
         payroll_run.status = 'draft'
         payroll_run.save()
@@ -536,6 +522,7 @@ def view_payroll_run(request, run_id):
         'payroll_run': payroll_run,
         'payslips': payslips,
         'selected_employees': selected_employees,
+        'can_download_all': request.session.get('user_role') in PAYSLIP_ADMIN_ROLES,
         'user_name': request.session.get('user_name'),
         'user_role': request.session.get('user_role'),
         'today_date': date.today(),
@@ -567,12 +554,11 @@ def payslips(request):
         return redirect('login')
     
     user_role = request.session.get('user_role')
-    user_email = request.session.get('user_email')
     
     # Filter payslips based on user role
-    if user_role not in ['SUPER ADMIN','ACCOUNTS']:
+    if user_role not in PAYSLIP_ADMIN_ROLES:
         try:
-            employee = Employee.objects.get(email=user_email)
+            employee = get_current_employee(request)
             payslips_list = Payslip.objects.filter(employee=employee).select_related('payroll_run').order_by('-generated_at')
             # Get total salary for the employee
             total_salary = payslips_list.aggregate(total=Sum('net_salary'))['total'] or 0
@@ -800,314 +786,61 @@ def generate_payslip_pdf(payslip):
 
 
 
-def number_to_words(number):
-    """Convert number to words (basic implementation)"""
-    try:
-        num = float(number)
-        if num == 0:
-            return "Zero rupees only"
-        
-        # Basic implementation - you can enhance this
-        units = ["", "One", "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine"]
-        teens = ["Ten", "Eleven", "Twelve", "Thirteen", "Fourteen", "Fifteen", "Sixteen", "Seventeen", "Eighteen", "Nineteen"]
-        tens = ["", "", "Twenty", "Thirty", "Forty", "Fifty", "Sixty", "Seventy", "Eighty", "Ninety"]
-        
-        def convert_below_100(n):
-            if n < 10:
-                return units[n]
-            elif n < 20:
-                return teens[n-10]
-            else:
-                return tens[n//10] + (" " + units[n%10] if n%10 != 0 else "")
-        
-        def convert_below_1000(n):
-            if n < 100:
-                return convert_below_100(n)
-            else:
-                return units[n//100] + " Hundred" + (" " + convert_below_100(n%100) if n%100 != 0 else "")
-        
-        # For simplicity, handling up to 99,999
-        if num <= 99999:
-            if num < 1000:
-                words = convert_below_1000(int(num))
-            else:
-                words = convert_below_1000(int(num)//1000) + " Thousand"
-                if num % 1000 != 0:
-                    words += " " + convert_below_1000(int(num)%1000)
-            
-            return words + " rupees only"
-        else:
-            return f"{num:,.2f} rupees only"
-            
-    except:
-        return f"{number} rupees only"
-
-
-class PayslipPDF(FPDF):
-    def __init__(self, month_name="", year=""):
-        super().__init__()
-        self.month_name = month_name
-        self.year = year
-        # ✅ Use Unicode-supported DejaVuSans font
-        font_path = os.path.join(settings.BASE_DIR, "static", "fonts", "DejaVuSans.ttf")
-        self.add_font("DejaVu", "", font_path, uni=True)
-        self.add_font("DejaVu", "B", font_path, uni=True)
-        self.add_font("DejaVu", "I", font_path, uni=True)
-        self.set_auto_page_break(auto=True, margin=15)
-
-    def header(self):
-        # ✅ Company Logo + Header
-        logo_path = os.path.join(settings.BASE_DIR, "static", "img", "ikontellogot.png")
-        try:
-            self.image(logo_path, 155, 12, 45)
-        except:
-            pass
-
-        self.set_font("DejaVu", "B", 16)
-        self.cell(
-            0,
-            10,
-            f"PAYSLIP - {self.month_name.upper()} {self.year}",
-            ln=True,
-            align="L",
-        )
-
-        self.set_font("DejaVu", "", 9)
-        self.multi_cell(
-            0,
-            5,
-            "\nIKONTEL SOLUTIONS PVT LTD\n\n"
-            "NO.72, 73 & 74, 1ST FLOOR AMRBP BUILDING, MARGOSA ROAD, 17TH CROSS RD,"
-            "\nMALLESWARAM"
-            "\nBENGALURU, KARNATAKA | IKONTEL SOLUTIONS PVT LTD",
-            align="L",
-        )
-        # self.ln(3)
-        # self.set_draw_color(0, 0, 0)
-        # self.set_line_width(0.4)
-        # self.line(10, self.get_y(), 200, self.get_y())
-        self.ln(5)
-
-    def section_box(self, title):
-        self.set_font("DejaVu", "B", 11)
-        self.set_fill_color(240, 240, 240)
-        self.cell(0, 8, f" {title}", ln=True, fill=True)
-        self.ln(2)
-
-    def cell_pair(self, label, value, w=45):
-        """Label-value pair (no borders)"""
-        self.set_font("DejaVu", "", 9)
-        self.cell(w, 7, f"{label}:", align="L")
-        self.cell(w + 25, 7, f"{value}", align="L")
-
-    def salary_table(self, title, data, total_label, payslip=None):
-        """
-        Salary components (no borders)
-        - For EARNINGS: includes Basic Salary (from payslip.basic_salary) + earning components
-        - For DEDUCTIONS: includes only deduction components
-        """
-        self.section_box(title)
-        self.set_font("DejaVu", "B", 9)
-        self.cell(100, 8, "Component", align="L")
-        self.cell(50, 8, "Amount (₹)", align="R", ln=True)
-
-        self.set_font("DejaVu", "", 9)
-
-        total = 0.0
-
-        # Show Basic Salary only in EARNINGS table
-        if (
-            payslip
-            and hasattr(payslip, "basic_salary")
-            and title.strip().upper() == "EARNINGS"
-        ):
-            basic_salary = float(payslip.basic_salary or 0)
-            self.cell(100, 7, "Basic Salary", align="L")
-            self.cell(50, 7, f"{basic_salary:,.2f}", align="R", ln=True)
-            total += basic_salary
-
-        # Show all components
-        for comp in data:
-            comp_name = comp.component.name
-            comp_amount = float(comp.amount or 0)
-            self.cell(100, 7, comp_name, align="L")
-            self.cell(50, 7, f"{comp_amount:,.2f}", align="R", ln=True)
-            total += comp_amount
-
-        # Total row
-        self.set_font("DejaVu", "B", 9)
-        self.cell(100, 8, total_label, align="L")
-        self.cell(50, 8, f"{total:,.2f}", align="R", ln=True)
-        self.ln(4)
-        
-        
 def download_payslip(request, payslip_id):
     try:
-        # Fetch Payslip Data
-        payslip = Payslip.objects.select_related("employee", "payroll_run").get(
-            id=payslip_id
-        )
-        all_components = PayslipComponent.objects.filter(
-            payslip=payslip
-        ).select_related("component")
-
-        earnings = all_components.filter(component_type="earning")
-        deductions = all_components.filter(component_type="deduction")
-
-        # If you still want totals in Python (for logging/debug, not used in PDF now)
-        total_earn = sum(float(c.amount) for c in earnings)
-        total_deduct = sum(float(c.amount) for c in deductions)
-        
-        # ---- Month & Year (SINGLE SOURCE) ----
-        if payslip.payroll_run and payslip.payroll_run.payroll_month:
-            month_name = datetime(
-                1900, int(payslip.payroll_run.payroll_month), 1
-            ).strftime("%B")
-        else:
-            month_name = "Month"
-
-        year = (
-            payslip.payroll_run.payroll_year
-            if payslip.payroll_run and payslip.payroll_run.payroll_year
-            else "Year"
-        )
-
-        # ---- PDF ----
-        pdf = PayslipPDF(month_name=month_name, year=year)
-        pdf.add_page()
-
-        # Employee Info
-        pdf.set_font("DejaVu", "B", 10)
-        pdf.cell(
-            0,
-            7,
-            f"{payslip.employee.first_name} {payslip.employee.last_name}",
-            ln=True,
-        )
-
-        pdf.set_draw_color(0, 0, 0)
-        pdf.set_line_width(0.4)
-        pdf.line(10, pdf.get_y() + 2, 200, pdf.get_y() + 2)
-        pdf.ln(5)
-
-        pdf.set_font("DejaVu", "", 9)
-
-        def add_row(labels_values):
-            col_width = 47
-            for label, value in labels_values:
-                pdf.set_font("DejaVu", "B", 9)
-                pdf.cell(col_width, 6, label, border=0)
-            pdf.ln(5)
-            for label, value in labels_values:
-                pdf.set_font("DejaVu", "", 9)
-                pdf.cell(col_width, 6, str(value), border=0)
-            pdf.ln(8)
-
-        add_row(
-            [
-                ("Employee Code", payslip.employee.employee_id),
-                (
-                    "Date Joined",
-                    payslip.employee.date_of_joining.strftime("%d %b %Y"),
-                ),
-                ("Department", payslip.employee.department or "N/A"),
-                ("Designation", payslip.employee.designation or "N/A"),
-            ]
-        )
-
-        add_row(
-            [
-                ("Bank", payslip.employee.bank_name or "N/A"),
-                ("Bank Account", payslip.employee.account_number or "N/A"),
-                ("Bank IFSC", payslip.employee.ifsc_code or "N/A"),
-                ("Payment Mode", "Bank Transfer"),
-            ]
-        )
-
-        add_row(
-            [
-                ("UAN", payslip.employee.uan if hasattr(payslip.employee, "uan") else "N/A"),
-                ("PF Number", payslip.employee.pf_number if hasattr(payslip.employee, "pf_number") else "N/A"),
-                ("ESI Number", payslip.employee.esi_number if hasattr(payslip.employee, "esi_number") else "N/A"),
-                ("", ""),
-            ]
-        )
-
-        pdf.ln(3)
-
-        # Salary Details
-        pdf.cell(0, 7, "Salary Details", ln=True)
-
-        pdf.set_draw_color(0, 0, 0)
-        pdf.set_line_width(0.4)
-        pdf.line(10, pdf.get_y() + 2, 200, pdf.get_y() + 2)
-        pdf.ln(5)
-
-        pdf.set_font("DejaVu", "B", 9)
-        pdf.cell(47.5, 6, "Total Working Days", border=0)
-        pdf.cell(47.5, 6, "Paid Days", border=0)
-        pdf.cell(47.5, 6, "Loss of Pay", border=0)
-        pdf.cell(47.5, 6, "Total Payable Days", border=0)
-        pdf.ln(6)
-
-        pdf.set_font("DejaVu", "", 9)
-        pdf.cell(47.5, 6, str(payslip.working_days), border=0)
-        pdf.cell(47.5, 6, str(payslip.paid_days), border=0)
-        pdf.cell(47.5, 6, str(payslip.leave_days), border=0)
-        pdf.cell(47.5, 6, str(payslip.paid_days - payslip.leave_days), border=0)
-        pdf.ln(10)
-
-        # Tables (FIXED: totals are not doubled now)
-        pdf.salary_table("EARNINGS", earnings, "Total Earnings (A)", payslip=payslip)
-        pdf.salary_table("DEDUCTIONS", deductions, "Total Deductions (B)")
+        rows = PayslipExportService.payslip_data(Payslip.objects.filter(id=payslip_id))
+        if not rows:
+            raise Payslip.DoesNotExist
+
+        # Served from storage; the content address doubles as the ETag so
+        # repeat downloads are answered with a 304
+        row, digest, path = PayslipExportService.store(rows)[0]
+        etag = f'"{digest}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = FileResponse(
+                default_storage.open(path, "rb"),
+                as_attachment=True,
+                filename=payslip_filename(row),
+                content_type="application/pdf",
+            )
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
 
-        # Summary
-        net_salary = payslip.net_salary
-        net_words = number_to_words(net_salary)
-        pdf.section_box("SUMMARY")
-        pdf.cell(100, 8, "Net Salary Payable (A - B)", align="L")
-        pdf.cell(50, 8, f"₹{net_salary:.2f}", align="R", ln=True)
-        pdf.ln(4)
-        pdf.multi_cell(0, 7, f"Net Salary (in words): {net_words}", align="L")
-        pdf.ln(5)
-        pdf.set_font("DejaVu", "I", 8)
-        pdf.multi_cell(
-            0, 6, "*Note: All amounts displayed in this payslip are in INR."
-        )
+        return response
 
-        pdf_buffer = io.BytesIO()
-        pdf.output(pdf_buffer)
-        pdf_buffer.seek(0)
+    except Payslip.DoesNotExist:
+        return HttpResponse("Payslip not found.")
+    except Exception as e:
+        return HttpResponse(f"Error generating PDF: {e}")
 
-        response = HttpResponse(pdf_buffer, content_type="application/pdf")
 
-        if payslip.payroll_run and payslip.payroll_run.payroll_month:
-            month_number = int(payslip.payroll_run.payroll_month)
-            month_name = datetime(1900, month_number, 1).strftime("%B")
-        else:
-            month_name = "Month"
+def download_payroll_run_payslips(request, run_id):
+    """Render every payslip of a run to storage and stream them back as one ZIP"""
+    if not request.session.get('user_authenticated'):
+        return redirect('login')
 
-        year_value = (
-            payslip.payroll_run.payroll_year
-            if payslip.payroll_run and payslip.payroll_run.payroll_year
-            else "Year"
-        )
+    if request.session.get('user_role') not in PAYSLIP_ADMIN_ROLES:
+        messages.error(request, 'You can only download your own payslips.')
+        return redirect('access_denied')
 
-        employee_name = (
-            f"{payslip.employee.first_name}_{payslip.employee.last_name}".replace(
-                " ", "_"
-            )
-        )
-        filename = f"Payslip_{employee_name}_{month_name}_{year_value}.pdf"
+    payroll_run = get_object_or_404(PayrollRun, id=run_id)
 
-        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    try:
+        files = PayslipExportService.generate(payroll_run)
+    except Exception as e:
+        logger.exception("Error generating payslip PDFs for payroll run %s", payroll_run.id)
+        messages.error(request, f'Error generating payslip PDFs: {str(e)}')
+        return redirect('view_payroll_run', run_id=run_id)
 
-        return response
+    if not files:
+        messages.warning(request, 'This payroll run has no payslips to download.')
+        return redirect('view_payroll_run', run_id=run_id)
 
-    except Payslip.DoesNotExist:
-        return HttpResponse("Payslip not found.")
-    except Exception as e:
-        return HttpResponse(f"Error generating PDF: {e}")
+    response = StreamingHttpResponse(PayslipExportService.stream_zip(files), content_type='application/zip')
+    filename = f"Payslips_{month_name(payroll_run.payroll_month)}_{payroll_run.payroll_year}.zip"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 
 def view_employee_salary(request, salary_id):
@@ -1132,33 +865,35 @@ def edit_employee_salary(request, salary_id):
     
     if request.method == 'POST':
         try:
-            salary.effective_date = request.POST.get('effective_date')
-            salary.basic_salary = Decimal(request.POST.get('basic_salary', 0))
-            salary.save()
-            
-            # Update components
-            for component in components:
-                amount_key = f'component_{component.id}'
-                amount = request.POST.get(amount_key, 0) or 0
-                
-                existing_component = existing_components.filter(component=component).first()
-                if existing_component:
-                    if Decimal(amount) > 0:
-                        existing_component.amount = Decimal(amount)
-                        existing_component.save()
-                    else:
-                        existing_component.delete()
-                elif Decimal(amount) > 0:
-                    EmployeeSalaryComponent(
-                        employee_salary=salary,
-                        component=component,
-                        amount=Decimal(amount),
-                        updated_by=request.session.get('user_name')
-                    ).save()
-            
-            # Recalculate totals
-            salary = calculate_salary_totals(salary)
-            
+            # A formula error in the recalculation rolls the whole change back
+            with transaction.atomic():
+                salary.effective_date = request.POST.get('effective_date')
+                salary.basic_salary = Decimal(request.POST.get('basic_salary', 0))
+                salary.save()
+
+                # Update components
+                for component in components:
+                    amount_key = f'component_{component.id}'
+                    amount = request.POST.get(amount_key, 0) or 0
+
+                    existing_component = existing_components.filter(component=component).first()
+                    if existing_component:
+                        if Decimal(amount) > 0:
+                            existing_component.amount = Decimal(amount)
+                            existing_component.save()
+                        else:
+                            existing_component.delete()
+                    elif Decimal(amount) > 0:
+                        EmployeeSalaryComponent(
+                            employee_salary=salary,
+                            component=component,
+                            amount=Decimal(amount),
+                            updated_by=request.session.get('user_name')
+                        ).save()
+
+                # Recalculate totals
+                salary = calculate_salary_totals(salary)
+
             messages.success(request, 'Salary structure updated successfully!')
             return redirect('employee_salaries')
             
@@ -9,6 +9,8 @@ from django.db.models import Q
 from datetime import date, timedelta, datetime
 from django.utils import timezone
 from .models import ExitInterview, NoDueCertificate, Resignation, ResignationChecklist, ResignationDocument
+from hr.utils import get_current_employee
+from hr.services import HierarchyService
 from hr.models import Employee
 from django.template.loader import render_to_string
 from xhtml2pdf import pisa
@@ -55,7 +57,6 @@ def resignation_dashboard(request):
         return redirect('login')
     
     user_role = request.session.get('user_role')
-    user_email = request.session.get('user_email')
     
     # Statistics
     total_resignations = Resignation.objects.filter(status__in=['applied', 'accepted']).count()
@@ -69,14 +70,11 @@ def resignation_dashboard(request):
     
     if user_role in ["MANAGER", "TL"]:
         try:
-            current_user_emp = Employee.objects.get(email=user_email)
+            current_user_emp = get_current_employee(request)
             print(f"Current user: {current_user_emp.first_name} {current_user_emp.last_name}")
             
             # Check how many team members report to this manager
-            team_members = Employee.objects.filter(
-                Q(reporting_manager_id=current_user_emp.id) |
-                Q(reporting_manager__icontains=current_user_emp.first_name)
-            )
+            team_members = HierarchyService.team_of(current_user_emp, depth=1)
             print(f"Team members count: {team_members.count()}")
             
             # CORRECTED: Use __in to filter by list of employee IDs
@@ -92,7 +90,7 @@ def resignation_dashboard(request):
     else:
         # For non-manager roles, exclude current user's resignation
         try:
-            current_user_emp = Employee.objects.get(email=user_email)
+            current_user_emp = get_current_employee(request)
             recent_resignations = Resignation.objects.exclude(
                 employee=current_user_emp
             ).select_related('employee').order_by('-created_at')[:10]
@@ -103,7 +101,7 @@ def resignation_dashboard(request):
     my_resignation = None
     if user_role != 'SUPER ADMIN':
         try:
-            employee = Employee.objects.get(email=user_email)
+            employee = get_current_employee(request)
             # my_resignation = Resignation.objects.filter(employee=employee).first()
             my_resignation = Resignation.objects.filter(employee=employee).order_by('-created_at')
         except Employee.DoesNotExist:
@@ -128,7 +126,7 @@ def submit_resignation(request):
     
     # Check if user already has an active resignation
     try:
-        employee = Employee.objects.get(email=request.session.get('user_email'))
+        employee = get_current_employee(request)
         
         # Check for existing resignations
         existing_resignations = Resignation.objects.filter(employee=employee)
@@ -162,7 +160,7 @@ def submit_resignation(request):
     
     if request.method == 'POST':
         try:
-            employee = Employee.objects.get(email=request.session.get('user_email'))
+            employee = get_current_employee(request)
             resignation_date = request.POST.get('resignation_date')
             reason = html.escape(request.POST.get('reason', ''))
             
@@ -235,7 +233,7 @@ def submit_resignation(request):
     
     # GET request - show form
     try:
-        employee = Employee.objects.get(email=request.session.get('user_email'))
+        employee = get_current_employee(request)
         employee_notice_period = getattr(employee, 'notice_period_days', 60)
         if employee_notice_period is None:
             employee_notice_period = 60
@@ -283,13 +281,12 @@ def all_resignations(request):
         return redirect('login')
     
     user_role = request.session.get('user_role')
-    user_email = request.session.get('user_email')
     
     # Base queryset - apply role-based filtering
     if user_role in ['ADMIN', 'HR', 'SUPER ADMIN']:
         # Super users can see all resignations except their own
         try:
-            current_user_emp = Employee.objects.get(email=user_email)
+            current_user_emp = get_current_employee(request)
             resignations = Resignation.objects.select_related('employee', 'applied_to', 'approved_by').exclude(employee=current_user_emp)
         except Employee.DoesNotExist:
             resignations = Resignation.objects.select_related('employee', 'applied_to', 'approved_by').all()
@@ -297,14 +294,11 @@ def all_resignations(request):
     elif user_role in ['MANAGER', 'TL']:
         # Managers/TLs can only see their team members' resignations (excluding their own)
         try:
-            current_user_emp = Employee.objects.get(email=user_email)
+            current_user_emp = get_current_employee(request)
             print(f"Current user: {current_user_emp.first_name} {current_user_emp.last_name}")
             
             # Check how many team members report to this manager
-            team_members = Employee.objects.filter(
-                Q(reporting_manager_id=current_user_emp.id) |
-                Q(reporting_manager__icontains=current_user_emp.first_name)
-            )
+            team_members = HierarchyService.team_of(current_user_emp, depth=1)
             print(f"Team members count: {team_members.count()}")
             
             # Filter resignations to only team members, excluding own resignation
@@ -321,13 +315,13 @@ def all_resignations(request):
     elif user_role == 'BRANCH MANAGER':
         # Branch Managers can see resignations from their location
         try:
-            current_user_emp = Employee.objects.get(email=user_email)
+            current_user_emp = get_current_employee(request)
             branch_manager_location = current_user_emp.location
             
             if branch_manager_location:
                 # Get all employees from the same location
                 location_employees = Employee.objects.filter(
-                    location__iexact=branch_manager_location
+                    current_user_emp.branch_lookup()
                 )
                 print(f"Branch Manager Location: {branch_manager_location}")
                 print(f"Employees in location: {location_employees.count()}")
@@ -349,7 +343,7 @@ def all_resignations(request):
     else:
         # Regular employees can only see their own resignations
         try:
-            employee = Employee.objects.get(email=user_email)
+            employee = get_current_employee(request)
             resignations = Resignation.objects.filter(employee=employee).select_related('employee', 'applied_to', 'approved_by')
         except Employee.DoesNotExist:
             resignations = Resignation.objects.none()
@@ -396,7 +390,7 @@ def my_resignation(request):
         return redirect('login')
     
     try:
-        employee = Employee.objects.get(email=request.session.get('user_email'))
+        employee = get_current_employee(request)
         # Get ALL resignations for this employee, ordered by most recent first
         resignations = Resignation.objects.filter(employee=employee).order_by('-created_at')
         
@@ -499,7 +493,6 @@ def approve_resignation(request, resignation_id):
     
     resignation = get_object_or_404(Resignation, id=resignation_id)
     user_role = request.session.get('user_role')
-    user_email = request.session.get('user_email')
     
     # Check permissions - only HR/Admin/Manager can approve
     if user_role not in ['ADMIN', 'HR', 'SUPER ADMIN']:
@@ -508,7 +501,7 @@ def approve_resignation(request, resignation_id):
     
     # Verify approver employee exists
     try:
-        approver = Employee.objects.get(email=user_email)
+        approver = get_current_employee(request)
     except Employee.DoesNotExist:
         messages.error(request, 'Your employee profile was not found. Please contact HR.')
         return redirect('resignation:resignation_detail', resignation_id=resignation_id)
@@ -660,7 +653,7 @@ def resignation_history(request):
         return redirect('login')
     
     try:
-        employee = Employee.objects.get(email=request.session.get('user_email'))
+        employee = get_current_employee(request)
         resignations = Resignation.objects.filter(employee=employee).order_by('-created_at')
         active_notice = resignations.filter(status__in=['applied', 'under_review', 'accepted']
 ).count()
@@ -735,7 +728,7 @@ def no_due_certificate(request, resignation_id):
                 signature_data = request.POST.get('hr_signature_data')
                 if signature_data:
                     try:
-                        hr_employee = Employee.objects.get(email=request.session.get('user_email'))
+                        hr_employee = get_current_employee(request)
                         no_due_cert.hr_signature = signature_data
                         no_due_cert.hr_signed_at = timezone.now()
                         no_due_cert.hr_approved_by = hr_employee
@@ -1164,7 +1157,7 @@ def exit_interview(request, resignation_id):
             if request.session.get('user_role') in ['HR', 'ADMIN', 'SUPER ADMIN']:
                 exit_interview_obj.interview_date = date.today()
                 try:
-                    exit_interview_obj.conducted_by = Employee.objects.get(email=request.session.get('user_email'))
+                    exit_interview_obj.conducted_by = get_current_employee(request)
                 except Employee.DoesNotExist:
                     pass
             
@@ -1397,7 +1390,7 @@ def upload_document(request, resignation_id):
     
     # Get current employee
     try:
-        employee = Employee.objects.get(email=user_email)
+        employee = get_current_employee(request)
     except Employee.DoesNotExist:
         messages.error(request, 'Employee profile not found.')
         return redirect('resignation:dashboard')